@@ -3,6 +3,11 @@ ASGI config for django_project project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+/api/live 的即時推播（Server-Sent Events）只在以 ASGI 執行時提供（見 myapp/live.py），例如：
+    uvicorn django_project.asgi:application --host 0.0.0.0 --port 8000
+uvicorn 已列在 pyproject.toml 的相依套件中。python manage.py runserver 走的是 WSGI，
+不經過這個檔案，/api/live 會回應 404；其餘的頁面與 API 兩種方式都能使用。
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -13,4 +18,14 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_project.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from myapp.live import live_app  # noqa: E402（需要先完成 Django 設定）
+
+
+async def application(scope, receive, send):
+    # 即時推播直接交給 live_app，其餘請求照常由 Django 處理
+    if scope["type"] == "http" and scope["path"] == "/api/live":
+        await live_app(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
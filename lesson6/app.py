@@ -1,13 +1,27 @@
 import streamlit as st
-import paho.mqtt.client as mqtt
 import json
 import pandas as pd
-import threading
 import time
-import random
 from datetime import datetime
-from collections import deque
-from queue import Queue
+from urllib.parse import urlsplit
+
+# MQTT 設定（與 ingest.py 共用）
+from mqtt_config import (
+    MQTT_BROKER,
+    MQTT_PORT,
+    MQTT_TOPIC_LIGHT,
+    MQTT_TOPIC_TEMP,
+    MQTT_TOPIC_HUMIDITY,
+    MQTT_TOPIC,
+)
+from ingest import IngestService
+from timeseries import ALIGN_BUCKET_NS, asof_join, to_frame
+from history_store import HISTORY_DB_PATH, ROLLUP_LEVELS, HistoryStore
+from export import EXPORT_FORMATS, EXPORT_PORT, ExportServer, fahrenheit
+from fleet import ALARM_STATES, FLEET_HISTORY_CAPACITY, STALE_AFTER_S, SUMMARY_SERIES, overview_frame
+from message_queue import POLICIES
+from publisher import Publisher, reading_messages
+from simulator import ENCODINGS, FleetSimulator
 
 # 頁面設定
 st.set_page_config(
@@ -16,266 +30,87 @@ st.set_page_config(
     layout="wide"
 )
 
-# MQTT 設定
-MQTT_BROKER = "localhost"
-MQTT_PORT = 1883
-MQTT_TOPIC_LIGHT = "home/light/status"
-MQTT_TOPIC_TEMP = "home/livingroom/temperature"
-MQTT_TOPIC_HUMIDITY = "home/livingroom/humidity"
-MQTT_TOPIC = "testtopic"  # 測試主題
+REFRESH_INTERVAL = 1  # 自動重新整理時檢查新數據的間隔（秒）
+TIME_BOUNDS_TTL = 10  # 歷史資料庫時間範圍的快取時間（秒），所有 session 共用
 
 # 初始化 session state
-if 'mqtt_client' not in st.session_state:
-    st.session_state.mqtt_client = None
-if 'mqtt_connected' not in st.session_state:
-    st.session_state.mqtt_connected = False
-if 'light_status' not in st.session_state:
-    st.session_state.light_status = "未知"
-if 'temperature' not in st.session_state:
-    st.session_state.temperature = None
-if 'humidity' not in st.session_state:
-    st.session_state.humidity = None
-if 'data_history' not in st.session_state:
-    st.session_state.data_history = deque(maxlen=1000)  # 儲存最多 1000 筆數據
-if 'mqtt_thread' not in st.session_state:
-    st.session_state.mqtt_thread = None
 if 'publisher_client' not in st.session_state:
     st.session_state.publisher_client = None
 if 'publisher_connected' not in st.session_state:
     st.session_state.publisher_connected = False
 if 'auto_publish' not in st.session_state:
     st.session_state.auto_publish = False
-if 'auto_publish_stop_event' not in st.session_state:
-    st.session_state.auto_publish_stop_event = threading.Event()
-if 'publish_thread' not in st.session_state:
-
-    st.session_state.publish_thread = None
-if 'testtopic_messages' not in st.session_state:
-    st.session_state.testtopic_messages = deque(maxlen=100)  # 儲存 testtopic 訊息
-if 'message_queue' not in st.session_state:
-    st.session_state.message_queue = Queue()  # 線程安全的消息隊列
+if 'simulator' not in st.session_state:
+    st.session_state.simulator = None  # 自動發送的多裝置模擬器（見 simulator.py）
 if 'temp_unit' not in st.session_state:
     st.session_state.temp_unit = "攝氏 (°C)"
+if 'stamp_payloads' not in st.session_state:
+    st.session_state.stamp_payloads = True  # 在數據中附上送出時間與序號（延遲量測用）
+# 發佈器的連線可能在背景中斷，每次執行時以實際狀態為準
+if st.session_state.publisher_client is not None:
+    st.session_state.publisher_connected = st.session_state.publisher_client.is_connected()
 
 
-# MQTT 回調函數（在背景線程中執行，使用隊列避免直接訪問 session_state）
-def on_connect(client, userdata, flags, reason_code, properties):
-    # 處理 reason_code（可能是整數或 ReasonCode 對象）
-    rc_value = reason_code.value if hasattr(reason_code, 'value') else int(reason_code)
-    
-    # 使用事件來通知連接狀態（線程安全）
-    if rc_value == 0:
-        # 訂閱所有主題（參考 lesson6_2.ipynb 的訂閱模式）
-        client.subscribe(MQTT_TOPIC_LIGHT, qos=1)
-        client.subscribe(MQTT_TOPIC_TEMP, qos=1)
-        client.subscribe(MQTT_TOPIC_HUMIDITY, qos=1)
-        client.subscribe(MQTT_TOPIC, qos=1)  # 訂閱測試主題
-        print(f"✓ 已連接到 MQTT Broker 並訂閱主題")
-        mqtt_connect_event.set()  # 通知連接成功
-    else:
-        error_messages = {
-            1: "協議版本不正確",
-            2: "客戶端 ID 無效",
-            3: "伺服器不可用",
-            4: "使用者名稱或密碼錯誤",
-            5: "未授權"
-        }
-        error_msg = error_messages.get(rc_value, f"未知錯誤 (代碼: {rc_value})")
-        print(f"✗ 連接失敗: {error_msg}")
-        mqtt_connect_event.set()  # 通知連接失敗
-
-def on_message(client, userdata, message):
-    """MQTT 訊息回調（在背景線程中執行，使用隊列傳遞數據）"""
-    topic = message.topic
-    payload = message.payload.decode('utf-8')
-    timestamp = datetime.now()
-    
+@st.cache_resource
+def get_ingest_service():
+    """整個行程共用一個 MQTT 訂閱服務，所有 session 共用同一份解析結果"""
     try:
-        # 將訊息放入隊列（線程安全，從 userdata 獲取隊列）
-        if userdata is not None:
-            userdata.put({
-                "topic": topic,
-                "payload": payload,
-                "timestamp": timestamp,
-                "qos": message.qos
-            })
-
+        history_store = HistoryStore(HISTORY_DB_PATH)
     except Exception as e:
-        print(f"處理訊息時發生錯誤: {e}")
+        print(f"無法開啟歷史資料庫 {HISTORY_DB_PATH}: {e}")
+        history_store = None
+    return IngestService(MQTT_BROKER, MQTT_PORT, history_store=history_store)
 
-def process_message_queue():
-    """處理消息隊列中的訊息（在主線程中執行）"""
-    if 'message_queue' not in st.session_state:
-        return
-    
-    # 處理隊列中的所有訊息
-    while not st.session_state.message_queue.empty():
-        try:
-            msg = st.session_state.message_queue.get_nowait()
-            topic = msg["topic"]
-            payload = msg["payload"]
-            timestamp = msg["timestamp"]
-            qos = msg["qos"]
-            
-            # 處理電燈開關狀態
-            if topic == MQTT_TOPIC_LIGHT:
-                data = json.loads(payload) if payload.startswith('{') else {"status": payload}
-                status = data.get("status", payload).lower()
-                if status in ["on", "開", "1", "true"]:
-                    st.session_state.light_status = "開啟"
-                elif status in ["off", "關", "0", "false"]:
-                    st.session_state.light_status = "關閉"
-                else:
-                    st.session_state.light_status = payload
-            
-            # 處理溫度數據
-            elif topic == MQTT_TOPIC_TEMP:
-                data = json.loads(payload) if payload.startswith('{') else {"value": float(payload)}
-                temp_value = float(data.get("value", payload))
-                st.session_state.temperature = temp_value
-                # 儲存到歷史記錄
-                st.session_state.data_history.append({
-                    "timestamp": timestamp,
-                    "temperature": temp_value,
-                    "humidity": st.session_state.humidity
-                })
-            
-            # 處理濕度數據
-            elif topic == MQTT_TOPIC_HUMIDITY:
-                data = json.loads(payload) if payload.startswith('{') else {"value": float(payload)}
-                humidity_value = float(data.get("value", payload))
-                st.session_state.humidity = humidity_value
-                # 更新最後一筆記錄的濕度，或創建新記錄
-                if st.session_state.data_history:
-                    last_record = st.session_state.data_history[-1]
-                    if last_record["timestamp"] == timestamp or (timestamp - last_record["timestamp"]).seconds < 1:
-                        last_record["humidity"] = humidity_value
-                    else:
-                        st.session_state.data_history.append({
-                            "timestamp": timestamp,
-                            "temperature": st.session_state.temperature,
-                            "humidity": humidity_value
-                        })
-                else:
-                    st.session_state.data_history.append({
-                        "timestamp": timestamp,
-                        "temperature": st.session_state.temperature,
-                        "humidity": humidity_value
-                    })
-            
-            # 處理 testtopic 訊息
-            elif topic == MQTT_TOPIC:
-                # 儲存 testtopic 訊息
-                st.session_state.testtopic_messages.append({
-                    "timestamp": timestamp,
-                    "topic": topic,
-                    "payload": payload,
-                    "qos": qos
-                })
-        except Exception as e:
-            print(f"處理隊列訊息時發生錯誤: {e}")
+ingest_service = get_ingest_service()
 
-# 連接事件
-mqtt_connect_event = threading.Event()
+@st.cache_resource
+def get_export_server():
+    """整個行程共用一個匯出下載伺服器（埠號被占用時為 None，頁面上顯示警告）"""
+    try:
+        return ExportServer(port=EXPORT_PORT)
+    except OSError as e:
+        print(f"無法啟動匯出下載伺服器（埠號 {EXPORT_PORT}）: {e}")
+        return None
 
-def mqtt_loop():
-    """MQTT 網路循環（在背景執行，參考 lesson6_2.ipynb 的非阻塞模式）"""
-    if st.session_state.mqtt_client:
-        # 使用 loop_start() 非阻塞模式，類似 lesson6_2.ipynb 的第三個 cell
-        st.session_state.mqtt_client.loop_start()
+def export_url(token):
+    """下載連結：與目前頁面相同的主機名稱，埠號為匯出伺服器的埠號"""
+    hostname = urlsplit("//" + (st.context.headers.get("Host") or "localhost")).hostname or "localhost"
+    if ":" in hostname:  # IPv6 位址
+        hostname = f"[{hostname}]"
+    return f"http://{hostname}:{export_server.port}/{token}"
+
+export_server = get_export_server()
 
 def start_mqtt():
-    """啟動 MQTT 連接（參考 lesson6_2.ipynb 的非阻塞模式）"""
-    if st.session_state.mqtt_client is None or not st.session_state.mqtt_connected:
-        try:
-            mqtt_connect_event.clear()
-            # 創建客戶端（使用新的 Callback API 版本 2，參考 lesson6_2.ipynb）
-            client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
-            # 將消息隊列作為 userdata 傳遞，避免在回調中訪問 session_state
-            client.user_data_set(st.session_state.message_queue)
-            client.on_connect = on_connect
-
-            client.on_message = on_message
-            
-            # 連接到 MQTT Broker（參考 lesson6_2.ipynb 的連接方式）
-            client.connect(MQTT_BROKER, MQTT_PORT, 60)
-            st.session_state.mqtt_client = client
-        
-            # 使用非阻塞模式啟動網路循環（參考 lesson6_2.ipynb 第三個 cell 的 loop_start）
-            client.loop_start()
-            
-            # 等待連接確認（最多等待 3 秒）
-            if mqtt_connect_event.wait(timeout=3):
-                # 在主線程中更新連接狀態（避免 ScriptRunContext 警告）
-                st.session_state.mqtt_connected = True
-                return True
-            else:
-                st.warning("⚠️ 連接超時，請檢查 MQTT Broker 是否運行")
-                return False
-        except Exception as e:
-            st.error(f"連接 MQTT 失敗: {e}")
-            return False
-    return True
+    """啟動共用的 MQTT 訂閱器（已由其他 session 啟動時直接沿用）"""
+    if ingest_service.start():
+        return True
+    if ingest_service.last_error:
+        st.warning(f"⚠️ {ingest_service.last_error}")
+    return False
 
 def stop_mqtt():
-    """停止 MQTT 連接"""
-    if st.session_state.mqtt_client:
-        st.session_state.mqtt_client.loop_stop()
-        st.session_state.mqtt_client.disconnect()
-        st.session_state.mqtt_client = None
-        st.session_state.mqtt_connected = False
-
-# MQTT 發佈器函數
-publisher_connect_event = threading.Event()
-
-def on_connect_publisher(client, userdata, flags, reason_code, properties):
-    # 處理 reason_code（可能是整數或 ReasonCode 對象）
-    rc_value = reason_code.value if hasattr(reason_code, 'value') else int(reason_code)
-    
-    if rc_value == 0:
-        st.session_state.publisher_connected = True
-        publisher_connect_event.set()
-        print(f"✓ 發佈器已連接到 MQTT Broker")
-    else:
-        st.session_state.publisher_connected = False
-        publisher_connect_event.set()
-        error_messages = {
-            1: "協議版本不正確",
-            2: "客戶端 ID 無效",
-            3: "伺服器不可用",
-            4: "使用者名稱或密碼錯誤",
-            5: "未授權"
-        }
-        error_msg = error_messages.get(rc_value, f"未知錯誤 (代碼: {rc_value})")
-        print(f"✗ 發佈器連接失敗: {error_msg}")
-
-def on_publish_publisher(client, userdata, mid, reason_code=None, properties=None):
-    print(f"✓ 訊息已發佈 (mid: {mid})")
+    """停止共用的 MQTT 訂閱器"""
+    ingest_service.stop()
 
+# MQTT 發佈器函數（Publisher 不等待確認，每則訊息回傳一個 Future）
 def start_publisher():
     """啟動 MQTT 發佈器（參考 lesson6_2.ipynb 的連接模式）"""
     if st.session_state.publisher_client is None or not st.session_state.publisher_connected:
         try:
-            publisher_connect_event.clear()
-            # 創建客戶端（使用新的 Callback API 版本 2）
-            client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
-            client.on_connect = on_connect_publisher
-            client.on_publish = on_publish_publisher
-            
-            # 連接到 MQTT Broker
-            client.connect(MQTT_BROKER, MQTT_PORT, 60)
-            
-            # 使用非阻塞模式啟動網路循環（參考 lesson6_2.ipynb）
-            client.loop_start()
-            st.session_state.publisher_client = client
+            if st.session_state.publisher_client is not None:
+                st.session_state.publisher_client.stop()
+            publisher = Publisher(MQTT_BROKER, MQTT_PORT)
+            st.session_state.publisher_client = publisher
             
             # 等待連接確認（最多等待 3 秒）
-            if publisher_connect_event.wait(timeout=3):
+            if publisher.start(timeout=3):
                 # 在主線程中更新連接狀態（避免 ScriptRunContext 警告）
                 st.session_state.publisher_connected = True
                 return True
             else:
-                st.warning("⚠️ 發佈器連接超時，請檢查：\n1. MQTT Broker 是否運行\n2. 端口 1883 是否開放")
+                st.session_state.publisher_connected = False
+                st.warning(f"⚠️ 發佈器連接失敗（{publisher.last_error}），請檢查：\n1. MQTT Broker 是否運行\n2. 端口 1883 是否開放")
                 return False
         except Exception as e:
             st.error(f"啟動發佈器失敗: {e}")
@@ -287,142 +122,104 @@ def start_publisher():
 def stop_publisher():
     """停止 MQTT 發佈器"""
     st.session_state.auto_publish = False
+    stop_simulator()
     if st.session_state.publisher_client:
-        try:
-            st.session_state.publisher_client.loop_stop()
-            st.session_state.publisher_client.disconnect()
-        except:
-            pass
+        st.session_state.publisher_client.stop()
         st.session_state.publisher_client = None
         st.session_state.publisher_connected = False
 
-def publish_data(light_status=None, temperature=None, humidity=None, test_message=None, client=None):
-    """發送 MQTT 數據"""
+def _report_result(description):
+    """回傳給 Future 的完成回調（在 paho 線程中執行，只能印出結果，不能操作畫面）"""
+    def callback(future):
+        error = future.exception()
+        if error is None:
+            print(f"✓ {description}")
+        else:
+            print(f"✗ {description}失敗: {error}")
+    return callback
+
+def publish_data(light_status=None, temperature=None, humidity=None, test_message=None, client=None,
+                 stamp_payloads=None, readings=None):
+    """
+    發送 MQTT 數據（不等待確認）
+    readings       = 一批讀數 [{"light": ..., "temperature": ..., "humidity": ...}, ...]，
+                     與 light_status / temperature / humidity 參數一起整批送出
+    client         = 指定的 Publisher（線程安全模式），None 時使用 session 的發佈器
+    stamp_payloads = 是否附上送出時間 ts 與序號 seq（見 latency.py），None 時依側邊欄設定
+    回傳每則訊息的 Future 清單；沒有送出任何訊息時回傳空清單
+    """
+    readings = list(readings or [])
+    if light_status is not None or temperature is not None or humidity is not None:
+        readings.append({"light": light_status, "temperature": temperature, "humidity": humidity})
+    has_test_message = test_message is not None and test_message.strip()
     # 檢查是否有任何數據要發送
-    if light_status is None and temperature is None and humidity is None and (test_message is None or not test_message.strip()):
-        return False
+    if not readings and not has_test_message:
+        return []
     
     # 如果明確提供了 client，直接使用 (線程安全模式)
     if client is not None:
-        target_client = client
-        connected = client.is_connected()
+        publisher = client
+        if stamp_payloads is None:
+            stamp_payloads = True
     else:
         # 使用 session_state (UI 模式)
-        if 'publisher_connected' not in st.session_state or not st.session_state.publisher_connected:
+        if not st.session_state.publisher_connected:
             if not start_publisher():
-                return False
-            # 等待連接穩定
-            time.sleep(0.3)
-        
-        target_client = st.session_state.publisher_client
-        connected = st.session_state.publisher_connected if 'publisher_connected' in st.session_state else False
+                return []
+        publisher = st.session_state.publisher_client
+        if stamp_payloads is None:
+            stamp_payloads = st.session_state.stamp_payloads
     
-    if target_client and connected:
+    if publisher is None or not publisher.is_connected():
+        if client is None:
+            st.warning("⚠️ 發佈器未連接，請先啟動發佈器")
+        return []
 
-        try:
-            success_count = 0
-            # 發送電燈狀態
-            if light_status is not None:
-                status = "on" if light_status else "off"
-                result = target_client.publish(
-                    MQTT_TOPIC_LIGHT, 
-                    json.dumps({"status": status}), 
-                    qos=1
-                )
-                if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                    success_count += 1
-            
-            # 發送溫度
-            if temperature is not None:
-                result = target_client.publish(
-                    MQTT_TOPIC_TEMP, 
-                    json.dumps({"value": round(temperature, 1)}), 
-                    qos=1
-                )
-                if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                    success_count += 1
-            
-            # 發送濕度
-            if humidity is not None:
-                result = target_client.publish(
-                    MQTT_TOPIC_HUMIDITY, 
- 
-                    json.dumps({"value": round(humidity, 1)}), 
-                    qos=1
-                )
-                if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                    success_count += 1
-            
-            # 發送到 testtopic
-            if test_message is not None and test_message.strip():
-                try:
-                    result = target_client.publish(
-                        MQTT_TOPIC, 
- 
-                        test_message, 
-                        qos=1
-                    )
-                    # 等待發送完成
-                    result.wait_for_publish(timeout=2)
-                    if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                        success_count += 1
-                        print(f"✓ 成功發送到 {MQTT_TOPIC}: {test_message}")
-                    else:
-                        print(f"✗ 發送失敗，錯誤代碼: {result.rc}")
-                except Exception as e:
-                    print(f"✗ 發送 testtopic 時發生錯誤: {e}")
-                    st.error(f"發送 testtopic 失敗: {e}")
-            
-            return success_count > 0
-        except Exception as e:
-            st.error(f"發送數據失敗: {e}")
-            return False
-    else:
-        st.warning("⚠️ 發佈器未連接，請先啟動發佈器")
-        return False
-
-def auto_publish_loop(client, stop_event):
-    """自動發送數據循環 (線程安全版)"""
-    base_temp = 25.0
-    base_humidity = 50.0
-    light_state = False
-    
-    print("自動發送線程啟動")
     try:
-        while not stop_event.is_set():
-            if client.is_connected():
-                # 切換電燈狀態
-                light_state = not light_state
-                
-                # 模擬溫度變化
-                temp = base_temp + random.uniform(-2, 2)
-                
-                # 模擬濕度變化
-                humidity = base_humidity + random.uniform(-5, 5)
-                humidity = max(0, min(100, humidity))
-                
-                # 發送數據 (傳入 client)
-                publish_data(light_status=light_state, temperature=temp, humidity=humidity, client=client)
-            
-            # 等待 2 秒，或直到收到停止信號
-            if stop_event.wait(timeout=2):
-                break
+        futures = publisher.publish_many(reading_messages(readings, stamp_payloads))
+        # 發送到 testtopic（確認結果由回調印出，不阻塞畫面）
+        if has_test_message:
+            future = publisher.publish(MQTT_TOPIC, test_message, qos=1)
+            future.add_done_callback(_report_result(f"發送到 {MQTT_TOPIC}: {test_message}"))
+            futures.append(future)
+        return futures
     except Exception as e:
-        print(f"自動發送線程錯誤: {e}")
-    print("自動發送線程結束")
+        if client is None:
+            st.error(f"發送數據失敗: {e}")
+        else:
+            print(f"發送數據失敗: {e}")
+        return []
+
+def publish_failed(futures):
+    """已經完成且失敗的訊息數（不等待尚未確認的訊息）"""
+    return sum(1 for f in futures if f.done() and f.exception() is not None)
+
+def start_simulator(devices, interval, jitter, encoding="json"):
+    """啟動自動發送（多裝置模擬器，單一排程線程）"""
+    stop_simulator()
+    simulator = FleetSimulator(st.session_state.publisher_client, devices=devices, interval=interval,
+                               jitter=jitter, stamp_payloads=st.session_state.stamp_payloads, encoding=encoding)
+    simulator.start()
+    st.session_state.simulator = simulator
+
+def stop_simulator():
+    """停止自動發送"""
+    if st.session_state.simulator is not None:
+        st.session_state.simulator.stop()
+        st.session_state.simulator = None
 
 
 # 主程式
 st.title("🏠 MQTT 監控系統")
 st.markdown("---")
 
-# 處理消息隊列（在主線程中執行，避免 ScriptRunContext 警告）
-process_message_queue()
+# 消息隊列由 IngestService 的背景線程處理，各 session 只讀取共用的快照
+snapshot = ingest_service.snapshot()
 
 # 連接狀態提示
 status_col1, status_col2, status_col3 = st.columns(3)
 with status_col1:
-    if st.session_state.mqtt_connected:
+    if snapshot.connected:
         st.success("✓ 訂閱器已連接")
     else:
         st.error("✗ 訂閱器未連接")
@@ -436,9 +233,9 @@ with status_col2:
         st.caption("請在側邊欄啟動發佈器以發送數據")
 
 with status_col3:
-    if st.session_state.mqtt_connected and st.session_state.publisher_connected:
+    if snapshot.connected and st.session_state.publisher_connected:
         st.success("✓ 系統就緒")
-    elif st.session_state.mqtt_connected:
+    elif snapshot.connected:
         st.info("ℹ️ 僅接收模式")
     elif st.session_state.publisher_connected:
         st.info("ℹ️ 僅發送模式")
@@ -469,7 +266,7 @@ with st.sidebar:
             st.rerun()
     
     # 連接狀態
-    if st.session_state.mqtt_connected:
+    if snapshot.connected:
         st.success("✓ 已連接")
     else:
         st.error("✗ 未連接")
@@ -480,6 +277,18 @@ with st.sidebar:
     st.subheader("MQTT 設定")
     st.text_input("Broker 地址", value=MQTT_BROKER, disabled=True)
     st.number_input("端口", value=MQTT_PORT, disabled=True)
+
+    # 接收隊列滿載策略（所有 session 共用同一個隊列）
+    message_queue = ingest_service.message_queue
+    queue_policy = st.selectbox(
+        "隊列滿載策略",
+        list(POLICIES),
+        index=list(POLICIES).index(message_queue.policy),
+        format_func=POLICIES.get,
+        help=f"接收隊列最多保留 {message_queue.maxsize:,} 則訊息，畫面停止更新時超過的部分依此策略處理"
+    )
+    if queue_policy != message_queue.policy:
+        message_queue.policy = queue_policy
     
     # 溫度單位設定
     st.session_state.temp_unit = st.radio(
@@ -493,10 +302,10 @@ with st.sidebar:
     
     # 主題列表
     st.subheader("訂閱主題")
-    st.code(MQTT_TOPIC_LIGHT)
-    st.code(MQTT_TOPIC_TEMP)
-    st.code(MQTT_TOPIC_HUMIDITY)
-    st.code(MQTT_TOPIC)
+    for topic_filter in ingest_service.registry.topic_filters():
+        st.code(topic_filter)
+    if ingest_service.plugins:
+        st.caption("已載入外掛處理器：" + "、".join(ingest_service.plugins))
     
     st.markdown("---")
     
@@ -506,6 +315,8 @@ with st.sidebar:
     # 發佈器連接狀態
     if st.session_state.publisher_connected:
         st.success("✓ 發佈器已連接")
+        publisher = st.session_state.publisher_client
+        st.caption(f"待確認 {publisher.in_flight} 則・已確認 {publisher.acked} 則・失敗 {publisher.failed} 則")
     else:
         st.info("發佈器未連接")
     
@@ -524,6 +335,12 @@ with st.sidebar:
             st.info("發佈器已停止")
             st.rerun()
     
+    st.session_state.stamp_payloads = st.checkbox(
+        "⏱️ 附加送出時間與序號",
+        value=st.session_state.stamp_payloads,
+        help="在 JSON 中加入 ts（epoch 毫秒）與 seq，供頁面下方的「🩺 診斷」計算延遲與遺失"
+    )
+    
     st.markdown("---")
     
     # 手動發送數據
@@ -537,8 +354,9 @@ with st.sidebar:
         submitted = st.form_submit_button("📤 發送數據", use_container_width=True)
         if submitted:
             with st.spinner("正在發送數據..."):
-                if publish_data(light_status=light_switch, temperature=temp_value, humidity=humidity_value):
-                    st.success("✓ 數據已成功發送！")
+                futures = publish_data(light_status=light_switch, temperature=temp_value, humidity=humidity_value)
+                if futures and not publish_failed(futures):
+                    st.success(f"✓ 已送出 {len(futures)} 則訊息（確認結果在背景追蹤）")
 
                 else:
                     st.error("✗ 發送失敗，請檢查：\n1. 發佈器是否已啟動\n2. MQTT Broker 是否運行")
@@ -569,14 +387,12 @@ with st.sidebar:
                         st.info("正在啟動發佈器...")
                         if not start_publisher():
                             st.error("✗ 發佈器啟動失敗，請檢查：\n1. MQTT Broker 是否運行\n2. 端口 1883 是否開放")
-                        else:
-                            time.sleep(0.5)  # 等待連接穩定
                     
                     if st.session_state.publisher_connected:
                         try:
-                            result = publish_data(test_message=test_message)
-                            if result:
-                                st.success(f"✓ 測試訊息已成功發送到 `{MQTT_TOPIC}`！")
+                            futures = publish_data(test_message=test_message)
+                            if futures and not publish_failed(futures):
+                                st.success(f"✓ 測試訊息已送出到 `{MQTT_TOPIC}`！")
 
                                 st.info(f"💡 提示：請確保訂閱器已連接以查看收到的訊息")
                             else:
@@ -591,6 +407,17 @@ with st.sidebar:
     # 自動發送模式
     st.subheader("🔄 自動發送模式")
     
+    sim_devices = st.number_input("模擬裝置數", min_value=1, max_value=5000, value=1, step=1,
+                                  disabled=st.session_state.auto_publish,
+                                  help="第一台使用客廳主題，其餘為 home/sim-0001/temperature 等")
+    sim_interval = st.number_input("發送間隔（秒）", min_value=0.1, max_value=60.0, value=2.0, step=0.5,
+                                   disabled=st.session_state.auto_publish)
+    sim_jitter = st.slider("時間抖動", min_value=0, max_value=50, value=20, step=5, format="±%d%%",
+                           disabled=st.session_state.auto_publish,
+                           help="每台裝置每次的發送間隔隨機增減，避免所有裝置同時發送")
+    sim_encoding = st.selectbox("資料格式", list(ENCODINGS), format_func=ENCODINGS.get,
+                                disabled=st.session_state.auto_publish,
+                                help="二進位訊框：第二台以後的裝置每筆讀數只發一則 24 位元組的訊息到 home/<裝置>/frame")
     auto_publish_enabled = st.checkbox("啟用自動發送", value=st.session_state.auto_publish)
     
     if auto_publish_enabled != st.session_state.auto_publish:
@@ -606,183 +433,384 @@ with st.sidebar:
                     st.session_state.auto_publish = False
             # 再次檢查連接狀態
             if st.session_state.publisher_connected:
-                if st.session_state.publish_thread is None or not st.session_state.publish_thread.is_alive():
-                    # 清除停止信號
-                    st.session_state.auto_publish_stop_event.clear()
-                    # 啟動線程 (傳入 client 和 stop_event)
-                    thread = threading.Thread(
-                        target=auto_publish_loop, 
-                        args=(st.session_state.publisher_client, st.session_state.auto_publish_stop_event), 
-                        daemon=True
-                    )
-                    thread.start()
-                    st.session_state.publish_thread = thread
-                    st.success("✓ 自動發送已啟動")
+                start_simulator(int(sim_devices), float(sim_interval), sim_jitter / 100, sim_encoding)
+                st.success("✓ 自動發送已啟動")
         else:
-            # 發送停止信號
-            st.session_state.auto_publish_stop_event.set()
+            stop_simulator()
             st.info("自動發送已停止")
 
         st.rerun()
     
-    if st.session_state.auto_publish:
-        st.info("🔄 自動發送中... 每 2 秒發送一次測試數據")
-
-# 主要內容區域
-col1, col2, col3 = st.columns(3)
-
-# 電燈開關狀態
-with col1:
-    st.subheader("💡 電燈狀態")
-    if st.session_state.light_status == "開啟":
-        st.markdown('<div style="text-align: center; padding: 20px; background-color: #ffd700; border-radius: 10px;">'
-                   f'<h1 style="color: #000;">{st.session_state.light_status}</h1></div>', 
-                   unsafe_allow_html=True)
-    elif st.session_state.light_status == "關閉":
-        st.markdown('<div style="text-align: center; padding: 20px; background-color: #333; border-radius: 10px;">'
-                   f'<h1 style="color: #fff;">{st.session_state.light_status}</h1></div>', 
-                   unsafe_allow_html=True)
-    else:
-        st.info("等待數據...")
-
-# 溫度顯示
-with col2:
-    st.subheader("🌡️ 客廳溫度")
-
-    if st.session_state.temperature is not None:
-        display_temp = st.session_state.temperature
+    simulator = st.session_state.simulator
+    if st.session_state.auto_publish and simulator is not None:
+        stats = simulator.stats()
+        st.info(f"🔄 自動發送中... {stats['devices']:,} 台裝置，每 {simulator.interval:g} 秒發送一次"
+                f"（約 {stats['expected_rate']:,.0f} 則/秒）")
+        st.caption(f"已送出 {stats['published']:,} 則・未連接略過 {stats['skipped']:,} 次・"
+                   f"排程延誤 {max(stats['lag'], 0) * 1000:.0f} ms")
+
+# 自動更新機制（變更驅動）：
+# 即時數值、歷史圖表、其他感測器與裝置總覽各自是一個 fragment，每秒只重新執行自己那一塊，
+# 並比對自己的序列版本，沒有新數據時沿用上次算好的結果；整個頁面只在連接狀態等少數狀態改變時才重新執行
+auto_refresh = st.sidebar.checkbox("🔄 自動重新整理", value=True, help="勾選此項後，有新數據時自動更新頁面（每秒檢查一次）")
+
+def live_section(render):
+    """把頁面的一個區塊包成 fragment：自動重新整理時每 REFRESH_INTERVAL 秒只重新執行這個區塊"""
+    return st.fragment(render, run_every=REFRESH_INTERVAL if auto_refresh else None)
+
+def series_version(snapshot, names):
+    """序列版本：各序列的數據點數與最後一個時間點，沒有新數據點時不變"""
+    version = []
+    for name in names:
+        series = snapshot.history.get(name)
+        count = 0 if series is None else len(series["timestamp"])
+        version.append((count, int(series["timestamp"][-1]) if count else None))
+    return tuple(version)
+
+def cached(name, version, build):
+    """同一個 session 中版本（序列版本與顯示選項）沒變時沿用上次 build() 的結果，不重新計算"""
+    cache = st.session_state.setdefault("live_cache", {})
+    if name not in cache or cache[name][0] != version:
+        cache[name] = (version, build())
+    return cache[name][1]
+
+def readings_view(snapshot):
+    """把快照的最新值整理成要顯示的文字與提示（同一版本只整理一次）"""
+    view = {
+        "light_style": {"開啟": ("#ffd700", "#000"), "關閉": ("#333", "#fff")}.get(snapshot.light_status),
+        "temperature": None, "temperature_hint": None, "humidity": None, "humidity_hint": None,
+    }
+    if snapshot.temperature is not None:
+        display_temp = snapshot.temperature
         unit_label = "°C"
-        
         if st.session_state.temp_unit == "華氏 (°F)":
             display_temp = display_temp * 9/5 + 32
             unit_label = "°F"
-            
-        st.metric("溫度", f"{display_temp:.1f} {unit_label}")
+        view["temperature"] = f"{display_temp:.1f} {unit_label}"
+        if snapshot.temperature > 28:
+            view["temperature_hint"] = ("warning", "溫度較高")
+        elif snapshot.temperature < 18:
+            view["temperature_hint"] = ("info", "溫度較低")
+    if snapshot.humidity is not None:
+        view["humidity"] = f"{snapshot.humidity:.1f} %"
+        if snapshot.humidity > 70:
+            view["humidity_hint"] = ("warning", "濕度較高")
+        elif snapshot.humidity < 30:
+            view["humidity_hint"] = ("info", "濕度較低")
+    return view
 
-        # 溫度顏色提示
-        if st.session_state.temperature > 28:
-            st.warning("溫度較高")
-        elif st.session_state.temperature < 18:
-            st.info("溫度較低")
-    else:
-        st.info("等待數據...")
-
-# 濕度顯示
-with col3:
-    st.subheader("💧 客廳濕度")
-    if st.session_state.humidity is not None:
-        st.metric("濕度", f"{st.session_state.humidity:.1f} %")
-        # 濕度顏色提示
-        if st.session_state.humidity > 70:
-            st.warning("濕度較高")
-        elif st.session_state.humidity < 30:
-            st.info("濕度較低")
-    else:
-        st.info("等待數據...")
+# 主要內容區域
+@live_section
+def live_readings():
+    """電燈、溫度、濕度的最新值"""
+    snapshot = ingest_service.snapshot()
+    # 版本沒變時沿用上次整理好的顯示內容，只把同樣的元素再送一次（fragment 沒送出的元素會被清掉）
+    view = cached("readings", (snapshot.version, st.session_state.temp_unit), lambda: readings_view(snapshot))
+
+    col1, col2, col3 = st.columns(3)
+
+    # 電燈開關狀態
+    with col1:
+        st.subheader("💡 電燈狀態")
+        if view["light_style"] is not None:
+            background, color = view["light_style"]
+            st.markdown(f'<div style="text-align: center; padding: 20px; background-color: {background}; border-radius: 10px;">'
+                       f'<h1 style="color: {color};">{snapshot.light_status}</h1></div>', 
+                       unsafe_allow_html=True)
+        else:
+            st.info("等待數據...")
+
+    # 溫度顯示
+    with col2:
+        st.subheader("🌡️ 客廳溫度")
+        if view["temperature"] is not None:
+            st.metric("溫度", view["temperature"])
+            # 溫度顏色提示
+            if view["temperature_hint"]:
+                getattr(st, view["temperature_hint"][0])(view["temperature_hint"][1])
+        else:
+            st.info("等待數據...")
+
+    # 濕度顯示
+    with col3:
+        st.subheader("💧 客廳濕度")
+        if view["humidity"] is not None:
+            st.metric("濕度", view["humidity"])
+            # 濕度顏色提示
+            if view["humidity_hint"]:
+                getattr(st, view["humidity_hint"][0])(view["humidity_hint"][1])
+        else:
+            st.info("等待數據...")
+
+    # 畫面更新延遲：每個 session 對每個版本只記錄一次（此時最新值已經畫出）
+    if snapshot.processed_at and st.session_state.get('rendered_version') != snapshot.version:
+        ingest_service.latency.record_render(snapshot.processed_at, time.time_ns())
+        st.session_state.rendered_version = snapshot.version
+
+live_readings()
 
 st.markdown("---")
 
 # 溫濕度圖表
 st.subheader("📊 溫濕度歷史圖表")
 
-if len(st.session_state.data_history) > 0:
-    # 轉換為 DataFrame
-    df = pd.DataFrame(list(st.session_state.data_history))
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    
+# 可從歷史資料庫讀取的時間範圍（秒），None 代表全部
+CHART_RANGES = {
+    "最近 1 小時": 3600,
+    "最近 24 小時": 86400,
+    "最近 7 天": 7 * 86400,
+    "最近 30 天": 30 * 86400,
+    "全部": None,
+}
+
+# 溫度與濕度各自取樣，顯示時依這個間隔對齊成同一列（0 代表以實際收到的時間點為列）
+ALIGN_BUCKETS = {
+    "1 秒": ALIGN_BUCKET_NS,
+    "5 秒": 5_000_000_000,
+    "1 分鐘": 60_000_000_000,
+    "不對齊（原始時間點）": 0,
+}
+
+def history_frame(history, n=None, bucket_ns=ALIGN_BUCKET_NS):
+    """把記憶體中的溫度、濕度序列以 asof_join 對齊成表格（只計算最後 n 列，不複製整份歷史）"""
+    df = to_frame(asof_join(history, bucket_ns, n, names=["temperature", "humidity"]))
     # 單位轉換
     if st.session_state.temp_unit == "華氏 (°F)":
         df['temperature'] = df['temperature'] * 9/5 + 32
-        
-    df = df.sort_values('timestamp')
-
+    return df
+
+history_store = ingest_service.history_store
+
+@st.cache_data(ttl=TIME_BOUNDS_TTL, show_spinner=False)
+def stored_time_bounds(series):
+    """歷史資料庫中某序列的時間範圍（TIME_BOUNDS_TTL 秒內不重新查詢，所有 session 共用）"""
+    bounds = history_store.time_bounds(series)
+    return None if bounds is None else tuple(bounds)
+
+@live_section
+def history_charts():
+    """溫濕度歷史圖表、匯出與統計（序列版本沒變時沿用上次的表格）"""
+    snapshot = ingest_service.snapshot()
+    has_stored_history = history_store is not None and stored_time_bounds("temperature") is not None
+    # 沒有新數據點時版本不變，重新整理只重畫上次的表格；單位換算也會改變表格內容
+    version = (series_version(snapshot, ["temperature", "humidity"]), st.session_state.temp_unit)
+
+    if snapshot.history_size > 0 or has_stored_history:
+        # 時間範圍選擇：「最近 N 筆」直接讀記憶體中的環形緩衝區，其餘從歷史資料庫讀取合適的彙總層級
+        col1, col2, col3 = st.columns([2, 1, 1])
+        with col3:
+            align_label = st.selectbox("對齊間隔", list(ALIGN_BUCKETS), help="溫度與濕度在同一個時間區間內的數據合併為一列，沒有新數據時沿用前一個值")
+            bucket_ns = ALIGN_BUCKETS[align_label]
+        with col1:
+            range_options = ["最近 N 筆（即時）"] + (list(CHART_RANGES) if history_store is not None else [])
+            range_label = st.selectbox("顯示時間範圍", range_options)
+            if range_label in CHART_RANGES:
+                def stored_frame():
+                    end_ns = time.time_ns()
+                    span = CHART_RANGES[range_label]
+                    if span is None:
+                        bounds = stored_time_bounds("temperature")
+                        start_ns = bounds[0] if bounds else end_ns
+                    else:
+                        start_ns = end_ns - span * 1_000_000_000
+                    df, level = history_store.chart_frame(["temperature", "humidity"], start_ns, end_ns,
+                                                          bucket_ns=bucket_ns)
+                    if st.session_state.temp_unit == "華氏 (°F)":
+                        df['temperature'] = df['temperature'] * 9/5 + 32
+                    return df, level
+
+                df_display, level = cached("chart", (version, range_label, bucket_ns), stored_frame)
+                source = f"原始數據，對齊間隔 {align_label}" if level == 0 else ROLLUP_LEVELS[level] + "平均值"
+                st.caption(f"資料來源：{source}（{len(df_display)} 點）")
+            elif snapshot.history_size > 10:
+                time_range = st.slider(
+                    "顯示時間範圍（最近 N 列數據）",
+                    min_value=10,
+                    max_value=min(500, snapshot.history_size),
+                    value=min(100, snapshot.history_size),
+                    step=10
+                )
+                df_display = cached("chart", (version, time_range, bucket_ns),
+                                    lambda: history_frame(snapshot.history, time_range, bucket_ns))
+            else:
+                df_display = cached("chart", (version, None, bucket_ns),
+                                    lambda: history_frame(snapshot.history, bucket_ns=bucket_ns))
     
-    # 時間範圍選擇
-    col1, col2 = st.columns([3, 1])
-    with col1:
-        if len(df) > 10:
-            time_range = st.slider(
-                "顯示時間範圍（最近 N 筆數據）",
-                min_value=10,
-                max_value=min(500, len(df)),
-                value=min(100, len(df)),
-                step=10
+        with col2:
+            chart_type = st.selectbox("圖表類型", ["折線圖", "區域圖"])
+    
+        # 繪製圖表
+        if chart_type == "折線圖":
+            st.line_chart(
+                df_display.set_index('timestamp')[['temperature', 'humidity']],
+                use_container_width=True
             )
-            df_display = df.tail(time_range)
         else:
-            df_display = df
-    
-    with col2:
-        chart_type = st.selectbox("圖表類型", ["折線圖", "區域圖"])
-    
-    # 繪製圖表
-    if chart_type == "折線圖":
-        st.line_chart(
-            df_display.set_index('timestamp')[['temperature', 'humidity']],
-            use_container_width=True
-        )
-    else:
-        st.area_chart(
-            df_display.set_index('timestamp')[['temperature', 'humidity']],
-            use_container_width=True
-        )
+            st.area_chart(
+                df_display.set_index('timestamp')[['temperature', 'humidity']],
+                use_container_width=True
+            )
     
-    # 數據表格
-    with st.expander("📋 查看數據表格"):
-        st.dataframe(df_display[['timestamp', 'temperature', 'humidity']], use_container_width=True)
+        # 數據表格
+        with st.expander("📋 查看數據表格"):
+            st.dataframe(df_display[['timestamp', 'temperature', 'humidity']], use_container_width=True)
     
-    # CSV 匯出功能
-    st.markdown("---")
-    st.subheader("💾 數據匯出")
+        # 數據匯出功能（按下下載連結時才產生檔案，邊產生邊送出）
+        st.markdown("---")
+        st.subheader("💾 數據匯出")
     
-    col1, col2 = st.columns(2)
-    with col1:
-        export_all = st.checkbox("匯出所有數據", value=False)
+        col1, col2 = st.columns(2)
+        with col1:
+            export_options = ["目前顯示的數據"] + (list(CHART_RANGES) if history_store is not None else [])
+            export_range = st.selectbox("匯出範圍", export_options)
+        with col2:
+            export_format = st.selectbox("檔案格式", list(EXPORT_FORMATS))
+    
+        def export_chunks(export_range=export_range, df_display=df_display,
+                          fahrenheit_unit=st.session_state.temp_unit == "華氏 (°F)"):
+            """匯出的數據（只在開啟下載連結時執行，歷史資料庫分段讀取）"""
+            if export_range in CHART_RANGES:
+                end_ns = time.time_ns()
+                span = CHART_RANGES[export_range]
+                start_ns = 0 if span is None else end_ns - span * 1_000_000_000
+                chunks = history_store.iter_raw(["temperature", "humidity"], start_ns, end_ns)
+                if fahrenheit_unit:
+                    chunks = map(fahrenheit, chunks)
+                return chunks
+            # 目前顯示的數據已經轉換過溫度單位
+            return [df_display]
+    
+        if export_server is not None:
+            # 每個 session 一個下載連結，重新整理時只更新內容（Streamlit 的下載按鈕會把整個檔案放在記憶體中）
+            st.session_state.export_token = export_server.register(
+                st.session_state.get("export_token"), export_chunks, export_format, "溫濕度數據")
+            st.link_button(
+                label=f"📥 下載 {export_format} 檔案",
+                url=export_url(st.session_state.export_token),
+                use_container_width=True
+            )
+        else:
+            st.warning(f"匯出下載伺服器無法啟動（埠號 {EXPORT_PORT} 已被使用？），可設定環境變數 EXPORT_PORT 改用其他埠號")
     
-    if export_all:
-        df_export = df
+        # 統計資訊（目前顯示的數據）
+        with st.expander("📈 統計資訊"):
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.metric("數據筆數", len(df_display))
+            with col2:
+                if df_display['temperature'].notna().any():
+                    unit_label = "°F" if st.session_state.temp_unit == "華氏 (°F)" else "°C"
+                    st.metric("平均溫度", f"{df_display['temperature'].mean():.1f} {unit_label}")
+
+            with col3:
+                if df_display['humidity'].notna().any():
+                    st.metric("平均濕度", f"{df_display['humidity'].mean():.1f} %")
+            with col4:
+                if len(df_display) > 1:
+                    time_span = (df_display['timestamp'].max() - df_display['timestamp'].min())
+                    st.metric("時間範圍", f"{time_span.total_seconds()/60:.1f} 分鐘")
+
     else:
-        df_export = df_display
-    
-    # 轉換為 CSV
-    csv = df_export[['timestamp', 'temperature', 'humidity']].to_csv(index=False)
-    
-    st.download_button(
-        label="📥 下載 CSV 檔案",
-        data=csv,
-        file_name=f"溫濕度數據_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-        mime="text/csv",
-        use_container_width=True
-    )
-    
-    # 統計資訊
-    with st.expander("📈 統計資訊"):
+        st.info("📊 等待數據中... 請確保 MQTT 連接已建立並有數據發送。")
+
+history_charts()
+
+@live_section
+def plugin_readings():
+    """外掛處理器（handlers/）提供的其他感測器數據"""
+    snapshot = ingest_service.snapshot()
+    if snapshot.plugin_state:
+        st.markdown("---")
+        st.subheader("🧩 其他感測器")
+        st.dataframe(
+            pd.DataFrame(list(snapshot.plugin_state.items()), columns=["項目", "數值"]),
+            use_container_width=True,
+            hide_index=True
+        )
+
+plugin_readings()
+
+# 裝置總覽：以萬用字元訂閱的所有裝置（home/<裝置>/...），一張表格，最需要注意的排在最上面
+FLEET_TOP_N = {"前 20 台": 20, "前 50 台": 50, "前 100 台": 100, "全部": None}
+
+@live_section
+def fleet_overview():
+    """裝置總覽與單一裝置的歷史（狀態依最後更新時間判斷，每次重新整理都重新計算）"""
+    snapshot = ingest_service.snapshot()
+    if len(snapshot.fleet["device"]) > 0:
+        st.markdown("---")
+        st.subheader("🛰️ 裝置總覽")
+        fleet_df = overview_frame(snapshot.fleet, time.time_ns())
+        offline = int((fleet_df["狀態"] == ALARM_STATES["offline"][1]).sum())
+        normal = int((fleet_df["狀態"] == ALARM_STATES["normal"][1]).sum())
+
         col1, col2, col3, col4 = st.columns(4)
         with col1:
-            st.metric("數據筆數", len(df_export))
+            st.metric("裝置數", f"{len(fleet_df):,}")
         with col2:
-            if df_export['temperature'].notna().any():
-                unit_label = "°F" if st.session_state.temp_unit == "華氏 (°F)" else "°C"
-                st.metric("平均溫度", f"{df_export['temperature'].mean():.1f} {unit_label}")
-
+            st.metric("正常", f"{normal:,}")
         with col3:
-            if df_export['humidity'].notna().any():
-                st.metric("平均濕度", f"{df_export['humidity'].mean():.1f} %")
+            st.metric("警示", f"{len(fleet_df) - normal - offline:,}")
         with col4:
-            if len(df_export) > 1:
-                time_span = (df_export['timestamp'].max() - df_export['timestamp'].min())
-                st.metric("時間範圍", f"{time_span.total_seconds()/60:.1f} 分鐘")
+            st.metric("離線", f"{offline:,}", help=f"超過 {STALE_AFTER_S} 秒（只送摘要的裝置為兩個時間窗）沒有收到數據")
 
-else:
-    st.info("📊 等待數據中... 請確保 MQTT 連接已建立並有數據發送。")
+        col1, col2, col3 = st.columns([2, 1, 1])
+        with col1:
+            fleet_search = st.text_input("搜尋裝置", placeholder="裝置名稱的一部分")
+        with col2:
+            top_n = FLEET_TOP_N[st.selectbox("顯示數量", list(FLEET_TOP_N))]
+        with col3:
+            st.write("")
+            only_alarms = st.checkbox("只顯示異常")
+        view = fleet_df
+        if fleet_search:
+            view = view[view["裝置"].str.contains(fleet_search, case=False, regex=False)]
+        if only_alarms:
+            view = view[view["狀態"] != ALARM_STATES["normal"][1]]
+        if top_n is not None:
+            view = view.head(top_n)
+        temp_column = "溫度 (°C)"
+        if st.session_state.temp_unit == "華氏 (°F)":
+            view = view.assign(**{temp_column: view[temp_column] * 9/5 + 32}).rename(columns={temp_column: "溫度 (°F)"})
+            temp_column = "溫度 (°F)"
+        st.dataframe(
+            view,
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                temp_column: st.column_config.NumberColumn(format="%.1f"),
+                "濕度 (%)": st.column_config.NumberColumn(format="%.1f"),
+                "最後更新 (秒前)": st.column_config.NumberColumn(format="%.0f"),
+            }
+        )
+        st.caption(f"顯示 {len(view):,} / {len(fleet_df):,} 台裝置（依狀態嚴重程度與資料新舊排序）")
+
+        # 單一裝置的歷史（每台裝置各自保存最近 FLEET_HISTORY_CAPACITY 筆）
+        # 選項依名稱排序（不隨狀態排序變動），重新整理時才不會跳回第一台
+        device = st.selectbox("查看單一裝置", sorted(fleet_df["裝置"]), key="fleet_device")
+        # 只送摘要的裝置另有 min / max 序列，一併畫出
+        device_history = ingest_service.device_history(device)
+        device_series = ["temperature", "humidity"] + [name for name in SUMMARY_SERIES if name in device_history]
+        device_df = to_frame(asof_join(device_history, ALIGN_BUCKET_NS, names=device_series))
+        if st.session_state.temp_unit == "華氏 (°F)":
+            for name in device_series:
+                if name.startswith("temperature"):
+                    device_df[name] = device_df[name] * 9/5 + 32
+        if len(device_df):
+            st.line_chart(device_df.set_index('timestamp')[device_series], use_container_width=True)
+            st.caption(f"{device}：{len(device_df)} 點（每 1 秒對齊一列，最多保留最近 {FLEET_HISTORY_CAPACITY} 筆）")
+        else:
+            st.info(f"{device} 尚未收到溫濕度數據")
+
+fleet_overview()
 
 # testtopic 訊息顯示
 st.markdown("---")
 st.subheader("🧪 testtopic 訊息監控")
 
-if len(st.session_state.testtopic_messages) > 0:
+if len(snapshot.testtopic_messages) > 0:
     # 顯示最近的訊息
-    recent_messages = list(st.session_state.testtopic_messages)[-10:]  # 顯示最近 10 條
+    recent_messages = list(snapshot.testtopic_messages)[-10:]  # 顯示最近 10 條
     
     for msg in reversed(recent_messages):
         with st.expander(f"📨 {msg['timestamp'].strftime('%Y-%m-%d %H:%M:%S')} - {msg['payload'][:50]}..."):
@@ -804,16 +832,73 @@ if len(st.session_state.testtopic_messages) > 0:
     
     # 清除訊息按鈕
     if st.button("🗑️ 清除訊息記錄"):
-        st.session_state.testtopic_messages.clear()
+        ingest_service.clear_testtopic_messages()
         st.rerun()
 else:
     st.info("📭 尚未收到 testtopic 訊息。請發送測試訊息或確保有數據發送到此主題。")
 
+# 診斷：接收隊列與延遲（發佈 → 收到 → 處理 → 畫面）
+st.markdown("---")
+with st.expander("🩺 診斷（隊列與延遲）"):
+    queue_stats = ingest_service.message_queue.stats()
+    st.markdown(f"**接收隊列**（{POLICIES[queue_stats['policy']]}）")
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("隊列長度", f"{queue_stats['size']:,} / {queue_stats['maxsize']:,}")
+    with col2:
+        st.metric("最高水位", f"{queue_stats['high_water']:,}")
+    with col3:
+        st.metric("已丟棄", f"{queue_stats['dropped']:,}")
+    with col4:
+        st.metric("已合併", f"{queue_stats['coalesced']:,}")
+
+    st.markdown("**端到端延遲**")
+    latency = ingest_service.latency
+    counters = latency.counters()
+    st.caption(f"統計開始時間：{datetime.fromtimestamp(counters['since']).strftime('%Y-%m-%d %H:%M:%S')}；"
+               "發佈 → 收到 需要發佈端附上 ts（跨機器時請先校時），遺失與亂序需要 seq")
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("已追蹤訊息", counters["received"])
+    with col2:
+        st.metric("遺失", counters["lost"])
+    with col3:
+        st.metric("亂序 / 重複", counters["reordered"])
+    with col4:
+        expected = counters["received"] + counters["lost"]
+        st.metric("遺失率", f"{counters['lost'] / expected * 100:.2f} %" if expected else "-")
+
+    st.dataframe(latency.summary(), use_container_width=True, hide_index=True)
+
+    histogram = latency.histogram_frame()
+    if len(histogram):
+        histogram["延遲"] = [f"≤ {edge:.3g} ms" if edge != float("inf") else "更長" for edge in histogram["上緣 (ms)"]]
+        st.bar_chart(histogram.set_index("延遲")[["broker", "queue", "ui"]], sort=False, use_container_width=True)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button(
+            label="📥 下載延遲統計 (CSV)",
+            data=latency.to_csv,
+            file_name=f"延遲統計_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+            mime="text/csv",
+            use_container_width=True
+        )
+    with col2:
+        if st.button("🗑️ 重設統計", use_container_width=True):
+            latency.reset()
+            ingest_service.message_queue.reset_counters()
+            st.rerun()
+
 # 注意：不自動啟動，需要用戶手動點擊連接按鈕
 # 這樣可以避免連接問題和更好的用戶控制
 
-# 自動更新機制
-if st.sidebar.checkbox("🔄 自動重新整理", value=True, help="勾選此項以每秒自動更新頁面數據"):
-    time.sleep(1)
-    st.rerun()
+def watch_for_updates():
+    """數據由上面各個 fragment 自行更新；只有連接狀態或 testtopic 訊息改變時才重新執行整個頁面"""
+    current = ingest_service.snapshot()
+    if (current.connected != snapshot.connected
+            or current.testtopic_messages[-1:] != snapshot.testtopic_messages[-1:]):
+        st.rerun()
 
+if auto_refresh:
+    st.fragment(watch_for_updates, run_every=REFRESH_INTERVAL)()
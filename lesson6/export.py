@@ -0,0 +1,196 @@
+"""
+數據匯出（按下下載連結時才產生，分段寫入、分段送出）
+
+原本每次重新整理都會把整份歷史轉成 CSV 字串，即使沒有人按下載。
+這裡改成：
+- 只有在使用者按下下載連結時才產生檔案
+- 從歷史資料庫分段讀取（HistoryStore.iter_raw），每一段編碼（壓縮）後立即以 HTTP chunked 送給瀏覽器，
+  伺服器端同時只保留一段數據，記憶體用量與時間範圍無關
+  （st.download_button 會把整個檔案以 bytes 保存在 Streamlit 的記憶體中，所以下載改由 ExportServer 提供）
+- 支援 CSV、gzip 壓縮的 CSV 與 Parquet（需要 pyarrow）
+"""
+import gzip
+import os
+import secrets
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow 為選用套件，沒有安裝時不提供 Parquet
+    pa = None
+    pq = None
+
+EXPORT_PORT = int(os.environ.get("EXPORT_PORT", "8502"))  # 下載伺服器的埠號（Streamlit 為 8501）
+EXPORT_LINK_TTL = 600  # 下載連結的有效時間（秒），每次重新整理頁面時延長
+EXPORT_COLUMNS = ["timestamp", "temperature", "humidity"]
+
+# 格式名稱: (副檔名, MIME 類型)
+EXPORT_FORMATS = {
+    "CSV": (".csv", "text/csv"),
+    "CSV (gzip 壓縮)": (".csv.gz", "application/gzip"),
+}
+if pq is not None:
+    EXPORT_FORMATS["Parquet"] = (".parquet", "application/vnd.apache.parquet")
+
+
+def fahrenheit(chunk):
+    """溫度欄位轉成華氏（匯出時依目前選擇的溫度單位）"""
+    chunk = chunk.copy()
+    chunk["temperature"] = chunk["temperature"] * 9/5 + 32
+    return chunk
+
+
+class _ChunkSink:
+    """只會往後寫的檔案物件：寫入的內容暫存到下一次 drain()，給 GzipFile 與 ParquetWriter 當輸出"""
+
+    def __init__(self):
+        self._parts = []
+        self._size = 0
+        self.closed = False
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._size += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._size
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def iter_export(chunks, fmt):
+    """
+    把多個 DataFrame 依序編碼成匯出檔案，逐段產生 bytes
+    chunks 可以是任何產生 DataFrame 的迭代器（只會同時保留一段在記憶體中）
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"不支援的匯出格式: {fmt}")
+    sink = _ChunkSink()
+    if fmt == "CSV":
+        steps = _write_csv(chunks, sink)
+    elif fmt == "CSV (gzip 壓縮)":
+        steps = _write_gzip_csv(chunks, sink)
+    else:
+        steps = _write_parquet(chunks, sink)
+    for _ in steps:
+        data = sink.drain()
+        if data:
+            yield data
+    data = sink.drain()
+    if data:
+        yield data
+
+
+def _write_csv(chunks, binary_file):
+    header = True
+    for chunk in chunks:
+        binary_file.write(chunk[EXPORT_COLUMNS].to_csv(index=False, header=header).encode("utf-8"))
+        header = False
+        yield
+    if header:  # 沒有任何數據時仍輸出標題列
+        binary_file.write((",".join(EXPORT_COLUMNS) + "\n").encode("utf-8"))
+
+
+def _write_gzip_csv(chunks, binary_file):
+    with gzip.GzipFile(fileobj=binary_file, mode="wb") as gz:
+        yield from _write_csv(chunks, gz)
+
+
+def _write_parquet(chunks, binary_file):
+    writer = None
+    for chunk in chunks:
+        table = pa.Table.from_pandas(chunk[EXPORT_COLUMNS], preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(binary_file, table.schema)
+        writer.write_table(table)  # 每一段寫成一個 row group
+        yield
+    if writer is None:
+        schema = pa.schema([("timestamp", pa.timestamp("ns")), ("temperature", pa.float64()), ("humidity", pa.float64())])
+        writer = pq.ParquetWriter(binary_file, schema)
+    writer.close()
+
+
+class ExportServer:
+    """
+    匯出檔案的下載伺服器（背景線程中的 HTTP 伺服器，整個行程共用一個）
+    每個 session 以 register() 取得一個隨機的下載路徑；瀏覽器開啟時才呼叫 make_chunks() 產生數據，
+    以 iter_export 邊編碼邊用 HTTP chunked 送出
+    """
+
+    def __init__(self, host="0.0.0.0", port=EXPORT_PORT):
+        self._exports = {}  # {token: (到期時間, make_chunks, 格式, 檔名開頭)}
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # chunked 傳輸需要 HTTP/1.1
+
+            def do_GET(self):
+                server._serve(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, name="export-server", daemon=True).start()
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def register(self, token, make_chunks, fmt, file_stem):
+        """
+        登記（或更新）一個下載，回傳 token；token 為 None 時產生新的
+        同一個 session 重新整理時傳入上次的 token，只更新內容與到期時間，不會累積
+        下載的檔名為 <file_stem>_<下載時間><副檔名>
+        """
+        now = time.monotonic()
+        with self._lock:
+            for expired in [key for key, entry in self._exports.items() if entry[0] < now]:
+                del self._exports[expired]
+            token = token or secrets.token_urlsafe(16)
+            self._exports[token] = (now + EXPORT_LINK_TTL, make_chunks, fmt, file_stem)
+        return token
+
+    def _serve(self, request):
+        token = request.path.lstrip("/").split("?", 1)[0]
+        with self._lock:
+            entry = self._exports.get(token)
+        if entry is None or entry[0] < time.monotonic():
+            request.send_error(404, explain="下載連結不存在或已過期，請重新整理頁面")
+            return
+        _, make_chunks, fmt, file_stem = entry
+        extension, mime = EXPORT_FORMATS[fmt]
+        file_name = f"{file_stem}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{extension}"
+        request.send_response(200)
+        request.send_header("Content-Type", mime)
+        request.send_header("Content-Disposition", f"attachment; filename*=UTF-8''{quote(file_name)}")
+        request.send_header("Cache-Control", "no-store")
+        request.send_header("Transfer-Encoding", "chunked")
+        request.end_headers()
+        try:
+            for data in iter_export(make_chunks(), fmt):
+                request.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            request.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # 使用者取消下載
+        except Exception as e:
+            # 標頭已經送出，只能中斷連線，瀏覽器會顯示下載失敗
+            print(f"匯出失敗: {e}")
+            request.close_connection = True
@@ -0,0 +1,209 @@
+"""
+多裝置（車隊）儲存與總覽
+
+儀表板原本只認得客廳的固定主題。這裡以萬用字元訂閱 home/+/temperature、home/+/humidity、
+home/+/light 與二進位訊框 home/+/frame，主題的第二層就是裝置名稱：
+- 每台裝置在 FleetStore 中佔一列，最新值、最後收到時間與訊息數都是以裝置索引存取的 NumPy 陣列
+- 每台裝置另有自己的 SeriesStore（容量較小），供點選單一裝置時查看歷史
+- 總覽表（overview_frame）以向量化方式計算資料新舊與警示狀態，幾百台裝置也只是一張表格
+- 摘要訊框（裝置端統計的 min / mean / max）直接存成序列：平均值寫入 temperature / humidity，
+  最小、最大值寫入 temperature_min、temperature_max 等序列（SUMMARY_SERIES），時間為時間窗起點
+"""
+import numpy as np
+import pandas as pd
+
+from timeseries import SeriesStore
+
+# 萬用字元主題：home/<裝置>/<量測項目>
+FLEET_TOPICS = {
+    "temperature": "home/+/temperature",
+    "humidity": "home/+/humidity",
+    "light": "home/+/light",
+    "frame": "home/+/frame",  # 一則訊息包含多個量測項目（見 frames.py）
+}
+FLEET_HISTORY_CAPACITY = 600   # 每台裝置每個序列保留的數據點（2 秒一筆約 20 分鐘）
+FLEET_HISTORY_HEADROOM = 128   # 每台裝置的環形緩衝區額外格數（裝置多時控制記憶體用量）
+STALE_AFTER_S = 30             # 超過這個秒數沒有收到數據視為離線（只送摘要的裝置放寬為兩個時間窗）
+SUMMARY_SERIES = ["temperature_min", "temperature_max", "humidity_min", "humidity_max"]
+
+# 警示門檻（與客廳卡片的提示相同）：(過低, 過高)
+ALARM_LIMITS = {
+    "temperature": (18, 28),
+    "humidity": (30, 70),
+}
+
+# 狀態依嚴重程度排列，總覽表以此排序
+ALARM_STATES = {
+    "offline": (3, "⚫ 離線"),
+    "temperature_high": (2, "🔴 溫度過高"),
+    "temperature_low": (2, "🔵 溫度過低"),
+    "humidity_high": (1, "🟠 濕度過高"),
+    "humidity_low": (1, "🟡 濕度過低"),
+    "normal": (0, "🟢 正常"),
+}
+
+
+def device_of(topic):
+    """主題 home/<裝置>/<量測項目> 中的裝置名稱"""
+    return topic.split("/")[1]
+
+
+class FleetStore:
+    """每台裝置一列的最新值陣列，加上每台裝置各自的序列儲存（不是線程安全的，由 IngestService 的鎖保護）"""
+
+    def __init__(self, history_capacity=FLEET_HISTORY_CAPACITY, history_headroom=FLEET_HISTORY_HEADROOM):
+        self.history_capacity = history_capacity
+        self.history_headroom = history_headroom
+        self._index = {}     # {裝置名稱: 列索引}
+        self._devices = []
+        self._series = {}    # {裝置名稱: SeriesStore}
+        self._allocate(64)
+
+    def _allocate(self, rows):
+        old = getattr(self, "_columns", None)
+        columns = {
+            "temperature": np.full(rows, np.nan),
+            "humidity": np.full(rows, np.nan),
+            "light": np.full(rows, np.nan),         # 1 = 開、0 = 關、NaN = 未知
+            "last_seen": np.zeros(rows, dtype=np.int64),   # epoch 奈秒
+            "messages": np.zeros(rows, dtype=np.int64),
+            "report_interval": np.zeros(rows),      # 摘要的時間窗（秒），0 = 逐筆回報
+        }
+        if old is not None:
+            for name, column in columns.items():
+                column[:len(old[name])] = old[name]
+        self._columns = columns
+
+    def __len__(self):
+        return len(self._devices)
+
+    def devices(self):
+        return list(self._devices)
+
+    def _row(self, device):
+        row = self._index.get(device)
+        if row is None:
+            row = self._index[device] = len(self._devices)
+            self._devices.append(device)
+            if row >= len(self._columns["last_seen"]):
+                self._allocate(2 * len(self._columns["last_seen"]))
+        return row
+
+    def _seen(self, row, timestamps):
+        columns = self._columns
+        columns["last_seen"][row] = max(columns["last_seen"][row], int(timestamps[-1]))
+        columns["messages"][row] += len(timestamps)
+
+    def record(self, device, metric, timestamps, values):
+        """一台裝置的一批數值（溫度或濕度），timestamps 依收到的先後排序"""
+        if len(timestamps) == 0:
+            return
+        row = self._row(device)
+        self._extend(device, row, metric, timestamps, values)
+        self._seen(row, timestamps)
+
+    def _extend(self, device, row, metric, timestamps, values):
+        self._columns[metric][row] = values[-1]
+        series = self._series.get(device)
+        if series is None:
+            series = self._series[device] = SeriesStore(self.history_capacity, self.history_headroom)
+        series.extend(metric, timestamps, values)
+
+    def record_frames(self, device, timestamps, temperature, humidity, light, received):
+        """
+        一台裝置的一批訊框（見 frames.py）：各欄位為等長陣列，NaN 代表該訊框沒有這個項目
+        timestamps = 取樣時間（批次上傳時比收到的時間早），received = 每則訊息收到的時間
+        """
+        if len(timestamps) == 0:
+            return
+        row = self._row(device)
+        for metric, values in (("temperature", temperature), ("humidity", humidity)):
+            valid = ~np.isnan(values)
+            if valid.any():
+                self._extend(device, row, metric, timestamps[valid], values[valid])
+        light = light[~np.isnan(light)]
+        if len(light):
+            self._columns["light"][row] = light[-1]
+        self._seen(row, received)
+
+    def record_summaries(self, device, summaries, received):
+        """
+        一台裝置的一批摘要（decode_summaries() 的結果中屬於這台裝置的列）
+        平均值與最小、最大值各自寫入序列；received = 每則訊息收到的時間
+        """
+        if len(summaries["start_ns"]) == 0:
+            return
+        row = self._row(device)
+        timestamps = summaries["start_ns"]
+        for metric in ("temperature", "humidity"):
+            valid = ~np.isnan(summaries[f"{metric}_mean"])
+            if not valid.any():
+                continue
+            self._extend(device, row, metric, timestamps[valid], summaries[f"{metric}_mean"][valid])
+            for stat in ("min", "max"):
+                self._series[device].extend(f"{metric}_{stat}", timestamps[valid], summaries[f"{metric}_{stat}"][valid])
+        self._columns["report_interval"][row] = (summaries["end_ns"][-1] - timestamps[-1]) / 1e9
+        self._seen(row, received)
+
+    def record_light(self, device, on, timestamps):
+        """一台裝置的電燈狀態（on 為 True / False，無法解析時為 None）"""
+        if len(timestamps) == 0:
+            return
+        row = self._row(device)
+        self._columns["light"][row] = np.nan if on is None else float(on)
+        self._seen(row, timestamps)
+
+    def overview(self):
+        """所有裝置的最新值（複製的陣列，可以在鎖外使用）"""
+        n = len(self._devices)
+        data = {"device": np.array(self._devices, dtype=object)}
+        for name, column in self._columns.items():
+            data[name] = column[:n].copy()
+        return data
+
+    def history(self, device, n=None):
+        """單一裝置的序列 {"temperature": {...}, "humidity": {...}}（同 SeriesStore.latest()）"""
+        series = self._series.get(device)
+        return {} if series is None else series.latest(n)
+
+    def clear(self):
+        self._index.clear()
+        self._devices.clear()
+        self._series.clear()
+        self._allocate(64)
+
+
+def alarm_states(overview, now_ns, stale_after=STALE_AFTER_S):
+    """向量化判斷每台裝置的狀態，回傳 (距離上次收到的秒數, 狀態代碼陣列)"""
+    age = (now_ns - overview["last_seen"]) / 1e9
+    temperature, humidity = overview["temperature"], overview["humidity"]
+    (temp_low, temp_high), (hum_low, hum_high) = ALARM_LIMITS["temperature"], ALARM_LIMITS["humidity"]
+    stale = np.maximum(stale_after, 2 * overview["report_interval"])
+    # NaN 的比較結果都是 False，沒有數據的項目不會觸發警示
+    states = np.select(
+        [age > stale, temperature > temp_high, temperature < temp_low, humidity > hum_high, humidity < hum_low],
+        ["offline", "temperature_high", "temperature_low", "humidity_high", "humidity_low"],
+        default="normal",
+    )
+    return age, states
+
+
+def overview_frame(overview, now_ns, stale_after=STALE_AFTER_S):
+    """總覽表：每台裝置一列，依嚴重程度、再依資料新舊排序（最需要注意的在最上面）"""
+    age, states = alarm_states(overview, now_ns, stale_after)
+    codes = np.array(sorted(ALARM_STATES))
+    found = np.searchsorted(codes, states)
+    severity = np.array([ALARM_STATES[code][0] for code in codes])[found]
+    labels = np.array([ALARM_STATES[code][1] for code in codes], dtype=object)[found]
+    light = np.where(np.isnan(overview["light"]), None, np.where(overview["light"] > 0, "開啟", "關閉"))
+    df = pd.DataFrame({
+        "狀態": labels,
+        "裝置": overview["device"],
+        "溫度 (°C)": overview["temperature"],
+        "濕度 (%)": overview["humidity"],
+        "電燈": light,
+        "最後更新 (秒前)": age,
+        "訊息數": overview["messages"],
+    })
+    order = np.lexsort((-age, -severity))
+    return df.iloc[order].reset_index(drop=True)
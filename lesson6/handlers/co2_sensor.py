@@ -0,0 +1,22 @@
+"""
+外掛處理器範例：CO2 感測器
+
+放在 handlers/ 資料夾中的模組會在 IngestService 建立時自動載入，
+只要提供 register(registry, service)，就能為新的裝置類型增加訂閱與處理邏輯，
+不需要修改 app.py 或 ingest.py。
+
+訊息格式：主題 home/<房間>/co2，內容 {"value": 650} 或 650
+"""
+import numpy as np
+
+from ingest import decode_values
+
+
+def register(registry, service):
+    @registry.handler("home/+/co2")
+    def on_co2(batch):
+        # 同一主題的一整批訊息，只顯示最新的數值
+        values = decode_values(batch.payloads[-1:])
+        if len(values) and not np.isnan(values[-1]):
+            room = batch.topic.split("/")[1]
+            service.plugin_state[f"{room} CO2 (ppm)"] = round(float(values[-1]), 1)
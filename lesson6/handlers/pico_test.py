@@ -0,0 +1,33 @@
+"""
+外掛處理器：lesson7 的 Pico W 發佈器
+
+訂閱 pico/test，顯示最新一則訊息。
+訊息格式：{"message": "Hello from Pico W! #1", "ts": ..., "seq": 1} 或純文字；
+ts / seq 由接收服務統一計入「延遲診斷」，這裡不需要另外處理。
+另外帶有 profile / radio_on_ms / messages 時（lesson7 的省電模式計數器），
+以及 report / samples / frames 時（回報方式、取樣次數與實際上傳的訊框數），一併顯示。
+"""
+import json
+
+
+def register(registry, service):
+    @registry.handler("pico/test")
+    def on_pico(batch):
+        payload = batch.payloads[-1].decode("utf-8", errors="replace")
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            data = {}
+        service.plugin_state["Pico W 訊息"] = data.get("message", payload)
+        if "profile" in data:
+            service.plugin_state["Pico W 省電模式"] = data["profile"]
+        if "radio_on_ms" in data:
+            service.plugin_state["Pico W 無線電開啟 (秒)"] = round(float(data["radio_on_ms"]) / 1000, 1)
+        if "messages" in data:
+            service.plugin_state["Pico W 已送訊息數"] = data["messages"]
+        if "report" in data:
+            service.plugin_state["Pico W 回報方式"] = data["report"]
+        if "samples" in data and "frames" in data:
+            service.plugin_state["Pico W 取樣 / 上傳訊框"] = f"{data['samples']} / {data['frames']}"
@@ -0,0 +1,251 @@
+"""
+永久保存的歷史資料庫（SQLite，WAL 模式）
+
+- samples：原始數據（每個序列一列一筆），由接收服務整批寫入，一批一個交易
+- rollups：預先計算好的 1 分鐘 / 1 小時 / 1 天 最小值、平均值、最大值，
+  寫入原始數據時在同一個交易中以 UPSERT 累加，不需要事後重算
+圖表依照時間範圍挑選合適的彙總層級，只讀取畫面放得下的點數，
+因此可以顯示數天到數月的數據而不必載入原始數據。
+"""
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from timeseries import ALIGN_BUCKET_NS, LOCAL_TIMEZONE, asof_join, ffill, to_frame
+
+HISTORY_DB_PATH = os.environ.get("HISTORY_DB_PATH", str(Path(__file__).parent / "history.db"))
+RAW_RETENTION_DAYS = 30      # 原始數據保留天數（彙總數據永久保留）
+CHART_MAX_POINTS = 1000      # 圖表一次最多讀取的點數
+EXPORT_CHUNK_ROWS = 50_000   # 匯出時每次從資料庫讀取的筆數
+
+NS = 1_000_000_000
+# 彙總層級（秒）
+ROLLUP_LEVELS = {
+    60: "1 分鐘",
+    3600: "1 小時",
+    86400: "1 天",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    series TEXT NOT NULL,
+    ts INTEGER NOT NULL,          -- epoch 奈秒
+    value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samples_series_ts ON samples (series, ts);
+CREATE TABLE IF NOT EXISTS rollups (
+    level INTEGER NOT NULL,       -- 彙總層級（秒）
+    series TEXT NOT NULL,
+    bucket INTEGER NOT NULL,      -- 區間起點（epoch 奈秒）
+    n INTEGER NOT NULL,
+    vmin REAL NOT NULL,
+    vsum REAL NOT NULL,
+    vmax REAL NOT NULL,
+    PRIMARY KEY (level, series, bucket)
+) WITHOUT ROWID;
+"""
+
+UPSERT_ROLLUP = """
+INSERT INTO rollups (level, series, bucket, n, vmin, vsum, vmax) VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (level, series, bucket) DO UPDATE SET
+    n = n + excluded.n,
+    vmin = min(vmin, excluded.vmin),
+    vsum = vsum + excluded.vsum,
+    vmax = max(vmax, excluded.vmax)
+"""
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
+def rollup(timestamps, values, level):
+    """
+    向量化計算一批數據在某個層級的彙總
+    回傳 (bucket, n, min, sum, max) 五個陣列
+    """
+    width = level * NS
+    buckets = timestamps // width * width
+    order = np.argsort(buckets, kind='stable')
+    buckets, values = buckets[order], values[order]
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    counts = np.diff(np.r_[starts, len(buckets)])
+    return (
+        buckets[starts],
+        counts,
+        np.minimum.reduceat(values, starts),
+        np.add.reduceat(values, starts),
+        np.maximum.reduceat(values, starts),
+    )
+
+
+class HistoryStore:
+    """溫濕度歷史資料庫：寫入端只有接收服務一個，讀取端每個線程各自一條連線"""
+
+    def __init__(self, path=HISTORY_DB_PATH, retention_days=RAW_RETENTION_DAYS):
+        self.path = path
+        self.retention_days = retention_days
+        self._write_lock = threading.Lock()
+        self._writer = _connect(path)
+        self._writer.executescript(SCHEMA)
+        self._readers = threading.local()
+        self._last_prune = 0.0
+
+    def _reader(self):
+        conn = getattr(self._readers, "conn", None)
+        if conn is None:
+            conn = self._readers.conn = _connect(self.path)
+        return conn
+
+    def write(self, batches):
+        """
+        整批寫入：batches = {序列名稱: (epoch 奈秒陣列, 數值陣列)}
+        原始數據與所有層級的彙總在同一個交易中完成
+        """
+        batches = {name: b for name, b in batches.items() if len(b[0])}
+        if not batches:
+            return
+        with self._write_lock:
+            conn = self._writer
+            conn.execute("BEGIN")
+            try:
+                for series, (timestamps, values) in batches.items():
+                    timestamps = np.asarray(timestamps, dtype=np.int64)
+                    values = np.asarray(values, dtype=float)
+                    conn.executemany(
+                        "INSERT INTO samples (series, ts, value) VALUES (?, ?, ?)",
+                        zip([series] * len(values), timestamps.tolist(), values.tolist())
+                    )
+                    for level in ROLLUP_LEVELS:
+                        buckets, counts, vmin, vsum, vmax = rollup(timestamps, values, level)
+                        conn.executemany(UPSERT_ROLLUP, zip(
+                            [level] * len(buckets), [series] * len(buckets), buckets.tolist(),
+                            counts.tolist(), vmin.tolist(), vsum.tolist(), vmax.tolist()
+                        ))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            # 每小時清理一次過期的原始數據
+            if time.time() - self._last_prune > 3600:
+                self._last_prune = time.time()
+                cutoff = time.time_ns() - self.retention_days * 86400 * NS
+                conn.execute("DELETE FROM samples WHERE ts < ?", (cutoff,))
+
+    def choose_level(self, series, start_ns, end_ns, max_points=CHART_MAX_POINTS):
+        """挑選畫面放得下的最細層級：0 代表原始數據，否則為彙總層級（秒）"""
+        count = self._reader().execute(
+            "SELECT COUNT(*) FROM (SELECT 1 FROM samples WHERE series = ? AND ts >= ? AND ts < ? LIMIT ?)",
+            (series, start_ns, end_ns, max_points + 1)
+        ).fetchone()[0]
+        if count <= max_points:
+            return 0
+        span = (end_ns - start_ns) / NS
+        for level in ROLLUP_LEVELS:
+            if span / level <= max_points:
+                return level
+        return max(ROLLUP_LEVELS)
+
+    def query(self, series, start_ns, end_ns, level):
+        """
+        讀取單一序列：回傳 DataFrame（timestamp, mean, min, max），timestamp 為本地時間
+        level = 0 時讀原始數據（mean/min/max 都是原始值）
+        """
+        conn = self._reader()
+        if level == 0:
+            rows = conn.execute(
+                "SELECT ts, value, value, value FROM samples WHERE series = ? AND ts >= ? AND ts < ? ORDER BY ts",
+                (series, start_ns, end_ns)
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT bucket, vsum / n, vmin, vmax FROM rollups "
+                "WHERE level = ? AND series = ? AND bucket >= ? AND bucket < ? ORDER BY bucket",
+                (level, series, start_ns - start_ns % (level * NS), end_ns)
+            ).fetchall()
+        df = pd.DataFrame(rows, columns=["timestamp", "mean", "min", "max"])
+        df["timestamp"] = (pd.to_datetime(df["timestamp"].astype("int64"), unit='ns', utc=True)
+                           .dt.tz_convert(LOCAL_TIMEZONE)
+                           .dt.tz_localize(None))
+        return df
+
+    def time_bounds(self, series):
+        """回傳某序列最早與最晚的時間（epoch 奈秒），沒有資料時回傳 None"""
+        row = self._reader().execute(
+            "SELECT min(bucket), max(bucket) + ? FROM rollups WHERE level = ? AND series = ?",
+            (60 * NS, 60, series)
+        ).fetchone()
+        return None if row[0] is None else row
+
+    def raw_series(self, series, start_ns, end_ns):
+        """讀取單一序列的原始數據：回傳 (epoch 奈秒陣列, 數值陣列)"""
+        rows = self._reader().execute(
+            "SELECT ts, value FROM samples WHERE series = ? AND ts >= ? AND ts < ? ORDER BY ts",
+            (series, start_ns, end_ns)
+        ).fetchall()
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        timestamps, values = zip(*rows)
+        return np.array(timestamps, dtype=np.int64), np.array(values, dtype=float)
+
+    def chart_frame(self, series_names, start_ns, end_ns, max_points=CHART_MAX_POINTS, bucket_ns=ALIGN_BUCKET_NS):
+        """
+        圖表用：依時間範圍挑選層級後讀取多個序列的平均值，合併成一個 DataFrame
+        原始數據的各序列時間點不同，以 asof_join 依 bucket_ns 對齊；彙總數據的區間本來就一致
+        回傳 (DataFrame, 層級)，DataFrame 欄位為 timestamp 與各序列名稱
+        """
+        level = max(self.choose_level(name, start_ns, end_ns, max_points) for name in series_names)
+        if level == 0:
+            series = {}
+            for name in series_names:
+                timestamps, values = self.raw_series(name, start_ns, end_ns)
+                series[name] = {"timestamp": timestamps, "value": values}
+            return to_frame(asof_join(series, bucket_ns)), level
+        frames = []
+        for name in series_names:
+            df = self.query(name, start_ns, end_ns, level)
+            frames.append(df.set_index("timestamp")["mean"].rename(name))
+        merged = pd.concat(frames, axis=1).sort_index()
+        return merged.reset_index(), level
+
+    def iter_raw(self, series_names, start_ns, end_ns, chunk_rows=EXPORT_CHUNK_ROWS):
+        """
+        依時間順序分段讀取原始數據（匯出用，記憶體用量只和 chunk_rows 有關）
+        每段為一個 DataFrame：timestamp 與各序列名稱的欄位，
+        每一列只有一個序列有新值，其他序列沿用前一個數值（跨段也會延續）
+        """
+        placeholders = ",".join("?" * len(series_names))
+        cursor = self._reader().execute(
+            f"SELECT ts, series, value FROM samples WHERE series IN ({placeholders}) AND ts >= ? AND ts < ? ORDER BY ts",
+            (*series_names, start_ns, end_ns)
+        )
+        codes = {name: i for i, name in enumerate(series_names)}
+        carry = [np.nan] * len(series_names)
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            ts, series, values = zip(*rows)
+            series = np.fromiter(map(codes.__getitem__, series), dtype=np.int64, count=len(rows))
+            values = np.array(values, dtype=float)
+            data = {
+                "timestamp": (pd.to_datetime(np.array(ts, dtype=np.int64), unit='ns', utc=True)
+                              .tz_convert(LOCAL_TIMEZONE)
+                              .tz_localize(None))
+            }
+            for name, code in codes.items():
+                column = np.where(series == code, values, np.nan)
+                column = ffill(column, carry[code])
+                carry[code] = column[-1]
+                data[name] = column
+            yield pd.DataFrame(data)
+
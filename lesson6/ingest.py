@@ -0,0 +1,459 @@
+"""
+MQTT 接收服務（每個行程只有一個）
+
+原本每個瀏覽器 session 都會建立自己的 paho 客戶端、消息隊列與歷史紀錄，
+觀看的人越多，Broker 連線數與解析工作就跟著倍增。
+這裡把訂閱與解析集中到一個共用的 IngestService，
+app.py 透過 st.cache_resource 取得同一個實例，各 session 只讀取唯讀快照。
+處理隊列與寫入歷史由服務自己的背景線程負責：沒有人開著頁面時資料也照常寫入。
+"""
+import json
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from itertools import groupby
+from datetime import datetime
+from types import MappingProxyType
+
+import numpy as np
+import paho.mqtt.client as mqtt
+from sensor_frames import decode_frames, decode_summaries
+
+from mqtt_config import (
+    MQTT_BROKER,
+    MQTT_PORT,
+    MQTT_TOPIC_LIGHT,
+    MQTT_TOPIC_TEMP,
+    MQTT_TOPIC_HUMIDITY,
+    MQTT_TOPIC,
+)
+from fleet import FLEET_TOPICS, FleetStore, device_of
+from latency import LatencyStats
+from message_queue import QUEUE_MAXSIZE, BoundedMessageQueue
+from timeseries import HISTORY_CAPACITY, SeriesStore
+from topics import TopicBatch, TopicRegistry, load_plugins
+
+DRAIN_INTERVAL = 0.2  # 背景線程多久處理一次消息隊列（秒），同一段時間內的訊息整批解碼與寫入
+
+CONNECT_ERROR_MESSAGES = {
+    1: "協議版本不正確",
+    2: "客戶端 ID 無效",
+    3: "伺服器不可用",
+    4: "使用者名稱或密碼錯誤",
+    5: "未授權"
+}
+
+
+@dataclass(frozen=True)
+class IngestSnapshot:
+    """提供給各 session 的唯讀快照"""
+    version: int
+    connected: bool
+    light_status: str
+    temperature: float | None
+    humidity: float | None
+    history: dict  # {序列名稱: {"timestamp": 唯讀視圖, "value": 唯讀視圖}}，見 SeriesStore.latest()
+    history_size: int  # 各序列中最多的數據點數
+    testtopic_messages: tuple
+    plugin_state: MappingProxyType  # 外掛處理器（handlers/）提供的狀態
+    processed_at: int  # 最後一次處理訊息的時間（epoch 奈秒），用來量測畫面更新延遲
+    fleet: dict  # 各裝置的最新值 {"device": ..., "temperature": ..., ...}，見 FleetStore.overview()
+
+
+# {"value": 25.3}，可以附帶延遲量測用的 "ts" 與 "seq"（見 latency.py）
+_VALUE_PAYLOAD = re.compile(
+    rb'^\{"value": ?(-?[0-9.eE+-]+)(?:, ?"ts": ?[0-9.eE+-]+)?(?:, ?"seq": ?[0-9]+)?\}$', re.MULTILINE
+)
+
+
+def decode_values(payloads):
+    """
+    批次解碼數值訊息（{"value": 25.3} 或純數字 25.3）
+    把整批 payload 串成一個 JSON 陣列，只呼叫一次 json.loads；
+    若其中有格式錯誤的訊息，才退回逐筆解碼。無法解碼的值為 NaN
+    """
+    if not payloads:
+        return np.empty(0)
+    # 最快路徑：全部都是發佈器產生的標準格式 {"value": 25.3}，用一次正規表示式取出數字
+    joined = b"\n".join(payloads)
+    numbers = _VALUE_PAYLOAD.findall(joined)
+    if len(numbers) == len(payloads) and joined.count(b"\n") == len(payloads) - 1:
+        try:
+            return np.array(list(map(float, numbers)))
+        except ValueError:
+            pass
+    try:
+        items = json.loads(b"[" + b",".join(payloads) + b"]")
+    except ValueError:
+        items = []
+        for payload in payloads:
+            try:
+                items.append(json.loads(payload))
+            except ValueError:
+                items.append(None)
+    try:
+        # 常見情況：全部都是 {"value": x}
+        return np.array([item["value"] for item in items], dtype=float)
+    except (TypeError, KeyError, ValueError):
+        pass
+    values = np.empty(len(items))
+    for i, item in enumerate(items):
+        if isinstance(item, dict):
+            item = item.get("value")
+        try:
+            values[i] = float(item)
+        except (TypeError, ValueError):
+            values[i] = np.nan
+    return values
+
+
+def _decode_series(batch):
+    """把一批數值訊息解碼成 (epoch 奈秒陣列, 數值陣列)，去掉無法解碼的訊息"""
+    values = decode_values(batch.payloads)
+    timestamps = np.array(batch.timestamps, dtype=np.int64)
+    valid = ~np.isnan(values)
+    return timestamps[valid], values[valid]
+
+
+def _concat_series(parts):
+    if not parts:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    if len(parts) == 1:
+        return parts[0]
+    timestamps = np.concatenate([p[0] for p in parts])
+    values = np.concatenate([p[1] for p in parts])
+    order = np.argsort(timestamps, kind='stable')
+    return timestamps[order], values[order]
+
+
+def parse_light(payload):
+    """解析電燈開關狀態：{"status": "on"} 或純文字 on / off / 開 / 關"""
+    payload = payload.decode('utf-8', errors='replace')
+    try:
+        data = json.loads(payload) if payload.startswith('{') else {"status": payload}
+        status = str(data.get("status", payload)).lower()
+    except ValueError:
+        status = payload.lower()
+    if status in ["on", "開", "1", "true"]:
+        return "開啟"
+    if status in ["off", "關", "0", "false"]:
+        return "關閉"
+    return payload
+
+
+def parse_value(payload):
+    """解析單一數值訊息，無法解碼時回傳 None"""
+    value = decode_values([payload])[0]
+    return None if np.isnan(value) else float(value)
+
+
+class IngestService:
+    """共用的 MQTT 訂閱服務：一個訂閱器、一份解析後的狀態"""
+
+    def __init__(self, broker=MQTT_BROKER, port=MQTT_PORT, history_capacity=HISTORY_CAPACITY, history_store=None,
+                 queue_maxsize=QUEUE_MAXSIZE, queue_policy="drop-oldest"):
+        self.broker = broker
+        self.port = port
+        self.client = None
+        self.connected = False
+        self.last_error = None
+        # 線程安全、有上限的消息隊列（paho 線程 -> 處理端），滿載時依策略丟棄或合併
+        self.message_queue = BoundedMessageQueue(queue_maxsize, queue_policy)
+
+        # 解析後的狀態，只能在持有 _lock 時修改
+        self._lock = threading.Lock()
+        self._connect_event = threading.Event()
+        self._drain_thread = None  # 處理消息隊列的背景線程（start() 啟動、stop() 停止）
+        self._drain_stop = threading.Event()
+        self._version = 0
+        self._snapshot = None
+        # 狀態卡片只需要最新值：on_message 直接覆寫每個主題的最新訊息（單一 dict 指派，不經過隊列），
+        # 快照時只解碼這幾則，工作量與主題數成正比，和訊息數無關
+        self._latest = dict.fromkeys((MQTT_TOPIC_LIGHT, MQTT_TOPIC_TEMP, MQTT_TOPIC_HUMIDITY))
+        self._latest_count = 0   # on_message 寫入最新值的次數（只有 paho 線程會修改）
+        self._latest_seen = 0    # 上一次建立快照時的 _latest_count
+        # 每個序列各自保存實際收到的數據點，顯示時才以 asof_join 對齊成表格
+        self.series = SeriesStore(history_capacity)
+        self.history_store = history_store  # 永久保存的歷史資料庫（HistoryStore，可為 None）
+        self.testtopic_messages = deque(maxlen=100)  # 儲存 testtopic 訊息
+        self.plugin_state = {}  # 外掛處理器自行存放的狀態（顯示在儀表板上）
+        self._pending_series = {"temperature": [], "humidity": []}  # 這一批解碼後、尚未寫入的序列
+        self._processed_at = 0
+        self.latency = LatencyStats()  # 端到端延遲統計（發佈 → 收到 → 處理 → 畫面）
+        self.fleet = FleetStore()  # 以萬用字元訂閱的多裝置數據（home/<裝置>/...）
+
+        # 主題處理器登錄表：同時決定訂閱清單與分派表
+        self.registry = TopicRegistry()
+        self.registry.subscribe(MQTT_TOPIC_LIGHT)  # 電燈只需要最新值，不進入隊列
+        self.registry.register(MQTT_TOPIC_TEMP, self._handle_temperature)
+        self.registry.register(MQTT_TOPIC_HUMIDITY, self._handle_humidity)
+        self.registry.register(MQTT_TOPIC, self._handle_testtopic)  # 測試主題
+        # 多裝置：主題的第二層為裝置名稱（客廳的溫濕度也會出現在裝置總覽中）
+        self.registry.register(FLEET_TOPICS["temperature"], self._handle_fleet_value)
+        self.registry.register(FLEET_TOPICS["humidity"], self._handle_fleet_value)
+        self.registry.register(FLEET_TOPICS["light"], self._handle_fleet_light)
+        self.registry.register(FLEET_TOPICS["frame"], self._handle_fleet_frame)
+        self.plugins = load_plugins(self.registry, self)
+
+    # MQTT 回調函數（在 paho 背景線程中執行，只把訊息放進隊列）
+    def on_connect(self, client, userdata, flags, reason_code, properties):
+        # 處理 reason_code（可能是整數或 ReasonCode 對象）
+        rc_value = reason_code.value if hasattr(reason_code, 'value') else int(reason_code)
+
+        if rc_value == 0:
+            # 一次訂閱登錄表中的所有主題過濾器
+            client.subscribe(self.registry.subscriptions())
+            self.connected = True
+            self.last_error = None
+            print(f"✓ 已連接到 MQTT Broker 並訂閱主題")
+        else:
+            self.connected = False
+            self.last_error = CONNECT_ERROR_MESSAGES.get(rc_value, f"未知錯誤 (代碼: {rc_value})")
+            print(f"✗ 連接失敗: {self.last_error}")
+        self._connect_event.set()  # 通知連接結果
+
+    def on_disconnect(self, client, userdata, flags, reason_code, properties):
+        self.connected = False
+
+    def on_message(self, client, userdata, message):
+        """
+        MQTT 訊息回調（在背景線程中執行）
+        - 狀態卡片的主題：覆寫最新值（後到的直接取代先到的）
+        - 有批次處理器的主題：放入隊列，交給 process_message_queue 寫入歷史
+        """
+        try:
+            topic = message.topic
+            received = time.time_ns()
+            if topic in self._latest:
+                self._latest[topic] = (message.payload, received)
+                self._latest_count += 1
+            if self.registry.dispatch(topic):
+                # 使用 tuple（topic, payload bytes, epoch 奈秒, qos），解碼留給批次處理
+                self.message_queue.put((topic, message.payload, received, message.qos))
+        except Exception as e:
+            print(f"處理訊息時發生錯誤: {e}")
+
+    def start(self, timeout=3):
+        """啟動共用的 MQTT 訂閱器，已連接時直接回傳 True"""
+        with self._lock:
+            if self.client is not None and self.connected:
+                return True
+            if self.client is not None:
+                self._stop_client()
+            try:
+                self._connect_event.clear()
+                # 創建客戶端（使用新的 Callback API 版本 2，參考 lesson6_2.ipynb）
+                client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+                client.on_connect = self.on_connect
+                client.on_disconnect = self.on_disconnect
+                client.on_message = self.on_message
+                client.connect(self.broker, self.port, 60)
+                # 使用非阻塞模式啟動網路循環（參考 lesson6_2.ipynb 第三個 cell 的 loop_start）
+                client.loop_start()
+                self.client = client
+            except Exception as e:
+                self.last_error = str(e)
+                return False
+            self._start_drain()
+
+        # 等待連接確認（最多等待 timeout 秒）
+        if not self._connect_event.wait(timeout=timeout):
+            self.last_error = "連接超時，請檢查 MQTT Broker 是否運行"
+            return False
+        return self.connected
+
+    def stop(self):
+        """停止共用的 MQTT 訂閱器（會影響所有觀看中的 session）"""
+        with self._lock:
+            self._stop_client()
+        self._stop_drain()
+        self.process_message_queue()  # 斷線前已收到的訊息照樣寫入
+
+    def _start_drain(self):
+        """啟動處理消息隊列的背景線程（已在執行時不重複啟動）"""
+        if self._drain_thread is not None and self._drain_thread.is_alive():
+            return
+        self._drain_stop.clear()
+        self._drain_thread = threading.Thread(target=self._drain_loop, name="ingest-drain", daemon=True)
+        self._drain_thread.start()
+
+    def _stop_drain(self):
+        self._drain_stop.set()
+        if self._drain_thread is not None and self._drain_thread is not threading.current_thread():
+            self._drain_thread.join()
+        self._drain_thread = None
+
+    def _drain_loop(self):
+        """每 DRAIN_INTERVAL 秒處理一次隊列，和有沒有 session 在觀看無關"""
+        while not self._drain_stop.wait(DRAIN_INTERVAL):
+            try:
+                self.process_message_queue()
+            except Exception as e:
+                print(f"處理消息隊列時發生錯誤: {e}")
+
+    def _stop_client(self):
+        if self.client:
+            self.client.loop_stop()
+            self.client.disconnect()
+            self.client = None
+        self.connected = False
+        self._touch()
+
+    def _touch(self):
+        """狀態有變更：更新版本號並讓快照失效"""
+        self._version += 1
+        self._snapshot = None
+
+    def process_message_queue(self):
+        """
+        批次處理消息隊列：一次取出全部訊息、依主題分組、批次解碼後整批寫入歷史
+        由背景線程（_drain_loop）定期呼叫，各 session 只讀取 snapshot()
+        """
+        batch = self.message_queue.drain()
+        if not batch:
+            return
+        with self._lock:
+            now = time.time_ns()
+            # 轉置成欄（topics, payloads, ...），再依主題做穩定排序分組，全部在 C 層完成
+            topics, payloads, timestamps, qos_list = zip(*batch)
+            self.latency.record_received(timestamps, now)
+            order = sorted(range(len(topics)), key=topics.__getitem__)
+            for topic, idx in groupby(order, key=topics.__getitem__):
+                handlers = self.registry.dispatch(topic)
+                if not handlers:
+                    continue
+                idx = list(idx)
+                topic_batch = TopicBatch(
+                    topic,
+                    list(map(payloads.__getitem__, idx)),
+                    list(map(timestamps.__getitem__, idx)),
+                    list(map(qos_list.__getitem__, idx)),
+                )
+                try:
+                    # 訊框的送出時間與序號由 _handle_fleet_frame 解碼時一併記錄
+                    if not topic.endswith("/frame"):
+                        self.latency.record_sent(topic, topic_batch.payloads, topic_batch.timestamps)
+                except Exception as e:
+                    print(f"量測 {topic} 延遲時發生錯誤: {e}")
+                for handler in handlers:
+                    try:
+                        handler(topic_batch)
+                    except Exception as e:
+                        print(f"處理 {topic} 訊息時發生錯誤: {e}")
+            try:
+                self._flush_history()
+            except Exception as e:
+                print(f"寫入歷史記錄時發生錯誤: {e}")
+            self._processed_at = now
+            self._touch()
+
+    # 內建的主題處理器（每個處理器收到同一主題的一整批訊息）
+    def _handle_temperature(self, batch):
+        """處理溫度數據（批次解碼，等整批分派完再寫入歷史）"""
+        self._pending_series["temperature"].append(_decode_series(batch))
+
+    def _handle_humidity(self, batch):
+        """處理濕度數據（批次解碼，等整批分派完再寫入歷史）"""
+        self._pending_series["humidity"].append(_decode_series(batch))
+
+    def _handle_testtopic(self, batch):
+        """處理 testtopic 訊息（最多只保留最後 100 筆）"""
+        keep = self.testtopic_messages.maxlen
+        for payload, timestamp, qos in zip(batch.payloads[-keep:], batch.timestamps[-keep:], batch.qos[-keep:]):
+            self.testtopic_messages.append({
+                "timestamp": datetime.fromtimestamp(timestamp / 1e9),
+                "topic": batch.topic,
+                "payload": payload.decode('utf-8', errors='replace'),
+                "qos": qos
+            })
+
+    def _handle_fleet_value(self, batch):
+        """處理任一裝置的溫度或濕度（home/<裝置>/temperature、home/<裝置>/humidity）"""
+        timestamps, values = _decode_series(batch)
+        self.fleet.record(device_of(batch.topic), batch.topic.rsplit("/", 1)[1], timestamps, values)
+
+    def _handle_fleet_light(self, batch):
+        """處理任一裝置的電燈狀態（只保留最後一則）"""
+        status = parse_light(batch.payloads[-1])
+        on = True if status == "開啟" else False if status == "關閉" else None
+        self.fleet.record_light(device_of(batch.topic), on, batch.timestamps)
+
+    def _handle_fleet_frame(self, batch):
+        """
+        處理任一裝置的訊框（二進位或 JSON，一則包含溫度、濕度與電燈，見 frames.py）
+        一則二進位訊息可以包含多筆取樣（批次上傳），歷史以各筆的取樣時間記錄
+        摘要訊框（裝置端的 min / mean / max）另外解碼，以時間窗起點寫入歷史；送出時間視為時間窗結束
+        """
+        device = device_of(batch.topic)
+        received = np.array(batch.timestamps, dtype=np.int64)
+        frames = decode_frames(batch.payloads)
+        if len(frames["message"]):
+            row_received = received[frames["message"]]
+            sent_ns = frames["sent_ns"]
+            sampled = np.where(np.isnan(sent_ns), row_received, np.nan_to_num(sent_ns)).astype(np.int64)
+            self.fleet.record_frames(device, sampled, frames["temperature"], frames["humidity"], frames["light"],
+                                     received[np.unique(frames["message"])])
+            self.latency.record_stamps(batch.topic, sent_ns, frames["seq"], row_received)
+        summaries = decode_summaries(batch.payloads)
+        if len(summaries["message"]):
+            row_received = received[summaries["message"]]
+            self.fleet.record_summaries(device, summaries, received[np.unique(summaries["message"])])
+            self.latency.record_stamps(batch.topic, summaries["end_ns"].astype(float), summaries["seq"], row_received)
+
+    def device_history(self, device, n=None):
+        """單一裝置的溫度、濕度序列（同 SeriesStore.latest()，可交給 asof_join）"""
+        with self._lock:
+            return self.fleet.history(device, n)
+
+    def _flush_history(self):
+        """把這一批的各序列整批寫入記憶體中的序列儲存，並以一個交易寫入歷史資料庫"""
+        batches = {}
+        for name, parts in self._pending_series.items():
+            if parts:
+                batches[name] = _concat_series(parts)
+                parts.clear()
+        if not batches:
+            return
+        for name, (timestamps, values) in batches.items():
+            self.series.extend(name, timestamps, values)
+        if self.history_store is not None:
+            self.history_store.write(batches)
+
+    @property
+    def version(self):
+        """目前狀態的版本號（數據或連接狀態改變時遞增）"""
+        return self.snapshot().version
+
+    def clear_testtopic_messages(self):
+        with self._lock:
+            self.testtopic_messages.clear()
+            self._touch()
+
+    def snapshot(self):
+        """取得目前狀態的唯讀快照（同一版本只建立一次，所有 session 共用）"""
+        with self._lock:
+            # 連接狀態與最新值由 paho 線程直接更新，不經過 _touch()
+            if self._snapshot is not None and (self._snapshot.connected != self.connected
+                                               or self._latest_seen != self._latest_count):
+                self._touch()
+            if self._snapshot is None:
+                self._latest_seen = self._latest_count
+                light = self._latest[MQTT_TOPIC_LIGHT]
+                temperature = self._latest[MQTT_TOPIC_TEMP]
+                humidity = self._latest[MQTT_TOPIC_HUMIDITY]
+                self._snapshot = IngestSnapshot(
+                    version=self._version,
+                    connected=self.connected,
+                    light_status="未知" if light is None else parse_light(light[0]),
+                    temperature=None if temperature is None else parse_value(temperature[0]),
+                    humidity=None if humidity is None else parse_value(humidity[0]),
+                    history=self.series.latest(),
+                    history_size=max(map(self.series.size, self.series.names()), default=0),
+                    testtopic_messages=tuple(MappingProxyType(dict(m)) for m in self.testtopic_messages),
+                    plugin_state=MappingProxyType(dict(self.plugin_state)),
+                    processed_at=self._processed_at,
+                    fleet=self.fleet.overview(),
+                )
+            return self._snapshot
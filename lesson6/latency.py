@@ -0,0 +1,242 @@
+"""
+端到端延遲量測
+
+發佈端在 JSON 中附上送出時間與序號：{"value": 25.3, "ts": 1760000000123.456, "seq": 42}
+- ts  = 送出時間（epoch 毫秒，可以有小數；Pico 需先以 NTP 校時）
+- seq = 同一個主題由 1 開始遞增的序號
+接收服務把每則訊息的時間拆成三段，各自累積成直方圖：
+- broker：ts → on_message 收到（網路 + Broker，跨機器時包含時鐘誤差）
+- queue：on_message 收到 → process_message_queue 處理（所有訊息都會量測）
+- ui：處理完成 → 瀏覽器畫面重新執行完畢（每次重新整理一筆）
+序號用來計算遺失與亂序（含重複）的訊息數。
+"""
+import itertools
+import re
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+# 直方圖：10 µs ~ 100 秒，每 10 倍切 20 格（相鄰格距約 12%）
+HISTOGRAM_EDGES_NS = np.geomspace(1e4, 1e11, 7 * 20 + 1)
+PERCENTILES = (50, 90, 99)
+RESTART_GAP = 1000  # 序號倒退超過這個數字時視為發佈端重新啟動，而不是亂序
+
+STAGES = {
+    "broker": "發佈 → 收到（網路 + Broker）",
+    "queue": "收到 → 處理（隊列等待）",
+    "ui": "處理 → 畫面更新",
+}
+
+# 每個主題一個序號產生器（同一個行程中的手動發送與自動發送共用）
+_sequences = defaultdict(lambda: itertools.count(1))
+_sequences_lock = threading.Lock()
+
+
+def stamp(data, topic):
+    """在要發佈的 dict 中加上送出時間與序號，回傳同一個 dict"""
+    with _sequences_lock:
+        seq = next(_sequences[topic])
+    data["ts"] = round(time.time_ns() / 1e6, 3)
+    data["seq"] = seq
+    return data
+
+
+# 每一行取出 ts 與 seq（兩者都可省略、順序不拘）
+_STAMP_LINE = re.compile(
+    rb'^(?=(?:.*?"ts": ?(-?[0-9.eE+-]+))?)(?=(?:.*?"seq": ?([0-9]+))?).*$', re.MULTILINE
+)
+_TS = re.compile(rb'"ts": ?(-?[0-9.eE+-]+)')
+_SEQ = re.compile(rb'"seq": ?([0-9]+)')
+
+
+def extract_stamps(payloads):
+    """
+    取出一批 payload 的送出時間（epoch 奈秒，沒有時為 NaN）與序號（沒有時為 -1）
+    整批都沒有 "ts" 時直接回傳 None，未量測的流量幾乎沒有額外成本
+    """
+    joined = b"\n".join(payloads)
+    if b'"ts"' not in joined and b'"seq"' not in joined:
+        return None
+    if joined.count(b"\n") == len(payloads) - 1:
+        pairs = _STAMP_LINE.findall(joined)
+    else:  # payload 本身含有換行，逐筆搜尋
+        pairs = []
+    if len(pairs) != len(payloads):
+        pairs = []
+        for payload in payloads:
+            ts = _TS.search(payload)
+            seq = _SEQ.search(payload)
+            pairs.append((ts.group(1) if ts else b"", seq.group(1) if seq else b""))
+    sent_ns = np.full(len(pairs), np.nan)
+    seqs = np.full(len(pairs), -1, dtype=np.int64)
+    for i, (ts, seq) in enumerate(pairs):
+        if ts:
+            try:
+                sent_ns[i] = float(ts) * 1e6
+            except ValueError:
+                pass
+        if seq:
+            seqs[i] = int(seq)
+    return sent_ns, seqs
+
+
+class LatencyHistogram:
+    """對數刻度直方圖：記錄為向量化的 bincount，百分位數由累積次數推算"""
+
+    def __init__(self, edges=HISTOGRAM_EDGES_NS):
+        self.edges = edges
+        self.reset()
+
+    def reset(self):
+        self.counts = np.zeros(len(self.edges) + 1, dtype=np.int64)  # 頭尾各一格放超出範圍的值
+        self.count = 0
+        self.total_ns = 0.0
+        self.max_ns = 0.0
+        self.negative = 0  # 負值（發佈端時鐘比接收端快）
+
+    def record(self, values_ns):
+        values_ns = np.asarray(values_ns, dtype=float)
+        values_ns = values_ns[~np.isnan(values_ns)]
+        if len(values_ns) == 0:
+            return
+        self.negative += int((values_ns < 0).sum())
+        self.counts += np.bincount(np.searchsorted(self.edges, values_ns), minlength=len(self.counts))
+        self.count += len(values_ns)
+        self.total_ns += float(values_ns.sum())
+        self.max_ns = max(self.max_ns, float(values_ns.max()))
+
+    def percentile(self, p):
+        """回傳第 p 百分位所在格子的上緣（奈秒，不超過最大值），沒有資料時回傳 None"""
+        if self.count == 0:
+            return None
+        rank = np.searchsorted(np.cumsum(self.counts), self.count * p / 100)
+        return min(float(self.edges[min(rank, len(self.edges) - 1)]), self.max_ns)
+
+    def mean(self):
+        return self.total_ns / self.count if self.count else None
+
+
+class SequenceTracker:
+    """依主題追蹤序號：跳號計為遺失，晚到或重複的計為亂序"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.last = {}      # {主題: 目前看過的最大序號}
+        self.received = 0
+        self.lost = 0
+        self.reordered = 0
+
+    def record(self, topic, seqs):
+        last = self.last.get(topic)
+        for seq in seqs.tolist():
+            if seq < 0:
+                continue
+            self.received += 1
+            if last is None or seq < last - RESTART_GAP:
+                last = seq
+            elif seq > last:
+                self.lost += seq - last - 1
+                last = seq
+            else:
+                # 先前被算成遺失的訊息晚到了（或是重複收到）
+                self.reordered += 1
+                self.lost = max(0, self.lost - 1)
+        if last is not None:
+            self.last[topic] = last
+
+
+class LatencyStats:
+    """三段延遲的直方圖與序號統計（接收服務與各 session 共用，以自己的鎖保護）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {stage: LatencyHistogram() for stage in STAGES}
+        self.sequences = SequenceTracker()
+        self.since = time.time()
+
+    def record_received(self, received_ns, processed_ns):
+        """隊列等待時間：一整批訊息一次記錄"""
+        with self._lock:
+            self.histograms["queue"].record(processed_ns - np.asarray(received_ns, dtype=np.int64))
+
+    def record_sent(self, topic, payloads, received_ns):
+        """從 payload 取出送出時間與序號（同一個主題的一批訊息）"""
+        stamps = extract_stamps(payloads)
+        if stamps is not None:
+            self.record_stamps(topic, *stamps, received_ns)
+
+    def record_stamps(self, topic, sent_ns, seqs, received_ns):
+        """已經解碼的送出時間（epoch 奈秒，NaN = 沒有）與序號（-1 = 沒有），例如二進位訊框"""
+        with self._lock:
+            self.histograms["broker"].record(np.asarray(received_ns, dtype=np.int64) - sent_ns)
+            self.sequences.record(topic, seqs)
+
+    def record_render(self, processed_ns, rendered_ns):
+        """畫面更新：從處理完成到這次重新執行結束"""
+        with self._lock:
+            self.histograms["ui"].record([rendered_ns - processed_ns])
+
+    def reset(self):
+        with self._lock:
+            for histogram in self.histograms.values():
+                histogram.reset()
+            self.sequences.reset()
+            self.since = time.time()
+
+    def summary(self):
+        """每段一列：筆數、平均、p50 / p90 / p99、最大值（毫秒）"""
+        rows = []
+        with self._lock:
+            for stage, histogram in self.histograms.items():
+                row = {"階段": STAGES[stage], "筆數": histogram.count}
+                mean = histogram.mean()
+                row["平均 (ms)"] = None if mean is None else mean / 1e6
+                for p in PERCENTILES:
+                    value = histogram.percentile(p)
+                    row[f"p{p} (ms)"] = None if value is None else value / 1e6
+                row["最大 (ms)"] = histogram.max_ns / 1e6 if histogram.count else None
+                row["負值"] = histogram.negative
+                rows.append(row)
+        return pd.DataFrame(rows)
+
+    def counters(self):
+        with self._lock:
+            return {
+                "received": self.sequences.received,
+                "lost": self.sequences.lost,
+                "reordered": self.sequences.reordered,
+                "since": self.since,
+            }
+
+    def histogram_frame(self):
+        """各段直方圖：每格一列（上緣毫秒、各段次數），供圖表與匯出使用"""
+        with self._lock:
+            data = {"上緣 (ms)": np.r_[self.histograms["queue"].edges / 1e6, np.inf]}
+            for stage, histogram in self.histograms.items():
+                data[stage] = histogram.counts.copy()
+        df = pd.DataFrame(data)
+        used = df[list(STAGES)].sum(axis=1) > 0
+        if not used.any():
+            return df.iloc[0:0]
+        first, last = used.idxmax(), used[::-1].idxmax()
+        return df.loc[first:last].reset_index(drop=True)
+
+    def to_csv(self):
+        """匯出：摘要、序號統計與直方圖，合併成一份 CSV"""
+        counters = self.counters()
+        parts = [
+            "# 延遲摘要",
+            self.summary().to_csv(index=False),
+            "# 序號統計",
+            f"開始時間,已追蹤訊息,遺失,亂序或重複\n"
+            f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(counters['since']))},"
+            f"{counters['received']},{counters['lost']},{counters['reordered']}\n",
+            "# 直方圖",
+            self.histogram_frame().to_csv(index=False),
+        ]
+        return "\n".join(parts).encode("utf-8")
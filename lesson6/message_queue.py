@@ -0,0 +1,101 @@
+"""
+有上限的訊息隊列（paho 線程 → 處理端）
+
+原本的 Queue() 沒有上限：瀏覽器分頁關閉或重新整理停住時，on_message 仍持續放入訊息，
+記憶體會無限制成長。這裡限制隊列最多保留 maxsize 則訊息，滿載時依策略處理：
+- drop-oldest：丟掉最舊的訊息，保留最新的（預設）
+- drop-newest：拒收新訊息，保留已排隊的
+- coalesce：同一個主題只保留最新的一則（先合併，合併後仍滿載才丟掉最舊的）
+所有被丟棄 / 合併的數量都會計數，供儀表板顯示。
+"""
+import threading
+from collections import deque
+
+QUEUE_MAXSIZE = 50_000  # 最多保留的訊息數
+
+POLICIES = {
+    "drop-oldest": "丟棄最舊的訊息",
+    "drop-newest": "丟棄最新的訊息",
+    "coalesce": "同主題只保留最新值",
+}
+
+
+class BoundedMessageQueue:
+    """有上限的訊息隊列；項目為 (主題, payload, epoch 奈秒, qos)"""
+
+    def __init__(self, maxsize=QUEUE_MAXSIZE, policy="drop-oldest"):
+        if maxsize < 1:
+            raise ValueError("maxsize 至少為 1")
+        self.maxsize = maxsize
+        self.policy = policy
+        self._items = deque()
+        self._lock = threading.Lock()
+        self.reset_counters()
+
+    @property
+    def policy(self):
+        return self._policy
+
+    @policy.setter
+    def policy(self, policy):
+        if policy not in POLICIES:
+            raise ValueError(f"不支援的滿載策略: {policy}")
+        self._policy = policy
+
+    def __len__(self):
+        return len(self._items)
+
+    def reset_counters(self):
+        self.enqueued = 0      # 放入的訊息總數
+        self.dropped = 0       # 因滿載被丟棄的訊息數
+        self.coalesced = 0     # 被同主題較新訊息取代的訊息數
+        self.high_water = 0    # 隊列曾經達到的最大長度
+        self._next_coalesce = 0
+
+    def put(self, item):
+        """放入一則訊息（不會阻塞；滿載時依策略丟棄或合併）"""
+        with self._lock:
+            self.enqueued += 1
+            if len(self._items) >= self.maxsize:
+                if self._policy == "drop-newest":
+                    self.dropped += 1
+                    return False
+                if self._policy == "coalesce" and self.enqueued >= self._next_coalesce:
+                    self._coalesce()
+                if len(self._items) >= self.maxsize:
+                    self._items.popleft()
+                    self.dropped += 1
+            self._items.append(item)
+            if len(self._items) > self.high_water:
+                self.high_water = len(self._items)
+            return True
+
+    def _coalesce(self):
+        """同主題只保留最新的一則（保持原本的先後順序）；合併後隊列長度只剩主題數"""
+        latest = {item[0]: i for i, item in enumerate(self._items)}
+        kept = deque(item for i, item in enumerate(self._items) if latest[item[0]] == i)
+        self.coalesced += len(self._items) - len(kept)
+        self._items = kept
+        # 主題數接近上限時合併效果有限：至少再放入 maxsize / 4 則之後才再合併（期間丟棄最舊的），
+        # 讓每則訊息的平均成本維持 O(1)
+        self._next_coalesce = self.enqueued + max(self.maxsize - len(kept), self.maxsize // 4)
+
+    def drain(self):
+        """一次取出所有訊息（只鎖一次）"""
+        with self._lock:
+            items = list(self._items)
+            self._items.clear()
+        return items
+
+    def stats(self):
+        """目前狀態與計數器"""
+        with self._lock:
+            return {
+                "size": len(self._items),
+                "maxsize": self.maxsize,
+                "policy": self._policy,
+                "enqueued": self.enqueued,
+                "dropped": self.dropped,
+                "coalesced": self.coalesced,
+                "high_water": self.high_water,
+            }
@@ -0,0 +1,12 @@
+"""
+MQTT 共用設定
+app.py 與 ingest.py 共用同一份 Broker 與主題設定
+"""
+
+# MQTT 設定
+MQTT_BROKER = "localhost"
+MQTT_PORT = 1883
+MQTT_TOPIC_LIGHT = "home/light/status"
+MQTT_TOPIC_TEMP = "home/livingroom/temperature"
+MQTT_TOPIC_HUMIDITY = "home/livingroom/humidity"
+MQTT_TOPIC = "testtopic"  # 測試主題
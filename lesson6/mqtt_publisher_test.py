@@ -2,74 +2,430 @@
 """
 MQTT 測試發佈器
 用於測試 Streamlit 監控系統
+
+兩種模式：
+- 預設：單一客戶端每 2 秒發送一次電燈、溫度、濕度（原本的示範模式）
+- --load：壓力測試模式，模擬大量裝置以固定速率發佈，
+  分散到多條連線（多個進程 × 每個進程多條線程），
+  結束時回報實際吞吐量與 PUBACK / PUBCOMP 延遲百分位數
+
+範例：
+    python mqtt_publisher_test.py
+    python mqtt_publisher_test.py --load --devices 500 --rate 10 --duration 30 --processes 2 --clients 4
+    python mqtt_publisher_test.py --load --topic-layout "home/livingroom/{metric}" --qos-mix 0:1,1:3
+    python mqtt_publisher_test.py --load --format frame   # 每台裝置每次一則二進位訊框（見 frames.py）
 """
-import paho.mqtt.client as mqtt
-import time
+import argparse
 import json
+import multiprocessing
+import os
+import queue
 import random
+import threading
+import time
+
+import numpy as np
+import paho.mqtt.client as mqtt
+from sensor_frames import encode_frame
+
+from mqtt_config import MQTT_BROKER, MQTT_PORT, MQTT_TOPIC_LIGHT, MQTT_TOPIC_TEMP, MQTT_TOPIC_HUMIDITY
+
+# 壓力測試預設值
+LOAD_DEVICES = 500
+LOAD_RATE = 10.0                 # 每台裝置每個量測項目每秒發佈幾則
+LOAD_DURATION = 30.0             # 秒
+LOAD_TOPIC_LAYOUT = "home/{device}/{metric}"
+LOAD_METRICS = "temperature,humidity"
+LOAD_QOS_MIX = "1:1"             # QoS:權重，例如 0:1,1:3 代表 25% QoS 0、75% QoS 1
+LOAD_MAX_INFLIGHT = 1000         # 每條連線同時等待確認的訊息上限（paho 預設只有 20）
+DRAIN_TIMEOUT = 10.0             # 發佈結束後等待剩餘確認的秒數
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def run_demo(broker=MQTT_BROKER, port=MQTT_PORT):
+    """原本的示範模式：每 2 秒發送一次電燈狀態、溫度與濕度"""
+    # 創建 MQTT 客戶端
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+
+    def on_connect(client, userdata, flags, reason_code, properties):
+        if reason_code == 0:
+            print(f"✓ 成功連接到 MQTT Broker: {broker}:{port}")
+        else:
+            print(f"✗ 連接失敗，錯誤代碼: {reason_code}")
+
+    def on_publish(client, userdata, mid, reason_code=None, properties=None):
+        print(f"✓ 訊息已發佈 (mid: {mid})")
+
+    client.on_connect = on_connect
+    client.on_publish = on_publish
+
+    # 連接到 MQTT Broker
+    print(f"正在連接到 {broker}:{port}...")
+    client.connect(broker, port, 60)
+    client.loop_start()
 
-# MQTT 設定
-MQTT_BROKER = "localhost"
-MQTT_PORT = 1883
-MQTT_TOPIC_LIGHT = "home/light/status"
-MQTT_TOPIC_TEMP = "home/livingroom/temperature"
-MQTT_TOPIC_HUMIDITY = "home/livingroom/humidity"
+    # 等待連接建立
+    time.sleep(1)
 
-# 創建 MQTT 客戶端
-client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    print("\n開始發送測試數據...")
+    print("按 Ctrl+C 停止\n")
 
-def on_connect(client, userdata, flags, reason_code, properties):
-    if reason_code == 0:
-        print(f"✓ 成功連接到 MQTT Broker: {MQTT_BROKER}:{MQTT_PORT}")
+    try:
+        light_state = False
+        base_temp = 25.0
+        base_humidity = 50.0
+
+        while True:
+            # 發送電燈狀態（每 5 秒切換一次）
+            light_state = not light_state
+            light_status = "on" if light_state else "off"
+            client.publish(MQTT_TOPIC_LIGHT, json.dumps({"status": light_status}), qos=1)
+            print(f"發送電燈狀態: {light_status}")
+
+            # 發送溫度（模擬溫度變化）
+            temp = base_temp + random.uniform(-2, 2)
+            client.publish(MQTT_TOPIC_TEMP, json.dumps({"value": round(temp, 1)}), qos=1)
+            print(f"發送溫度: {temp:.1f} °C")
+
+            # 發送濕度（模擬濕度變化）
+            humidity = base_humidity + random.uniform(-5, 5)
+            humidity = max(0, min(100, humidity))  # 限制在 0-100 之間
+            client.publish(MQTT_TOPIC_HUMIDITY, json.dumps({"value": round(humidity, 1)}), qos=1)
+            print(f"發送濕度: {humidity:.1f} %")
+
+            print("-" * 40)
+            time.sleep(2)  # 每 2 秒發送一次數據
+
+    except KeyboardInterrupt:
+        print("\n\n正在停止...")
+        client.loop_stop()
+        client.disconnect()
+        print("✓ 已斷開連接")
+
+
+# ---------------------------------------------------------------------------
+# 壓力測試模式
+# ---------------------------------------------------------------------------
+
+def parse_qos_mix(text):
+    """'0:1,1:3' → ([0, 1], [0.25, 0.75])"""
+    levels, weights = [], []
+    for part in text.split(","):
+        qos, _, weight = part.partition(":")
+        qos = int(qos)
+        if qos not in (0, 1, 2):
+            raise ValueError(f"QoS 只能是 0、1、2: {part}")
+        levels.append(qos)
+        weights.append(float(weight or 1))
+    total = sum(weights)
+    return levels, [w / total for w in weights]
+
+
+def make_payload(metric, value, payload_size, device_id=0, seq=0):
+    """
+    產生與儀表板相容的 JSON 數據；payload_size 大於實際長度時以 pad 欄位補足
+    metric 為 "frame" 時產生二進位訊框（溫度、濕度、電燈放在同一則，不補足長度）
+    """
+    if metric == "frame":
+        return encode_frame(device_id, seq, time.time_ns() // 1000,
+                            temperature=value, humidity=value * 2, light=value >= 25)
+    if metric == "status":
+        payload = json.dumps({"status": "on" if value >= 25 else "off"})  # 以模擬溫度決定開關
     else:
-        print(f"✗ 連接失敗，錯誤代碼: {reason_code}")
-
-def on_publish(client, userdata, mid, reason_code=None, properties=None):
-    print(f"✓ 訊息已發佈 (mid: {mid})")
-
-client.on_connect = on_connect
-client.on_publish = on_publish
-
-# 連接到 MQTT Broker
-print(f"正在連接到 {MQTT_BROKER}:{MQTT_PORT}...")
-client.connect(MQTT_BROKER, MQTT_PORT, 60)
-client.loop_start()
-
-# 等待連接建立
-time.sleep(1)
-
-print("\n開始發送測試數據...")
-print("按 Ctrl+C 停止\n")
-
-try:
-    light_state = False
-    base_temp = 25.0
-    base_humidity = 50.0
-    
-    while True:
-        # 發送電燈狀態（每 5 秒切換一次）
-        light_state = not light_state
-        light_status = "on" if light_state else "off"
-        client.publish(MQTT_TOPIC_LIGHT, json.dumps({"status": light_status}), qos=1)
-        print(f"發送電燈狀態: {light_status}")
-        
-        # 發送溫度（模擬溫度變化）
-        temp = base_temp + random.uniform(-2, 2)
-        client.publish(MQTT_TOPIC_TEMP, json.dumps({"value": round(temp, 1)}), qos=1)
-        print(f"發送溫度: {temp:.1f} °C")
-        
-        # 發送濕度（模擬濕度變化）
-        humidity = base_humidity + random.uniform(-5, 5)
-        humidity = max(0, min(100, humidity))  # 限制在 0-100 之間
-        client.publish(MQTT_TOPIC_HUMIDITY, json.dumps({"value": round(humidity, 1)}), qos=1)
-        print(f"發送濕度: {humidity:.1f} %")
-        
-        print("-" * 40)
-        time.sleep(2)  # 每 2 秒發送一次數據
-
-except KeyboardInterrupt:
-    print("\n\n正在停止...")
-    client.loop_stop()
-    client.disconnect()
-    print("✓ 已斷開連接")
+        payload = json.dumps({"value": round(value, 1)})
+    missing = payload_size - len(payload)
+    if missing > 0:
+        # {"value": 1.0, "pad": "xxx"} 比原本多出 11 個字元 + pad 長度
+        payload = payload[:-1] + ', "pad": "' + "x" * max(0, missing - 11) + '"}'
+    return payload.encode()
+
+
+class LoadClient:
+    """
+    一條 MQTT 連線：負責一部分裝置，依排程發佈並記錄每則訊息的確認延遲
+    QoS 1 在收到 PUBACK、QoS 2 在收到 PUBCOMP 時 paho 會呼叫 on_publish；
+    QoS 0 沒有確認，on_publish 只代表已寫入 socket，不列入延遲統計
+    """
+
+    def __init__(self, client_id, args, streams, qos_cycle, counters):
+        self.args = args
+        self.client_id = client_id
+        self.streams = streams          # [(主題, 量測項目, 裝置編號), ...]
+        self.qos_cycle = qos_cycle      # 預先抽好的 QoS 序列，發佈時依序循環使用
+        self.counters = counters        # 跨進程共用的 (已發佈, 已確認) 計數器
+        self.sent = {0: 0, 1: 0, 2: 0}
+        self.latencies = {1: [], 2: []}
+        self.errors = 0
+        self._pending = {}              # {mid: (送出時間, qos)}
+        self._early = {}                # 比 publish() 回傳更早到達的確認 {mid: 確認時間}
+        self._lock = threading.Lock()
+        self._connected = threading.Event()
+
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id)
+        self.client.max_inflight_messages_set(args.max_inflight)
+        self.client.on_connect = self.on_connect
+        self.client.on_publish = self.on_publish
+
+    def on_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code == 0:
+            self._connected.set()
+        else:
+            print(f"✗ 連接失敗，錯誤代碼: {reason_code}")
+
+    def on_publish(self, client, userdata, mid, reason_code=None, properties=None):
+        now = time.perf_counter_ns()
+        with self._lock:
+            entry = self._pending.pop(mid, None)
+            if entry is None:
+                self._early[mid] = now
+                return
+        self._record(entry, now)
+
+    def _record(self, entry, acked_at):
+        sent_at, qos = entry
+        if qos:
+            self.latencies[qos].append(acked_at - sent_at)
+            with self.counters[1].get_lock():
+                self.counters[1].value += 1
+
+    def connect(self):
+        self.client.connect(self.args.broker, self.args.port, 60)
+        self.client.loop_start()
+        return self._connected.wait(10)
+
+    def run(self, start_at, stop_at):
+        """
+        依固定間隔輪流替每個 (裝置, 量測項目) 發佈一則訊息，落後時不睡眠直接追趕；
+        到 stop_at 一律停止，因此發佈總數 / 測試秒數就是實際達到的吞吐量
+        """
+        streams = self.streams
+        if not streams:
+            return
+        interval_ns = int(1e9 / (len(streams) * self.args.rate))
+        rng = random.Random()
+        values = [rng.uniform(20, 30) for _ in streams]
+        seqs = [0] * len(streams)
+        qos_cycle = self.qos_cycle
+        publish = self.client.publish
+        sent_counter = self.counters[0]
+
+        i = 0
+        unreported = 0
+        while True:
+            target = start_at + i * interval_ns
+            now = time.perf_counter_ns()
+            if target >= stop_at or now >= stop_at:
+                break
+            delay = target - now
+            if delay > 1_000_000:  # 領先超過 1 ms 才睡眠，減少系統呼叫
+                time.sleep(delay / 1e9)
+            k = i % len(streams)
+            topic, metric, device_id = streams[k]
+            values[k] += rng.uniform(-0.2, 0.2)  # 隨機漫步
+            qos = qos_cycle[i % len(qos_cycle)]
+            seqs[k] += 1
+            payload = make_payload(metric, values[k], self.args.payload_size, device_id, seqs[k])
+
+            sent_at = time.perf_counter_ns()
+            info = publish(topic, payload, qos=qos)
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                self.errors += 1
+            else:
+                self.sent[qos] += 1
+                with self._lock:
+                    acked_at = self._early.pop(info.mid, None)
+                    if acked_at is None:
+                        self._pending[info.mid] = (sent_at, qos)
+                if acked_at is not None:
+                    self._record((sent_at, qos), acked_at)
+            i += 1
+            unreported += 1
+            if unreported >= 100:
+                with sent_counter.get_lock():
+                    sent_counter.value += unreported
+                unreported = 0
+        with sent_counter.get_lock():
+            sent_counter.value += unreported
+
+    def drain(self, timeout):
+        """等待尚未確認的訊息（QoS 0 不需要確認）"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if not any(qos for _, qos in self._pending.values()):
+                    return
+            time.sleep(0.05)
+
+    def close(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def result(self):
+        with self._lock:
+            unacked = sum(1 for _, qos in self._pending.values() if qos)
+        return {
+            "sent": dict(self.sent),
+            "errors": self.errors,
+            "unacked": unacked,
+            "latencies": {qos: np.array(v, dtype=np.int64) for qos, v in self.latencies.items()},
+        }
+
+
+def build_streams(args):
+    """每個 (裝置, 量測項目) 一個串流：[(主題, 量測項目, 裝置編號), ...]"""
+    if args.format == "frame":
+        metrics = ["frame"]
+    else:
+        metrics = [m.strip() for m in args.metrics.split(",") if m.strip()]
+    return [(args.topic_layout.format(device=f"dev{n:04d}", metric=m), m, n)
+            for n in range(args.devices) for m in metrics]
+
+
+def load_worker(worker_id, args, streams, start_at, counters, results):
+    """一個進程：開 args.clients 條連線，各自在自己的線程中發佈"""
+    levels, weights = parse_qos_mix(args.qos_mix)
+    rng = random.Random(worker_id)
+    clients = []
+    for k in range(args.clients):
+        qos_cycle = rng.choices(levels, weights, k=1000)
+        client_id = f"loadgen-{os.getpid()}-{k}"
+        clients.append(LoadClient(client_id, args, streams[k::args.clients], qos_cycle, counters))
+
+    for c in clients:
+        if not c.connect():
+            print(f"✗ 連線 {c.client_id} 逾時")
+
+    stop_at = start_at + int(args.duration * 1e9)
+    threads = [threading.Thread(target=c.run, args=(start_at, stop_at), daemon=True) for c in clients]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for c in clients:
+        c.drain(args.drain_timeout)
+    for c in clients:
+        c.close()
+    results.put([c.result() for c in clients])
+
+
+def percentile_line(latencies_ns):
+    if len(latencies_ns) == 0:
+        return "無資料"
+    ms = latencies_ns / 1e6
+    parts = [f"p{p:g} {np.percentile(ms, p):.2f} ms" for p in PERCENTILES]
+    parts.append(f"最大 {ms.max():.2f} ms")
+    return "、".join(parts)
+
+
+def run_load(args):
+    streams = build_streams(args)
+    if not streams:
+        raise SystemExit("沒有任何量測項目（--metrics）")
+    parse_qos_mix(args.qos_mix)  # 先檢查格式
+    target_rate = len(streams) * args.rate
+    connections = args.processes * args.clients
+    print(f"壓力測試：{args.devices} 台裝置 × {len(streams) // args.devices} 個量測項目，"
+          f"每項 {args.rate:g} 則/秒，目標 {target_rate:,.0f} 則/秒")
+    print(f"Broker {args.broker}:{args.port}，{connections} 條連線（{args.processes} 個進程 × {args.clients} 條線程），"
+          f"持續 {args.duration:g} 秒，QoS 比例 {args.qos_mix}")
+    print(f"主題範例: {streams[0][0]}")
+
+    # 跨進程共用的計數器，只用來顯示即時進度
+    counters = (multiprocessing.Value("q", 0), multiprocessing.Value("q", 0))
+    results = multiprocessing.Queue()
+    # 所有進程在同一個時間點開始（留 2 秒建立連線）；perf_counter_ns 在 Linux 上跨進程一致
+    start_at = time.perf_counter_ns() + 2_000_000_000
+    workers = [
+        multiprocessing.Process(
+            target=load_worker,
+            args=(w, args, streams[w::args.processes], start_at, counters, results)
+        )
+        for w in range(args.processes)
+    ]
+    for w in workers:
+        w.start()
+
+    client_results = []
+    last_sent = 0
+    try:
+        while len(client_results) < connections:
+            try:
+                client_results.extend(results.get(timeout=1))
+                continue
+            except queue.Empty:
+                pass
+            sent, acked = counters[0].value, counters[1].value
+            if sent:
+                print(f"  已發佈 {sent:,} 則（{sent - last_sent:,} 則/秒），已確認 {acked:,} 則")
+            last_sent = sent
+            if not any(w.is_alive() for w in workers) and results.empty():
+                break
+    except KeyboardInterrupt:
+        print("\n\n正在停止...")
+        for w in workers:
+            w.terminate()
+    for w in workers:
+        w.join()
+    report(args, target_rate, client_results)
+
+
+def report(args, target_rate, client_results):
+    if not client_results:
+        print("沒有收到任何結果")
+        return
+    sent = {q: sum(r["sent"][q] for r in client_results) for q in (0, 1, 2)}
+    total = sum(sent.values())
+    errors = sum(r["errors"] for r in client_results)
+    unacked = sum(r["unacked"] for r in client_results)
+    print("\n" + "=" * 60)
+    print("壓力測試結果")
+    print("=" * 60)
+    print(f"目標吞吐量: {target_rate:,.0f} 則/秒")
+    print(f"實際吞吐量: {total / args.duration:,.0f} 則/秒（共 {total:,} 則，{args.duration:g} 秒）")
+    sample_metric = "frame" if args.format == "frame" else "temperature"
+    print(f"每則大小: {len(make_payload(sample_metric, 25.0, args.payload_size))} bytes，"
+          f"發佈失敗 {errors:,} 則，逾時未確認 {unacked:,} 則")
+    for qos in (0, 1, 2):
+        if not sent[qos]:
+            continue
+        if qos == 0:
+            print(f"QoS 0: {sent[0]:,} 則（不需確認）")
+            continue
+        lat = np.concatenate([r["latencies"][qos] for r in client_results])
+        ack = "PUBACK" if qos == 1 else "PUBCOMP"
+        print(f"QoS {qos}: {sent[qos]:,} 則，已確認 {len(lat):,} 則")
+        print(f"  {ack} 延遲: {percentile_line(lat)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MQTT 測試發佈器")
+    parser.add_argument("--broker", default=MQTT_BROKER)
+    parser.add_argument("--port", type=int, default=MQTT_PORT)
+    parser.add_argument("--load", action="store_true", help="壓力測試模式")
+    parser.add_argument("--devices", type=int, default=LOAD_DEVICES, help="模擬裝置數")
+    parser.add_argument("--rate", type=float, default=LOAD_RATE, help="每台裝置每個量測項目每秒發佈幾則")
+    parser.add_argument("--duration", type=float, default=LOAD_DURATION, help="測試秒數")
+    parser.add_argument("--topic-layout", default=LOAD_TOPIC_LAYOUT,
+                        help="主題格式，可使用 {device} 與 {metric}")
+    parser.add_argument("--metrics", default=LOAD_METRICS,
+                        help="量測項目（以逗號分隔），status 會發送電燈開關格式")
+    parser.add_argument("--format", choices=["json", "frame"], default="json",
+                        help="json：每個量測項目一則；frame：每台裝置每次一則二進位訊框（忽略 --metrics）")
+    parser.add_argument("--payload-size", type=int, default=0, help="每則訊息至少幾個位元組（以 pad 欄位補足）")
+    parser.add_argument("--qos-mix", default=LOAD_QOS_MIX, help="QoS 比例，例如 0:1,1:3")
+    parser.add_argument("--processes", type=int, default=1, help="進程數")
+    parser.add_argument("--clients", type=int, default=4, help="每個進程的連線數（每條連線一個線程）")
+    parser.add_argument("--max-inflight", type=int, default=LOAD_MAX_INFLIGHT,
+                        help="每條連線同時等待確認的訊息上限")
+    parser.add_argument("--drain-timeout", type=float, default=DRAIN_TIMEOUT,
+                        help="發佈結束後等待剩餘確認的秒數")
+    args = parser.parse_args()
+
+    if args.load:
+        run_load(args)
+    else:
+        run_demo(args.broker, args.port)
+
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+管線化的 MQTT 發佈器
+
+原本 publish_data() 每次呼叫都逐一 json.dumps + publish()，testtopic 還會以
+wait_for_publish(timeout=2) 等待確認，一個慢的 PUBACK 就讓 Streamlit 腳本卡住最多 2 秒。
+這裡改成：
+- publish() / publish_many() 立即回傳 concurrent.futures.Future，不等待確認
+- 確認（QoS 1 的 PUBACK、QoS 2 的 PUBCOMP、QoS 0 寫入 socket）由 paho 的 on_publish 回調完成 Future
+- 同時等待確認的訊息上限由 paho 預設的 20 則提高到 PUBLISH_MAX_INFLIGHT，
+  吞吐量由 Broker 決定，而不是每則訊息一次來回
+- 連線中斷時 paho 會自動重新連線，並重送所有尚未確認的訊息（mid 不變），Future 繼續等待確認；
+  只有呼叫 stop() 時，尚未確認的 Future 才以 ConnectionError 結束
+"""
+import json
+import threading
+from concurrent.futures import Future
+
+import paho.mqtt.client as mqtt
+
+from ingest import CONNECT_ERROR_MESSAGES
+from latency import stamp
+from mqtt_config import MQTT_BROKER, MQTT_PORT, MQTT_TOPIC_LIGHT, MQTT_TOPIC_TEMP, MQTT_TOPIC_HUMIDITY
+
+PUBLISH_MAX_INFLIGHT = 1000  # 同時等待確認的訊息上限
+DEFAULT_TOPICS = {"light": MQTT_TOPIC_LIGHT, "temperature": MQTT_TOPIC_TEMP, "humidity": MQTT_TOPIC_HUMIDITY}
+
+
+class Publisher:
+    """非阻塞的 MQTT 發佈器：每則訊息一個 Future，確認後完成"""
+
+    def __init__(self, broker=MQTT_BROKER, port=MQTT_PORT, max_inflight=PUBLISH_MAX_INFLIGHT):
+        self.broker = broker
+        self.port = port
+        self.last_error = None
+        self.acked = 0
+        self.failed = 0
+        self._pending = {}   # {mid: Future}
+        self._early = {}     # 比 publish() 回傳更早到達的確認 {mid: 例外或 None}
+        self._abandoned = set()  # stop() 時已經以失敗結束、paho 之後仍可能重送並確認的 mid
+        self._lock = threading.Lock()
+        self._connect_event = threading.Event()
+        self._connected = False
+
+        # 創建客戶端（使用新的 Callback API 版本 2）
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        self.client.max_inflight_messages_set(max_inflight)
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self.client.on_publish = self.on_publish
+
+    # MQTT 回調函數（在 paho 背景線程中執行）
+    def on_connect(self, client, userdata, flags, reason_code, properties):
+        # 處理 reason_code（可能是整數或 ReasonCode 對象）
+        rc_value = reason_code.value if hasattr(reason_code, 'value') else int(reason_code)
+        self._connected = rc_value == 0
+        with self._lock:
+            # 上一條連線留下、沒有對應 Future 的確認不再有意義，避免之後被重複使用的 mid 誤認
+            self._early.clear()
+        if self._connected:
+            self.last_error = None
+            print(f"✓ 發佈器已連接到 MQTT Broker")
+        else:
+            self.last_error = CONNECT_ERROR_MESSAGES.get(rc_value, f"未知錯誤 (代碼: {rc_value})")
+            print(f"✗ 發佈器連接失敗: {self.last_error}")
+        self._connect_event.set()
+
+    def on_disconnect(self, client, userdata, flags, reason_code, properties):
+        # 尚未確認的訊息留在 _pending：paho 重新連線後會以相同的 mid 重送，確認到達時照常完成
+        self._connected = False
+        with self._lock:
+            self._early.clear()
+
+    def on_publish(self, client, userdata, mid, reason_code=None, properties=None):
+        error = None
+        if reason_code is not None and getattr(reason_code, "is_failure", False):
+            error = RuntimeError(f"Broker 拒絕訊息: {reason_code}")
+        with self._lock:
+            future = self._pending.pop(mid, None)
+            if future is None:
+                if mid in self._abandoned:
+                    self._abandoned.discard(mid)
+                else:
+                    self._early[mid] = error
+                return
+        self._finish(future, error)
+
+    def _finish(self, future, error=None):
+        if error is None:
+            self.acked += 1
+            future.set_result(True)
+        else:
+            self.failed += 1
+            future.set_exception(error)
+
+    def start(self, timeout=3):
+        """連接 Broker 並啟動網路線程，回傳是否連接成功"""
+        if self._connected:
+            return True
+        try:
+            self._connect_event.clear()
+            self.client.connect(self.broker, self.port, 60)
+            # 使用非阻塞模式啟動網路循環（參考 lesson6_2.ipynb）
+            self.client.loop_start()
+        except Exception as e:
+            self.last_error = str(e)
+            return False
+        if not self._connect_event.wait(timeout=timeout):
+            self.last_error = "連接超時，請檢查 MQTT Broker 是否運行"
+            return False
+        return self._connected
+
+    def stop(self):
+        try:
+            self.client.disconnect()
+            self.client.loop_stop()
+        except Exception:
+            pass
+        self._connected = False
+        # 不會再自動重新連線：尚未確認的訊息以失敗結束（paho 仍保留它們，下次 start() 時會重送）
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._abandoned.update(pending)
+            self._early.clear()
+        for future in pending.values():
+            self._finish(future, ConnectionError("發佈器已停止，訊息未確認"))
+
+    def is_connected(self):
+        return self._connected and self.client.is_connected()
+
+    @property
+    def in_flight(self):
+        """已送出、尚未確認的訊息數"""
+        return len(self._pending)
+
+    def publish(self, topic, payload, qos=1, retain=False):
+        """送出一則訊息，立即回傳 Future（確認後結果為 True，失敗時為例外）"""
+        future = Future()
+        try:
+            info = self.client.publish(topic, payload, qos=qos, retain=retain)
+        except Exception as e:
+            self._finish(future, e)
+            return future
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            self._finish(future, RuntimeError(f"發送失敗: {mqtt.error_string(info.rc)}"))
+            return future
+        with self._lock:
+            done = info.mid in self._early
+            if done:
+                error = self._early.pop(info.mid)
+            else:
+                self._pending[info.mid] = future
+        if done:
+            self._finish(future, error)
+        return future
+
+    def publish_many(self, messages):
+        """整批送出 [(主題, payload, qos), ...]，回傳對應的 Future 清單（不等待任何確認）"""
+        return [self.publish(topic, payload, qos) for topic, payload, qos in messages]
+
+
+def reading_messages(readings, stamp_payloads=True, qos=1, topics=None):
+    """
+    把一批讀數轉成要發佈的訊息 [(主題, payload, qos), ...]
+    每筆讀數為 dict，可包含 light（bool）、temperature、humidity，沒有的欄位不發送
+    stamp_payloads = 是否附上送出時間 ts 與序號 seq（見 latency.py）
+    topics         = {"light": ..., "temperature": ..., "humidity": ...}，None 時使用 mqtt_config 的主題
+    """
+    topics = topics or DEFAULT_TOPICS
+
+    def encode(topic, data):
+        return json.dumps(stamp(data, topic) if stamp_payloads else data)
+
+    messages = []
+    for reading in readings:
+        if reading.get("light") is not None:
+            topic = topics["light"]
+            messages.append((topic, encode(topic, {"status": "on" if reading["light"] else "off"}), qos))
+        for metric in ("temperature", "humidity"):
+            if reading.get(metric) is not None:
+                topic = topics[metric]
+                messages.append((topic, encode(topic, {"value": round(reading[metric], 1)}), qos))
+    return messages
@@ -0,0 +1,215 @@
+"""
+多裝置自動發送模擬器
+
+原本的 auto_publish_loop 只模擬一台裝置，每 2 秒固定發送一次。這裡模擬 N 台裝置（數十到數千台）：
+- 每台裝置有自己的主題命名空間：home/<裝置>/temperature、home/<裝置>/humidity、home/<裝置>/light
+  （第一台沿用 mqtt_config 的客廳主題，儀表板上的卡片與圖表照常顯示）
+- 溫濕度為隨機漫步，並緩慢回到各裝置自己的基準值；電燈偶爾切換
+- 每台裝置的發送時間加上隨機抖動，不會全部在同一瞬間發送
+- 只用一個排程線程：以時間輪（timer wheel）安排下一次發送，到期的裝置一次向量化更新、整批發佈
+- encoding="frame" 時，第二台以後的裝置每筆讀數只發一則 24 位元組的二進位訊框到 home/<裝置>/frame（見 frames.py）
+"""
+import threading
+import time
+
+import numpy as np
+from sensor_frames import FRAME_TOPIC_LAYOUT, encode_frames
+
+from mqtt_config import MQTT_TOPIC_LIGHT, MQTT_TOPIC_TEMP, MQTT_TOPIC_HUMIDITY
+from publisher import reading_messages
+
+DEVICE_TOPIC_LAYOUT = "home/{device}/{metric}"
+WHEEL_TICK = 0.05   # 時間輪每格的長度（秒）
+WHEEL_SLOTS = 256   # 時間輪格數（一圈 12.8 秒，更長的間隔以圈數表示）
+ENCODINGS = {
+    "json": "JSON（每個量測項目一則）",
+    "frame": "二進位訊框（每筆讀數一則）",
+}
+
+
+def device_name(index):
+    """第 index 台模擬裝置的名稱"""
+    return "livingroom" if index == 0 else f"sim-{index:04d}"
+
+
+def device_topics(index, layout=DEVICE_TOPIC_LAYOUT):
+    """第 index 台裝置的主題 {量測項目: 主題}"""
+    if index == 0:
+        return {"light": MQTT_TOPIC_LIGHT, "temperature": MQTT_TOPIC_TEMP, "humidity": MQTT_TOPIC_HUMIDITY}
+    name = device_name(index)
+    return {metric: layout.format(device=name, metric=metric) for metric in ("light", "temperature", "humidity")}
+
+
+class TimerWheel:
+    """
+    簡單的時間輪：每格一個清單，放入 O(1)、每次前進一格只處理該格的項目
+    超過一圈的延遲記錄剩餘圈數，輪到時圈數未歸零就留在原格
+    """
+
+    def __init__(self, tick=WHEEL_TICK, slots=WHEEL_SLOTS):
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.current = 0  # 目前所在的格子（已處理過）
+
+    def schedule(self, item, delay):
+        """delay 秒後到期（至少下一格）"""
+        ticks = max(1, int(round(delay / self.tick)))
+        rounds, offset = divmod(ticks, len(self.slots))
+        if offset == 0:
+            rounds, offset = rounds - 1, len(self.slots)
+        slot = (self.current + offset) % len(self.slots)
+        self.slots[slot].append((rounds, item))
+
+    def advance(self):
+        """前進一格，回傳到期的項目"""
+        self.current = (self.current + 1) % len(self.slots)
+        entries = self.slots[self.current]
+        if not entries:
+            return []
+        due = [item for rounds, item in entries if rounds == 0]
+        remaining = [(rounds - 1, item) for rounds, item in entries if rounds > 0]
+        self.slots[self.current] = remaining
+        return due
+
+
+class FleetModel:
+    """所有裝置的感測器狀態（NumPy 陣列，一次更新一批裝置）"""
+
+    def __init__(self, devices, seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.base_temperature = self.rng.uniform(22.0, 28.0, devices)
+        self.base_humidity = self.rng.uniform(40.0, 60.0, devices)
+        self.temperature = self.base_temperature.copy()
+        self.humidity = self.base_humidity.copy()
+        self.light = self.rng.random(devices) < 0.5
+
+    def step(self, indices):
+        """到期的裝置各走一步，回傳它們的讀數"""
+        n = len(indices)
+        temperature = self.temperature[indices]
+        humidity = self.humidity[indices]
+        # 隨機漫步，每步往基準值拉回 5%
+        temperature += self.rng.normal(0, 0.3, n) + 0.05 * (self.base_temperature[indices] - temperature)
+        humidity += self.rng.normal(0, 1.0, n) + 0.05 * (self.base_humidity[indices] - humidity)
+        np.clip(humidity, 0, 100, out=humidity)
+        self.temperature[indices] = temperature
+        self.humidity[indices] = humidity
+        self.light[indices] ^= self.rng.random(n) < 0.1
+        return self.light[indices], temperature, humidity
+
+
+class FleetSimulator:
+    """以一個排程線程模擬 N 台裝置，透過 Publisher 整批發佈"""
+
+    def __init__(self, publisher, devices=1, interval=2.0, jitter=0.2, stamp_payloads=True, seed=None,
+                 encoding="json"):
+        if devices < 1:
+            raise ValueError("裝置數至少為 1")
+        if encoding not in ENCODINGS:
+            raise ValueError(f"不支援的資料格式: {encoding}")
+        if interval < WHEEL_TICK:
+            raise ValueError(f"發送間隔至少為 {WHEEL_TICK} 秒")
+        self.publisher = publisher
+        self.devices = devices
+        self.interval = interval
+        self.jitter = min(max(jitter, 0.0), 0.9)
+        self.stamp_payloads = stamp_payloads
+        self.encoding = encoding
+        self.model = FleetModel(devices, seed)
+        self.topics = [device_topics(i) for i in range(devices)]
+        self.frame_topics = [FRAME_TOPIC_LAYOUT.format(device=device_name(i)) for i in range(devices)]
+        self._frame_seqs = np.zeros(devices, dtype=np.int64)
+        self.published = 0   # 已送出的訊息數
+        self.skipped = 0     # 發佈器未連接而略過的發送次數
+        self.lag = 0.0       # 排程線程最近一次落後的秒數
+        self._rng = np.random.default_rng(seed)
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def expected_rate(self):
+        """預期每秒送出的訊息數（JSON 每台裝置每次 3 則；訊框除了第一台以外每次 1 則）"""
+        if self.encoding == "frame":
+            return (3 + self.devices - 1) / self.interval
+        return self.devices * 3 / self.interval
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+
+    def _delays(self, n):
+        """下一次發送的延遲：間隔 ±jitter"""
+        return self.interval * self._rng.uniform(1 - self.jitter, 1 + self.jitter, n)
+
+    def _run(self):
+        wheel = TimerWheel()
+        # 第一次發送平均分散在一個間隔內
+        for index, delay in enumerate(self._rng.uniform(0, self.interval, self.devices)):
+            wheel.schedule(index, delay)
+        print(f"自動發送線程啟動（{self.devices} 台裝置）")
+        started = time.monotonic()
+        ticks = 0
+        try:
+            while True:
+                next_tick = started + (ticks + 1) * wheel.tick
+                if self._stop_event.wait(timeout=max(0.0, next_tick - time.monotonic())):
+                    break
+                # 線程被延誤時一次補上所有過期的格子
+                due = []
+                now = time.monotonic()
+                while started + (ticks + 1) * wheel.tick <= now:
+                    ticks += 1
+                    due.extend(wheel.advance())
+                self.lag = now - next_tick
+                if not due:
+                    continue
+                self._publish(np.array(due))
+                for index, delay in zip(due, self._delays(len(due))):
+                    wheel.schedule(index, delay)
+        except Exception as e:
+            print(f"自動發送線程錯誤: {e}")
+        print("自動發送線程結束")
+
+    def _publish(self, indices):
+        light, temperature, humidity = self.model.step(indices)
+        if not self.publisher.is_connected():
+            self.skipped += len(indices)
+            return
+        messages = []
+        # 第一台裝置沿用客廳的 JSON 主題，儀表板上的卡片才有數據
+        json_rows = range(len(indices)) if self.encoding == "json" else np.flatnonzero(indices == 0).tolist()
+        for i in json_rows:
+            messages.extend(reading_messages(
+                [{"light": bool(light[i]), "temperature": float(temperature[i]), "humidity": float(humidity[i])}],
+                self.stamp_payloads,
+                topics=self.topics[indices[i]],
+            ))
+        if self.encoding == "frame":
+            rows = np.flatnonzero(indices != 0)
+            devices = indices[rows]
+            self._frame_seqs[devices] += 1
+            frames = encode_frames(devices, self._frame_seqs[devices], time.time_ns() // 1000,
+                                   temperature[rows], humidity[rows], light[rows].tolist())
+            messages.extend((self.frame_topics[device], frame, 1) for device, frame in zip(devices.tolist(), frames))
+        self.publisher.publish_many(messages)
+        self.published += len(messages)
+
+    def stats(self):
+        return {
+            "devices": self.devices,
+            "expected_rate": self.expected_rate,
+            "published": self.published,
+            "skipped": self.skipped,
+            "lag": self.lag,
+        }
@@ -0,0 +1,82 @@
+"""sensor_frames：訊框與摘要訊框編碼後再解碼應得到原本的數值"""
+import json
+import unittest
+
+import numpy as np
+from sensor_frames import (FRAME_SIZE, SUMMARY_SIZE, decode_frames, decode_summaries, encode_frame, encode_frames,
+                           encode_summary, is_frame, is_summary)
+
+
+class FrameRoundTripTest(unittest.TestCase):
+    def test_single_frame(self):
+        payload = encode_frame(42, 7, 1_730_000_000_123_456, 25.37, 61.2, True)
+        self.assertEqual(len(payload), FRAME_SIZE)
+        self.assertTrue(is_frame(payload))
+        self.assertFalse(is_summary(payload))
+        decoded = decode_frames([payload])
+        self.assertEqual((decoded["device"][0], decoded["seq"][0]), (42, 7))
+        self.assertEqual(decoded["sent_ns"][0], 1_730_000_000_123_456_000)
+        self.assertAlmostEqual(decoded["temperature"][0], 25.37)
+        self.assertAlmostEqual(decoded["humidity"][0], 61.2)
+        self.assertEqual(decoded["light"][0], 1.0)
+
+    def test_missing_fields_and_negative_temperature(self):
+        decoded = decode_frames([encode_frame(1, 2, 0, -12.5), encode_frame(1, 3, 0, light=False)])
+        np.testing.assert_array_equal(decoded["temperature"], [-12.5, np.nan])
+        np.testing.assert_array_equal(decoded["humidity"], [np.nan, np.nan])
+        np.testing.assert_array_equal(decoded["light"], [np.nan, 0.0])
+
+    def test_vectorized_encode_matches_single(self):
+        n = 5
+        ids, seqs = np.arange(n), np.arange(n) + 100
+        ts = 1_730_000_000_000_000 + np.arange(n) * 1_000_000
+        temperature = np.array([20.0, np.nan, 21.5, -3.25, 40.0])
+        humidity = np.array([50.0, 51.0, np.nan, 0.0, 100.0])
+        light = [True, None, False, True, None]
+        frames = encode_frames(ids, seqs, ts, temperature, humidity, light)
+        expected = [encode_frame(int(ids[i]), int(seqs[i]), int(ts[i]),
+                                 None if np.isnan(temperature[i]) else temperature[i],
+                                 None if np.isnan(humidity[i]) else humidity[i], light[i]) for i in range(n)]
+        self.assertEqual(frames, expected)
+
+    def test_concatenated_frames_and_mixed_json(self):
+        batch = b"".join(encode_frame(9, seq, seq * 1000, 20 + seq) for seq in range(3))
+        text = json.dumps({"temperature": 30.5, "light": "on", "ts": 1_730_000_000_000, "seq": 5}).encode()
+        decoded = decode_frames([text, batch, b"not json"])
+        np.testing.assert_array_equal(decoded["message"], [0, 1, 1, 1, 2])
+        np.testing.assert_array_equal(decoded["temperature"], [30.5, 20, 21, 22, np.nan])
+        np.testing.assert_array_equal(decoded["seq"], [5, 0, 1, 2, -1])
+        self.assertEqual(decoded["light"][0], 1.0)
+        self.assertEqual(decoded["sent_ns"][0], 1_730_000_000_000 * 1e6)
+
+    def test_bad_magic_is_skipped(self):
+        good = encode_frame(1, 1, 0, 20.0)
+        bad = b"\x00" + good[1:]
+        decoded = decode_frames([good + bad + good])
+        self.assertEqual(len(decoded["seq"]), 2)
+
+
+class SummaryRoundTripTest(unittest.TestCase):
+    def test_summary(self):
+        payload = encode_summary(44, 3, 1_730_000_000_000_000, 60_000, 30, (20.0, 21.25, 22.5), (40.0, 41.0, 42.0))
+        self.assertEqual(len(payload), SUMMARY_SIZE)
+        self.assertTrue(is_summary(payload))
+        self.assertFalse(is_frame(payload))
+        decoded = decode_summaries([encode_frame(1, 1, 0, 20.0), payload + payload])
+        np.testing.assert_array_equal(decoded["message"], [1, 1])
+        self.assertEqual(decoded["device"][0], 44)
+        self.assertEqual(decoded["end_ns"][0] - decoded["start_ns"][0], 60_000 * 1_000_000)
+        self.assertEqual(decoded["count"][0], 30)
+        self.assertEqual((decoded["temperature_min"][0], decoded["temperature_mean"][0], decoded["temperature_max"][0]),
+                         (20.0, 21.25, 22.5))
+        self.assertEqual(decoded["humidity_max"][0], 42.0)
+        # 摘要訊框不會出現在 decode_frames 的結果中
+        self.assertEqual(len(decode_frames([payload])["seq"]), 0)
+
+    def test_summary_without_humidity(self):
+        decoded = decode_summaries([encode_summary(1, 1, 0, 1000, 1, (20.0, 20.0, 20.0))])
+        self.assertTrue(np.isnan(decoded["humidity_mean"][0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+"""message_queue.py：三種滿載策略與計數器"""
+import unittest
+
+from message_queue import BoundedMessageQueue
+
+
+def message(topic, i):
+    return (topic, str(i).encode(), i, 0)
+
+
+class BoundedMessageQueueTest(unittest.TestCase):
+    def test_under_capacity_keeps_everything(self):
+        queue = BoundedMessageQueue(maxsize=5)
+        for i in range(5):
+            self.assertTrue(queue.put(message("a", i)))
+        self.assertEqual([item[2] for item in queue.drain()], list(range(5)))
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(queue.stats()["dropped"], 0)
+
+    def test_drop_oldest(self):
+        queue = BoundedMessageQueue(maxsize=3, policy="drop-oldest")
+        for i in range(5):
+            self.assertTrue(queue.put(message("a", i)))
+        self.assertEqual([item[2] for item in queue.drain()], [2, 3, 4])
+        stats = queue.stats()
+        self.assertEqual((stats["enqueued"], stats["dropped"], stats["high_water"]), (5, 2, 3))
+
+    def test_drop_newest(self):
+        queue = BoundedMessageQueue(maxsize=3, policy="drop-newest")
+        results = [queue.put(message("a", i)) for i in range(5)]
+        self.assertEqual(results, [True, True, True, False, False])
+        self.assertEqual([item[2] for item in queue.drain()], [0, 1, 2])
+        self.assertEqual(queue.stats()["dropped"], 2)
+
+    def test_coalesce_keeps_latest_per_topic_in_order(self):
+        queue = BoundedMessageQueue(maxsize=4, policy="coalesce")
+        for i, topic in enumerate(["a", "b", "a", "b", "c"]):
+            queue.put(message(topic, i))
+        # 第 5 則時滿載：a、b 各只留最新的一則，不丟棄任何主題
+        self.assertEqual([(item[0], item[2]) for item in queue.drain()], [("a", 2), ("b", 3), ("c", 4)])
+        stats = queue.stats()
+        self.assertEqual((stats["coalesced"], stats["dropped"]), (2, 0))
+
+    def test_coalesce_falls_back_to_drop_oldest_with_distinct_topics(self):
+        queue = BoundedMessageQueue(maxsize=3, policy="coalesce")
+        for i in range(6):
+            queue.put(message(f"t{i}", i))
+        self.assertEqual([item[2] for item in queue.drain()], [3, 4, 5])
+        stats = queue.stats()
+        self.assertEqual((stats["coalesced"], stats["dropped"]), (0, 3))
+
+    def test_reset_counters_and_policy_change(self):
+        queue = BoundedMessageQueue(maxsize=2)
+        for i in range(4):
+            queue.put(message("a", i))
+        queue.reset_counters()
+        self.assertEqual({k: v for k, v in queue.stats().items() if k in ("enqueued", "dropped", "high_water")},
+                         {"enqueued": 0, "dropped": 0, "high_water": 0})
+        queue.policy = "drop-newest"
+        self.assertEqual(queue.stats()["policy"], "drop-newest")
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            BoundedMessageQueue(maxsize=0)
+        with self.assertRaises(ValueError):
+            BoundedMessageQueue(policy="drop-random")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+"""timeseries.py：環形緩衝區的繞回與保留格數、asof_join 的對齊"""
+import unittest
+
+import numpy as np
+
+from timeseries import RingBuffer, SeriesStore, asof_join
+
+S = 1_000_000_000
+
+
+class RingBufferTest(unittest.TestCase):
+    def test_append_wraps_and_keeps_latest_in_order(self):
+        buffer = RingBuffer(capacity=5, headroom=2)
+        for i in range(20):
+            buffer.append(timestamp=i, value=i * 1.5)
+        self.assertEqual(len(buffer), 5)
+        latest = buffer.latest()
+        np.testing.assert_array_equal(latest["timestamp"], np.arange(15, 20))
+        np.testing.assert_array_equal(latest["value"], np.arange(15, 20) * 1.5)
+        self.assertEqual(buffer.last("timestamp"), 19)
+
+    def test_extend_longer_than_slots_keeps_tail(self):
+        buffer = RingBuffer(capacity=4, headroom=2)
+        buffer.append(timestamp=-1, value=0.0)
+        buffer.extend(timestamp=np.arange(100), value=np.arange(100, dtype=float))
+        np.testing.assert_array_equal(buffer.latest()["timestamp"], np.arange(96, 100))
+        np.testing.assert_array_equal(buffer.latest(2)["value"], [98.0, 99.0])
+
+    def test_latest_is_read_only_view(self):
+        buffer = RingBuffer(capacity=4, headroom=2)
+        buffer.extend(timestamp=np.arange(3), value=np.ones(3))
+        view = buffer.latest()["value"]
+        with self.assertRaises(ValueError):
+            view[0] = 2.0
+
+    def test_view_survives_headroom_writes(self):
+        buffer = RingBuffer(capacity=4, headroom=3)
+        buffer.extend(timestamp=np.arange(4), value=np.arange(4, dtype=float))
+        view = buffer.latest()["timestamp"]
+        snapshot = view.copy()
+        # 之後再寫入 headroom 筆，先前取出的視圖內容不變
+        for i in range(3):
+            buffer.append(timestamp=100 + i, value=0.0)
+        np.testing.assert_array_equal(view, snapshot)
+        np.testing.assert_array_equal(buffer.latest()["timestamp"], [3, 100, 101, 102])
+
+    def test_missing_float_column_is_nan(self):
+        buffer = RingBuffer(capacity=3, columns={"timestamp": np.int64, "a": float, "b": float})
+        buffer.append(timestamp=1, a=2.0)
+        self.assertTrue(np.isnan(buffer.last("b")))
+        self.assertIsNone(RingBuffer(capacity=3).last("value"))
+
+    def test_clear(self):
+        buffer = RingBuffer(capacity=3)
+        buffer.extend(timestamp=np.arange(3), value=np.zeros(3))
+        buffer.clear()
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(len(buffer.latest()["timestamp"]), 0)
+
+
+class AsofJoinTest(unittest.TestCase):
+    def series(self, **points):
+        """{名稱: [(秒, 數值), ...]} -> asof_join 的輸入"""
+        return {name: {"timestamp": np.array([t * S for t, _ in items], dtype=np.int64),
+                       "value": np.array([v for _, v in items], dtype=float)}
+                for name, items in points.items()}
+
+    def test_buckets_take_last_value_and_carry_forward(self):
+        series = self.series(temperature=[(0, 20.0), (0.5, 21.0), (3, 22.0)], humidity=[(1, 50.0)])
+        joined = asof_join(series, S)
+        np.testing.assert_array_equal(joined["timestamp"], [0, S, 3 * S])
+        np.testing.assert_array_equal(joined["temperature"], [21.0, 21.0, 22.0])
+        np.testing.assert_array_equal(joined["humidity"], [np.nan, 50.0, 50.0])
+
+    def test_no_bucket_uses_raw_timestamps(self):
+        series = self.series(a=[(0.25, 1.0), (0.75, 2.0)], b=[(0.5, 3.0)])
+        joined = asof_join(series, 0)
+        np.testing.assert_array_equal(joined["timestamp"], [S // 4, S // 2, 3 * S // 4])
+        np.testing.assert_array_equal(joined["b"], [np.nan, 3.0, 3.0])
+
+    def test_out_of_order_points_are_sorted(self):
+        series = self.series(a=[(2, 2.0), (0, 0.0), (1, 1.0)])
+        np.testing.assert_array_equal(asof_join(series, S)["a"], [0.0, 1.0, 2.0])
+
+    def test_last_n_matches_full_join(self):
+        store = SeriesStore(capacity=1000)
+        rng = np.random.default_rng(0)
+        store.extend("temperature", np.sort(rng.integers(0, 500 * S, 800)), rng.random(800))
+        store.extend("humidity", np.sort(rng.integers(0, 500 * S, 50)), rng.random(50))
+        full = asof_join(store.latest(), S)
+        tail = asof_join(store.latest(), S, n=30)
+        for name, values in full.items():
+            np.testing.assert_array_equal(tail[name], values[-30:])
+
+    def test_zero_rows(self):
+        series = self.series(a=[(0, 1.0), (1, 2.0), (2, 3.0)])
+        joined = asof_join(series, S, n=0)
+        self.assertEqual(len(joined["timestamp"]), 0)
+        self.assertEqual(len(joined["a"]), 0)
+
+    def test_missing_and_empty_series(self):
+        joined = asof_join(self.series(a=[(0, 1.0)]), S, names=["a", "b"])
+        np.testing.assert_array_equal(joined["b"], [np.nan])
+        joined = asof_join({}, S, n=5, names=["a"])
+        self.assertEqual(len(joined["timestamp"]), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
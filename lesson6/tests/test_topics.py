@@ -0,0 +1,84 @@
+"""topics.py：萬用字元字首樹、過濾器涵蓋關係與訂閱清單去重"""
+import unittest
+
+from topics import TopicRegistry, TopicTrie, filter_covers, validate_filter
+
+
+class TopicTrieTest(unittest.TestCase):
+    def setUp(self):
+        self.trie = TopicTrie()
+        for topic_filter in ["home/livingroom/temperature", "home/+/temperature", "home/#", "#", "+/+/light"]:
+            self.trie.insert(topic_filter, topic_filter)
+
+    def test_exact_and_wildcards(self):
+        self.assertEqual(sorted(self.trie.match("home/livingroom/temperature")),
+                         sorted(["home/livingroom/temperature", "home/+/temperature", "home/#", "#"]))
+        self.assertEqual(sorted(self.trie.match("home/kitchen/light")), sorted(["home/#", "#", "+/+/light"]))
+        self.assertEqual(self.trie.match("office/pc"), ["#"])
+
+    def test_hash_matches_parent_level(self):
+        # home/# 也比對 home 本身（MQTT 規範）
+        self.assertIn("home/#", self.trie.match("home"))
+
+    def test_plus_does_not_match_extra_levels(self):
+        self.assertNotIn("home/+/temperature", self.trie.match("home/a/b/temperature"))
+
+    def test_system_topics_skip_first_level_wildcards(self):
+        self.assertEqual(self.trie.match("$SYS/broker/clients"), [])
+        self.trie.insert("$SYS/#", "sys")
+        self.assertEqual(self.trie.match("$SYS/broker/clients"), ["sys"])
+
+    def test_invalid_filters(self):
+        for topic_filter in ["home/#/x", "home/a+", "home#"]:
+            with self.assertRaises(ValueError):
+                validate_filter(topic_filter)
+
+
+class FilterCoversTest(unittest.TestCase):
+    def test_covers(self):
+        self.assertTrue(filter_covers("home/+/temperature", "home/livingroom/temperature"))
+        self.assertTrue(filter_covers("home/#", "home/+/temperature"))
+        self.assertTrue(filter_covers("#", "home/#"))
+        self.assertTrue(filter_covers("home/+/+", "home/+/light"))
+
+    def test_does_not_cover(self):
+        self.assertFalse(filter_covers("home/+/temperature", "home/#"))
+        self.assertFalse(filter_covers("home/livingroom/temperature", "home/+/temperature"))
+        self.assertFalse(filter_covers("home/+", "home/a/b"))
+        self.assertFalse(filter_covers("#", "$SYS/#"))
+        self.assertFalse(filter_covers("+/broker", "$SYS/broker"))
+
+
+class TopicRegistryTest(unittest.TestCase):
+    def test_subscriptions_drop_covered_filters_and_keep_highest_qos(self):
+        registry = TopicRegistry()
+        registry.register("home/livingroom/temperature", print, qos=2)
+        registry.register("home/+/temperature", print, qos=0)
+        registry.subscribe("home/+/humidity", qos=1)
+        registry.subscribe("testtopic", qos=0)
+        self.assertEqual(dict(registry.subscriptions()),
+                         {"home/+/temperature": 2, "home/+/humidity": 1, "testtopic": 0})
+
+    def test_wildcard_covers_everything(self):
+        registry = TopicRegistry()
+        registry.subscribe("home/+/light", qos=1)
+        registry.subscribe("#", qos=0)
+        self.assertEqual(registry.subscriptions(), [("#", 1)])
+
+    def test_dispatch_is_cached_and_invalidated_on_register(self):
+        registry = TopicRegistry()
+        calls = []
+
+        @registry.handler("home/+/co2")
+        def co2(batch):
+            calls.append(batch)
+
+        self.assertEqual(registry.dispatch("home/kitchen/co2"), (co2,))
+        self.assertIs(registry.dispatch("home/kitchen/co2"), registry.dispatch("home/kitchen/co2"))
+        registry.register("home/#", print)
+        self.assertEqual(set(registry.dispatch("home/kitchen/co2")), {co2, print})
+        self.assertEqual(registry.dispatch("office/co2"), ())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,235 @@
+"""
+以 NumPy 預先配置的欄式環形緩衝區（時間序列儲存）
+
+取代原本「deque 裝 dict + 每次重新整理都 pd.DataFrame(list(...))」的做法：
+- 每個欄位一條連續的 NumPy 陣列（時間戳記為 int64 epoch 奈秒）
+- 新增資料為 O(1)，不產生任何 Python 物件
+- 陣列長度是格數（slots）的兩倍，每筆資料同時寫入 i 與 i + slots 兩個位置（鏡像），
+  因此「最近 N 筆」永遠是一段連續、依時間排序的切片，可以零複製地取出視圖
+
+溫度、濕度等每個序列各自保存實際收到的數據點（SeriesStore），
+需要「同一列有溫度也有濕度」的表格時，才在讀取時以 asof_join 向量化對齊。
+"""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+HISTORY_CAPACITY = 100_000  # 每個序列預設保留最近 10 萬筆數據
+ALIGN_BUCKET_NS = 1_000_000_000  # asof_join 預設以 1 秒為一列
+SERIES_COLUMNS = {"timestamp": np.int64, "value": np.float64}
+LOCAL_TIMEZONE = datetime.now().astimezone().tzinfo  # 圖表以本地時間顯示
+
+
+class RingBuffer:
+    """欄式環形緩衝區，每個欄位都是預先配置的 NumPy 陣列"""
+
+    def __init__(self, capacity=HISTORY_CAPACITY, columns=None, headroom=None):
+        """
+        capacity = 對外可讀取的最大筆數
+        columns  = {欄位名稱: dtype}，預設為 timestamp / value（SERIES_COLUMNS）
+        headroom = 額外保留的格數：取出的視圖在之後再寫入 headroom 筆之前都不會被覆蓋
+        """
+        if columns is None:
+            columns = SERIES_COLUMNS
+        if headroom is None:
+            headroom = max(1024, capacity // 8)
+        self.capacity = capacity
+        self._slots = capacity + headroom
+        self._columns = {}
+        for name, dtype in columns.items():
+            dtype = np.dtype(dtype)
+            fill = np.nan if dtype.kind == 'f' else 0
+            self._columns[name] = np.full(2 * self._slots, fill, dtype=dtype)
+        self._head = 0   # 下一筆要寫入的位置（0 ~ slots-1）
+        self._size = 0
+
+    def __len__(self):
+        return min(self._size, self.capacity)
+
+    @property
+    def columns(self):
+        return tuple(self._columns)
+
+    @property
+    def nbytes(self):
+        return sum(col.nbytes for col in self._columns.values())
+
+    def append(self, **values):
+        """新增一筆資料（O(1)）；未提供的浮點欄位填入 NaN"""
+        i = self._head
+        j = i + self._slots
+        for name, col in self._columns.items():
+            value = values.get(name)
+            if value is None:
+                value = np.nan if col.dtype.kind == 'f' else 0
+            col[i] = value
+            col[j] = value
+        self._head = (i + 1) % self._slots
+        self._size += 1
+
+    def extend(self, **columns):
+        """整批新增資料（向量化寫入）；各欄位為等長的陣列，未提供的浮點欄位填入 NaN"""
+        n = len(next(iter(columns.values())))
+        if n == 0:
+            return
+        # 超過格數的部分只會被自己覆蓋，直接只寫最後 slots 筆
+        skip = max(0, n - self._slots)
+        idx = (self._head + skip + np.arange(n - skip)) % self._slots
+        for name, col in self._columns.items():
+            values = columns.get(name)
+            if values is None:
+                values = np.nan if col.dtype.kind == 'f' else 0
+            else:
+                values = np.asarray(values)[skip:]
+            col[idx] = values
+            col[idx + self._slots] = values
+        self._head = (self._head + n) % self._slots
+        self._size += n
+
+    def last(self, name):
+        """取得最後一筆資料的某個欄位，沒有資料時回傳 None"""
+        if self._size == 0:
+            return None
+        return self._columns[name][(self._head - 1) % self._slots].item()
+
+    def latest(self, n=None):
+        """
+        取得最近 n 筆資料（依時間由舊到新）
+        回傳 {欄位名稱: 唯讀 NumPy 視圖}，不複製任何資料
+        """
+        size = len(self)
+        n = size if n is None else max(0, min(n, size))
+        end = self._head + self._slots
+        views = {}
+        for name, col in self._columns.items():
+            view = col[end - n:end]
+            view.flags.writeable = False
+            views[name] = view
+        return views
+
+    def clear(self):
+        self._head = 0
+        self._size = 0
+
+
+class SeriesStore:
+    """每個序列（主題）一個環形緩衝區，只保存實際收到的數據點，不做任何對齊或補值"""
+
+    def __init__(self, capacity=HISTORY_CAPACITY, headroom=None):
+        self.capacity = capacity
+        self.headroom = headroom  # 見 RingBuffer；None 時依容量決定
+        self._series = {}
+
+    def __contains__(self, name):
+        return name in self._series
+
+    def names(self):
+        return list(self._series)
+
+    def size(self, name):
+        buffer = self._series.get(name)
+        return 0 if buffer is None else len(buffer)
+
+    def extend(self, name, timestamps, values):
+        """整批新增一個序列的數據（第一次寫入時建立該序列）"""
+        if len(timestamps) == 0:
+            return
+        buffer = self._series.get(name)
+        if buffer is None:
+            buffer = self._series[name] = RingBuffer(self.capacity, SERIES_COLUMNS, self.headroom)
+        buffer.extend(timestamp=timestamps, value=values)
+
+    def latest(self, n=None):
+        """{序列名稱: {"timestamp": 唯讀視圖, "value": 唯讀視圖}}，每個序列最近 n 筆"""
+        return {name: buffer.latest(n) for name, buffer in self._series.items()}
+
+    def clear(self):
+        for buffer in self._series.values():
+            buffer.clear()
+
+
+def _bucket_last(timestamps, values, bucket_ns):
+    """每個時間區間只留最後一個值：回傳 (區間起點, 數值)，依時間排序"""
+    if len(timestamps) > 1 and (timestamps[1:] < timestamps[:-1]).any():
+        order = np.argsort(timestamps, kind='stable')
+        timestamps, values = timestamps[order], values[order]
+    keys = timestamps // bucket_ns * bucket_ns if bucket_ns else timestamps
+    last = np.r_[keys[1:] != keys[:-1], True] if len(keys) else np.empty(0, dtype=bool)
+    return keys[last], values[last]
+
+
+def asof_join(series, bucket_ns=ALIGN_BUCKET_NS, n=None, names=None):
+    """
+    把多個各自取樣的序列對齊成一張表（向量化，讀取時才計算）
+    series    = {名稱: {"timestamp": epoch 奈秒陣列, "value": 數值陣列}}，例如 SeriesStore.latest()
+    bucket_ns = 對齊間隔；時間切成這個長度的區間，任一序列有數據的區間就是一列，
+                每個序列取該區間內最後一個值，區間內沒有數據時沿用之前最近的值（as-of），
+                還沒有任何數據時為 NaN；0 代表不分區間，以各序列實際的時間點為列
+    n         = 只回傳最後 n 列（只讀取每個序列尾端需要的部分）
+    names     = 輸出的序列（預設為 series 的全部）；不在 series 中的序列整欄為 NaN
+    回傳 {"timestamp": 區間起點, 名稱: 數值陣列, ...}，可直接交給 to_frame()
+    """
+    names = list(series) if names is None else list(names)
+    empty = {"timestamp": np.empty(0, dtype=np.int64), "value": np.empty(0)}
+    take = None if n is None else n + 1
+    while True:
+        parts = {}
+        truncated = []
+        for name in names:
+            columns = series.get(name, empty)
+            timestamps, values = columns["timestamp"], columns["value"]
+            if take is not None and len(timestamps) > take:
+                timestamps, values = timestamps[-take:], values[-take:]
+                truncated.append(name)
+            parts[name] = _bucket_last(timestamps, values, bucket_ns)
+        keys = [part[0] for part in parts.values()]
+        grid = np.concatenate(keys) if keys else np.empty(0, dtype=np.int64)
+        grid.sort(kind='stable')  # 各段本身已排序，合併排序很快
+        grid = grid[np.r_[True, grid[1:] != grid[:-1]]] if len(grid) else grid
+        if n is not None:
+            grid = grid[len(grid) - min(n, len(grid)):]
+        # 只讀取尾端時，必須已湊滿 n 列，且被截斷的序列涵蓋第一列之前的數據，否則中間可能缺列或缺少 as-of 的值
+        # n == 0 時不需要任何一列，直接回傳空的欄位
+        if not truncated or n == 0 or (len(grid) == n and all(parts[name][0][0] <= grid[0] for name in truncated)):
+            break
+        # 依目前每列平均用掉的數據點數估計還需要多少（至少加倍）
+        take = max(take * 2, take * (n + 1) // max(len(grid), 1) + 1)
+
+    joined = {"timestamp": grid}
+    for name, (part_keys, part_values) in parts.items():
+        idx = np.searchsorted(part_keys, grid, side='right') - 1
+        column = part_values[np.maximum(idx, 0)] if len(part_values) else np.full(len(grid), np.nan)
+        column = np.where(idx >= 0, column, np.nan)
+        joined[name] = column
+    return joined
+
+
+def ffill(values, seed=None):
+    """向量化的前值填補：NaN 沿用前一個有效值，開頭的 NaN 使用 seed"""
+    missing = np.isnan(values)
+    if not missing.any():
+        return values
+    idx = np.where(missing, -1, np.arange(len(values)))
+    np.maximum.accumulate(idx, out=idx)
+    filled = values[np.maximum(idx, 0)]
+    filled[idx < 0] = np.nan if seed is None else seed
+    return filled
+
+
+def to_frame(columns, n=None):
+    """
+    將 latest() 或 asof_join() 取得的欄位轉成 DataFrame（只處理最後 n 筆）
+    timestamp 欄位由 epoch 奈秒轉為本地時間，方便圖表顯示
+    """
+    data = {}
+    for name, values in columns.items():
+        if n is not None:
+            values = values[len(values) - min(n, len(values)):]
+        if name == "timestamp":
+            values = (pd.to_datetime(values, unit='ns', utc=True)
+                      .tz_convert(LOCAL_TIMEZONE)
+                      .tz_localize(None))
+        data[name] = values
+    return pd.DataFrame(data, copy=False)
+
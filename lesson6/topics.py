@@ -0,0 +1,180 @@
+"""
+MQTT 主題處理器登錄表
+
+訂閱清單與訊息分派都由同一份登錄表產生，新增感測器只要登錄一個處理器：
+- 主題過濾器（可含 + 與 # 萬用字元）編譯成字首樹，比對成本只和主題層數有關
+- 實際收到的主題會快取比對結果，之後的分派只是一次 dict 查詢（O(1)）
+- handlers/ 資料夾中的外掛模組可以自行登錄新的裝置類型，不必修改 app.py
+"""
+import importlib
+import importlib.util
+import os
+from collections import namedtuple
+from pathlib import Path
+
+HANDLER_DIR = Path(__file__).parent / "handlers"
+MATCH_CACHE_SIZE = 10_000  # 快取的主題數上限，超過時清空重建
+
+# 處理器收到的資料：同一個主題在這一批中的所有訊息
+TopicBatch = namedtuple("TopicBatch", ["topic", "payloads", "timestamps", "qos"])
+
+
+class _Node:
+    __slots__ = ("children", "values")
+
+    def __init__(self):
+        self.children = {}
+        self.values = []
+
+
+class TopicTrie:
+    """MQTT 主題過濾器字首樹"""
+
+    def __init__(self):
+        self._root = _Node()
+
+    def insert(self, topic_filter, value):
+        validate_filter(topic_filter)
+        node = self._root
+        for level in topic_filter.split("/"):
+            node = node.children.setdefault(level, _Node())
+        node.values.append(value)
+
+    def match(self, topic):
+        """回傳所有符合 topic 的過濾器所登錄的值（依登錄順序）"""
+        levels = topic.split("/")
+        matched = []
+        self._match(self._root, levels, 0, matched, topic.startswith("$"))
+        return matched
+
+    def _match(self, node, levels, i, matched, system_topic):
+        # 以 $ 開頭的系統主題不會被第一層的萬用字元比對到（MQTT 規範）
+        wildcard_ok = not (system_topic and i == 0)
+        if wildcard_ok and "#" in node.children:
+            matched.extend(node.children["#"].values)
+        if i == len(levels):
+            matched.extend(node.values)
+            return
+        child = node.children.get(levels[i])
+        if child is not None:
+            self._match(child, levels, i + 1, matched, system_topic)
+        if wildcard_ok and "+" in node.children:
+            self._match(node.children["+"], levels, i + 1, matched, system_topic)
+
+
+def validate_filter(topic_filter):
+    levels = topic_filter.split("/")
+    for i, level in enumerate(levels):
+        if "#" in level and (level != "#" or i != len(levels) - 1):
+            raise ValueError(f"無效的主題過濾器: {topic_filter}（# 只能是最後一層）")
+        if "+" in level and level != "+":
+            raise ValueError(f"無效的主題過濾器: {topic_filter}（+ 必須單獨佔一層）")
+
+
+def filter_covers(general, specific):
+    """general 能比對到 specific 所能比對到的所有主題時回傳 True"""
+    general_levels = general.split("/")
+    specific_levels = specific.split("/")
+    for i, level in enumerate(general_levels):
+        # 第一層的萬用字元不會比對到 $ 開頭的系統主題
+        if i == 0 and level in ("+", "#") and specific_levels[0].startswith("$"):
+            return False
+        if level == "#":
+            return True
+        if i >= len(specific_levels) or specific_levels[i] == "#":
+            return False
+        if level != "+" and level != specific_levels[i]:
+            return False
+    return len(general_levels) == len(specific_levels)
+
+
+class TopicRegistry:
+    """主題處理器登錄表：同時提供訂閱清單與分派表"""
+
+    def __init__(self):
+        self._trie = TopicTrie()
+        self._filters = {}  # {過濾器: qos}，保持登錄順序
+        self._cache = {}    # {實際主題: (處理器, ...)}
+
+    def register(self, topic_filter, handler, qos=1):
+        """登錄處理器；handler(batch) 會收到一個 TopicBatch"""
+        self._trie.insert(topic_filter, handler)
+        self._filters[topic_filter] = max(qos, self._filters.get(topic_filter, 0))
+        self._cache.clear()
+
+    def subscribe(self, topic_filter, qos=1):
+        """只訂閱、不登錄批次處理器（例如只需要最新值的主題，見 IngestService.on_message）"""
+        validate_filter(topic_filter)
+        self._filters[topic_filter] = max(qos, self._filters.get(topic_filter, 0))
+
+    def handler(self, topic_filter, qos=1):
+        """裝飾器寫法：@registry.handler("home/+/co2")"""
+        def decorator(func):
+            self.register(topic_filter, func, qos=qos)
+            return func
+        return decorator
+
+    def topic_filters(self):
+        return list(self._filters)
+
+    def subscriptions(self):
+        """
+        給 client.subscribe() 使用的 [(過濾器, qos), ...]
+        被其他過濾器涵蓋的過濾器不另外訂閱（例如有 home/+/temperature 時略過 home/livingroom/temperature），
+        重疊的訂閱可能讓 Broker 把同一則訊息送兩次；涵蓋者的 qos 取兩者較高的
+        """
+        def covered(topic_filter, candidates):
+            return [other for other in candidates if other != topic_filter and filter_covers(other, topic_filter)]
+
+        # 沒有被任何過濾器涵蓋的才訂閱（涵蓋關係可遞移，每個過濾器至少被其中一個涵蓋）
+        subscriptions = {f: qos for f, qos in self._filters.items() if not covered(f, self._filters)}
+        for topic_filter, qos in self._filters.items():
+            if topic_filter not in subscriptions:
+                covering = covered(topic_filter, subscriptions)[0]
+                subscriptions[covering] = max(qos, subscriptions[covering])
+        return list(subscriptions.items())
+
+    def dispatch(self, topic):
+        """取得處理這個主題的所有處理器（快取後為 O(1)）"""
+        handlers = self._cache.get(topic)
+        if handlers is None:
+            if len(self._cache) >= MATCH_CACHE_SIZE:
+                self._cache.clear()
+            handlers = self._cache[topic] = tuple(self._trie.match(topic))
+        return handlers
+
+
+def load_plugins(registry, service, plugin_dir=HANDLER_DIR):
+    """
+    載入外掛處理器：
+    1. plugin_dir 中的每個 .py 檔（底線開頭的除外）
+    2. 環境變數 MQTT_HANDLER_MODULES 指定的模組（以逗號分隔）
+    每個模組需提供 register(registry, service) 函式
+    回傳成功載入的模組名稱
+    """
+    modules = []
+    if plugin_dir.is_dir():
+        for path in sorted(plugin_dir.glob("*.py")):
+            if path.name.startswith("_"):
+                continue
+            try:
+                spec = importlib.util.spec_from_file_location(f"handlers.{path.stem}", path)
+                module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+                modules.append(module)
+            except Exception as e:
+                print(f"載入處理器模組 {path.name} 失敗: {e}")
+    for name in filter(None, os.environ.get("MQTT_HANDLER_MODULES", "").split(",")):
+        try:
+            modules.append(importlib.import_module(name.strip()))
+        except Exception as e:
+            print(f"載入處理器模組 {name} 失敗: {e}")
+
+    loaded = []
+    for module in modules:
+        try:
+            module.register(registry, service)
+            loaded.append(module.__name__)
+        except Exception as e:
+            print(f"載入處理器模組 {module.__name__} 失敗: {e}")
+    return loaded
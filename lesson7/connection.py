@@ -0,0 +1,208 @@
+# connection.py
+# 適用：Raspberry Pi Pico W（MicroPython）
+#
+# 在背景維持 WiFi 與 MQTT 連線的 asyncio 任務（狀態機）：
+#   WiFi 未連線 → 連線 WiFi → 連線 MQTT → 已連線 →（斷線）→ 回到對應的狀態
+# 失敗時以指數退避重試（1、2、4… 秒，最多 BACKOFF_MAX_MS，加上少量隨機抖動），
+# 等待期間不會卡住其他任務，取樣與緩衝照常進行。
+# MQTT 連線與 publish 本身是阻塞的，以 CONNECT_TIMEOUT_S / SOCKET_TIMEOUT_S 限制最多卡住多久。
+# keep_connected=False 時只在上傳流程呼叫 want(True) 後才連線，want(False) 就斷線並關閉無線電（省電）。
+# radio_on_ms 累計無線電開啟的時間、messages 累計成功發布的訊息數，用來比較各省電模式。
+
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+import random
+import time
+
+WIFI_DOWN = "WiFi 未連線"
+WIFI_CONNECTING = "連線 WiFi 中"
+MQTT_CONNECTING = "連線 MQTT 中"
+CONNECTED = "已連線"
+
+BACKOFF_MIN_MS = 1000
+BACKOFF_MAX_MS = 20000      # 上限不要太長，AP 重新開機後幾秒內就能恢復
+WIFI_TIMEOUT_MS = 15000     # 單次 WiFi 連線最多等多久
+CHECK_INTERVAL_MS = 500     # 已連線時多久檢查一次 WiFi 狀態
+PING_INTERVAL_MS = 30000    # 已連線時多久送一次 MQTT PINGREQ（偵測 Broker 已經斷線）
+# umqtt.simple 的 socket 是阻塞式的，等待期間整個事件迴圈（包括取樣）都會停住，逾時要短
+CONNECT_TIMEOUT_S = 2       # TCP 連線與等待 CONNACK 最多幾秒（Broker 連不上時不會卡住數十秒）
+SOCKET_TIMEOUT_S = 1        # 連上後的 socket 逾時：qos=1 的 publish 等 PUBACK 最多 1 秒，不超過取樣間隔
+
+
+class ConnectionManager:
+    """
+    wifi = 提供 begin() 與 is_connected() 的模組（wifi_connect.py）
+    make_client = 建立 MQTTClient 的函式（尚未 connect）
+    on_wifi = 每次 WiFi 連上時呼叫（例如 NTP 校時）
+    keep_connected = 是否一直保持連線
+    """
+
+    def __init__(self, wifi, make_client, on_wifi=None, keep_connected=True):
+        self.wifi = wifi
+        self.make_client = make_client
+        self.on_wifi = on_wifi
+        self.client = None
+        self.state = WIFI_DOWN
+        self.up = asyncio.Event()   # 已連線時 set，其他任務可以 await up.wait()
+        self.wanted = keep_connected
+        self._wanted = asyncio.Event()
+        if keep_connected:
+            self._wanted.set()
+        self.outages = 0            # 斷線次數
+        self.last_outage_ms = 0     # 上一次從斷線到恢復花了多少毫秒
+        self.messages = 0           # 成功發布的訊息數
+        self.radio_on_ms = 0        # 無線電累計開啟時間（不含目前這一段）
+        self._radio_since = None    # 目前這一段從何時開啟（None = 關閉中）
+        self._down_since = time.ticks_ms()
+        self._backoff = BACKOFF_MIN_MS
+
+    def is_connected(self):
+        return self.client is not None
+
+    def publish(self, topic, payload, qos=0):
+        """透過目前的連線發布；失敗時標記為斷線（背景任務會重新連線）並把例外往上丟"""
+        if self.client is None:
+            raise OSError("MQTT 未連線")
+        try:
+            self.client.publish(topic, payload, qos=qos)
+        except Exception as e:
+            self.lost(e)
+            raise
+        self.messages += 1
+
+    def want(self, on):
+        """要求連線（on=True）或釋放連線並關閉無線電（on=False）"""
+        self.wanted = on
+        if on:
+            self._wanted.set()
+        else:
+            self._wanted.clear()
+            self.power_down()
+
+    def power_down(self):
+        """主動斷開 MQTT 與 WiFi 並關閉無線電（不算斷線次數）"""
+        if self.client is not None:
+            try:
+                self.client.disconnect()
+            except Exception:
+                pass
+            self.client = None
+        self.up.clear()
+        try:
+            self.wifi.off()
+        except Exception as e:
+            print("關閉無線電失敗:", e)
+        if self._radio_since is not None:
+            self.radio_on_ms += time.ticks_diff(time.ticks_ms(), self._radio_since)
+            self._radio_since = None
+        self.state = WIFI_DOWN
+        self._down_since = time.ticks_ms()
+
+    def radio_time_ms(self):
+        """無線電累計開啟時間（含目前這一段）"""
+        if self._radio_since is None:
+            return self.radio_on_ms
+        return self.radio_on_ms + time.ticks_diff(time.ticks_ms(), self._radio_since)
+
+    def lost(self, reason):
+        """目前的連線已經失效"""
+        if self.client is not None:
+            print("連線中斷:", reason)
+            try:
+                self.client.disconnect()
+            except Exception:
+                pass
+            self.client = None
+            self.outages += 1
+            self._down_since = time.ticks_ms()
+        self.up.clear()
+        self.state = WIFI_DOWN if not self.wifi.is_connected() else MQTT_CONNECTING
+
+    async def _wait_backoff(self):
+        """指數退避：等待目前的退避時間（加上 0～25% 的抖動），下一次加倍"""
+        delay = self._backoff + self._backoff * random.getrandbits(8) // 1024
+        print(f"{self.state}，{delay / 1000:.1f} 秒後重試")
+        self._backoff = min(self._backoff * 2, BACKOFF_MAX_MS)
+        # WiFi 晶片可能自己先連回來，不必等滿
+        waited = 0
+        while waited < delay:
+            await asyncio.sleep_ms(CHECK_INTERVAL_MS)
+            waited += CHECK_INTERVAL_MS
+            if not self.wanted or (self.state == WIFI_DOWN and self.wifi.is_connected()):
+                break
+
+    async def _connect_wifi(self):
+        self.state = WIFI_CONNECTING
+        if self._radio_since is None:
+            self._radio_since = time.ticks_ms()
+        try:
+            self.wifi.begin()
+        except Exception as e:
+            print("WiFi 啟動失敗:", e)
+        start = time.ticks_ms()
+        while self.wanted and time.ticks_diff(time.ticks_ms(), start) < WIFI_TIMEOUT_MS:
+            if self.wifi.is_connected():
+                print("WiFi 連線成功，IP:", self.wifi.get_ip())
+                if self.on_wifi is not None:
+                    self.on_wifi()
+                return True
+            await asyncio.sleep_ms(250)
+        self.state = WIFI_DOWN
+        return False
+
+    def _connect_mqtt(self):
+        self.state = MQTT_CONNECTING
+        client = self.make_client()
+        try:
+            # connect(timeout=) 在建立 socket 後、連線前就設定逾時（umqtt.simple 1.4 以上）
+            client.connect(timeout=CONNECT_TIMEOUT_S)
+            client.sock.settimeout(SOCKET_TIMEOUT_S)
+        except Exception as e:
+            print("MQTT 連線失敗:", e)
+            return False
+        self.client = client
+        self.state = CONNECTED
+        if self.outages:
+            self.last_outage_ms = time.ticks_diff(time.ticks_ms(), self._down_since)
+            print(f"已恢復 MQTT 連線（中斷 {self.last_outage_ms / 1000:.1f} 秒）")
+        else:
+            print("已連接到 MQTT Broker")
+        self._backoff = BACKOFF_MIN_MS
+        self.up.set()
+        return True
+
+    async def run(self):
+        """背景任務：永遠不會結束"""
+        last_ping = time.ticks_ms()
+        while True:
+            if not self.wanted:
+                await self._wanted.wait()
+                continue
+            if not self.wifi.is_connected():
+                self.lost("WiFi 斷線")
+                if not await self._connect_wifi():
+                    await self._wait_backoff()
+                    continue
+            if self.client is None:
+                if not self._connect_mqtt():
+                    await self._wait_backoff()
+                    continue
+                last_ping = time.ticks_ms()
+            await asyncio.sleep_ms(CHECK_INTERVAL_MS)
+            if self.client is not None and time.ticks_diff(time.ticks_ms(), last_ping) >= PING_INTERVAL_MS:
+                last_ping = time.ticks_ms()
+                try:
+                    self.client.ping()
+                except Exception as e:
+                    self.lost(e)
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "outages": self.outages,
+            "last_outage_ms": self.last_outage_ms,
+            "messages": self.messages,
+            "radio_on_ms": self.radio_time_ms(),
+        }
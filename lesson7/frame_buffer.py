@@ -0,0 +1,165 @@
+# frame_buffer.py
+# 適用：Raspberry Pi Pico W（MicroPython），也可以在一般 Python 上測試
+#
+# 取樣先放進固定大小的 RAM 環形緩衝區（預先配置的 bytearray，不會在執行中配置記憶體），
+# 連上 Broker 時再把多筆取樣串接成一則訊息整批送出。
+# 訊框格式與專案根目錄的 sensor_frames 套件相同（每筆 24 位元組），儀表板可以直接解碼串接的訊框。
+# RAM 滿了而且有設定 spill_path 時，最舊的一段會寫到 flash 檔案，之後優先送出；
+# flash 也滿了才丟掉最舊的取樣（計入 dropped）。
+# 摘要訊框（版本 2，每個 38 位元組，見 sensor_frames）用另一個 frame_size=SUMMARY_SIZE 的緩衝區存放。
+
+import os
+import struct
+
+FRAME_FORMAT = "<BBHIIqhH"  # magic、版本、旗標、裝置編號、序號、取樣時間（epoch 微秒）、溫度 ×100、濕度 ×100
+FRAME_SIZE = struct.calcsize(FRAME_FORMAT)
+FRAME_MAGIC = 0xF5
+FRAME_VERSION = 1
+NO_TEMPERATURE = -32768
+NO_HUMIDITY = 0xFFFF
+FLAG_LIGHT_KNOWN = 0x1
+FLAG_LIGHT_ON = 0x2
+# 摘要：magic、版本、旗標、裝置編號、序號、時間窗起點（epoch 微秒）、時間窗長度（毫秒）、取樣數、
+#       溫度 min / mean / max ×100、濕度 min / mean / max ×100
+SUMMARY_FORMAT = "<BBHIIqIHhhhHHH"
+SUMMARY_SIZE = struct.calcsize(SUMMARY_FORMAT)
+SUMMARY_VERSION = 2
+
+SPILL_CHUNK = 60  # 每次寫到 flash 的訊框數（減少寫入次數）
+
+
+def light_flags(light):
+    """電燈狀態轉成旗標（None = 沒有電燈狀態）"""
+    if light is None:
+        return 0
+    return FLAG_LIGHT_KNOWN | (FLAG_LIGHT_ON if light else 0)
+
+
+def _file_size(path):
+    try:
+        return os.stat(path)[6]
+    except OSError:
+        return 0
+
+
+class FrameBuffer:
+    """固定大小的訊框環形緩衝區，加上選用的 flash 溢出檔"""
+
+    def __init__(self, capacity=360, spill_path=None, spill_max_bytes=64 * 1024, frame_size=FRAME_SIZE):
+        self.capacity = capacity
+        self.spill_path = spill_path
+        self.spill_max_bytes = spill_max_bytes
+        self.frame_size = frame_size
+        self._buf = bytearray(capacity * frame_size)
+        self._head = 0          # 最舊一筆的位置
+        self._count = 0         # RAM 中的訊框數
+        self.spill_sent = 0     # flash 檔案中已送出的位元組數（deepsleep 前要另外保存）
+        self.dropped = 0        # 因空間不足而丟棄的訊框數
+        self.spilled = 0        # 寫到 flash 的訊框數
+
+    def __len__(self):
+        """尚未送出的訊框數（RAM + flash）"""
+        return self._count + self.spill_pending() // self.frame_size
+
+    def spill_pending(self):
+        if not self.spill_path:
+            return 0
+        return max(0, _file_size(self.spill_path) - self.spill_sent)
+
+    def _slot(self):
+        """下一個寫入位置；緩衝區滿了時先把最舊的一段移到 flash（或丟掉）"""
+        if self._count == self.capacity:
+            self._evict()
+        pos = (self._head + self._count) % self.capacity * self.frame_size
+        self._count += 1
+        return pos
+
+    def append(self, device_id, seq, ts_us, temperature=None, humidity=None, light=None):
+        """放入一筆取樣"""
+        struct.pack_into(
+            FRAME_FORMAT, self._buf, self._slot(), FRAME_MAGIC, FRAME_VERSION, light_flags(light), device_id, seq,
+            ts_us,
+            NO_TEMPERATURE if temperature is None else round(temperature * 100),
+            NO_HUMIDITY if humidity is None else round(humidity * 100),
+        )
+
+    def append_summary(self, device_id, seq, start_us, window_ms, count, temperature=None, humidity=None):
+        """放入一個時間窗的摘要；temperature / humidity 為 (min, mean, max)，沒有的項目傳 None"""
+        t = (NO_TEMPERATURE,) * 3 if temperature is None else [round(v * 100) for v in temperature]
+        h = (NO_HUMIDITY,) * 3 if humidity is None else [round(v * 100) for v in humidity]
+        struct.pack_into(
+            SUMMARY_FORMAT, self._buf, self._slot(), FRAME_MAGIC, SUMMARY_VERSION, 0, device_id, seq, start_us,
+            window_ms, count, t[0], t[1], t[2], h[0], h[1], h[2],
+        )
+
+    def _evict(self):
+        n = min(SPILL_CHUNK, self._count)
+        if self.spill_path and _file_size(self.spill_path) + n * self.frame_size <= self.spill_max_bytes:
+            try:
+                with open(self.spill_path, "ab") as f:
+                    f.write(self._peek(n))
+                self._drop(n)
+                self.spilled += n
+                return
+            except OSError as e:
+                print("寫入 flash 失敗:", e)
+        self._drop(1)
+        self.dropped += 1
+
+    def save(self):
+        """
+        把 RAM 中的訊框全部移到 flash（deepsleep 前呼叫，醒來後 RAM 會被清空）
+        flash 空間不足時放不下的部分計入 dropped；沒有設定 spill_path 時回傳 False
+        """
+        if not self.spill_path:
+            return False
+        room = max(0, self.spill_max_bytes - _file_size(self.spill_path)) // self.frame_size
+        n = min(self._count, room)
+        if n:
+            with open(self.spill_path, "ab") as f:
+                f.write(self._peek(n))
+            self.spilled += n
+        self.dropped += self._count - n
+        self._drop(self._count)
+        return True
+
+    def _peek(self, n):
+        """RAM 中最舊的 n 筆（處理環形的繞回）"""
+        start = self._head * self.frame_size
+        end = start + n * self.frame_size
+        size = len(self._buf)
+        if end <= size:
+            return bytes(self._buf[start:end])
+        return bytes(self._buf[start:]) + bytes(self._buf[:end - size])
+
+    def _drop(self, n):
+        self._head = (self._head + n) % self.capacity
+        self._count -= n
+
+    def next_batch(self, max_frames):
+        """
+        取得下一批要送出的訊框（flash 中較舊的優先），回傳 bytes；沒有資料時回傳 None
+        送出成功後必須呼叫 commit(batch)，失敗時資料仍留在緩衝區
+        """
+        pending = self.spill_pending()
+        if pending:
+            with open(self.spill_path, "rb") as f:
+                f.seek(self.spill_sent)
+                return f.read(min(pending, max_frames * self.frame_size))
+        if self._count:
+            return self._peek(min(self._count, max_frames))
+        return None
+
+    def commit(self, batch):
+        """確認 next_batch() 取得的資料已經送出"""
+        if self.spill_pending():
+            self.spill_sent += len(batch)
+            if not self.spill_pending():
+                # flash 中的資料都送完了，刪除檔案
+                try:
+                    os.remove(self.spill_path)
+                except OSError:
+                    pass
+                self.spill_sent = 0
+        else:
+            self._drop(len(batch) // self.frame_size)
@@ -1,35 +1,357 @@
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
 import wifi_connect as wifi
 import time
+import json
+import machine
+import ntptime
+from machine import ADC
 from umqtt.simple import MQTTClient
+from frame_buffer import FRAME_SIZE, SUMMARY_SIZE, FrameBuffer
+from connection import ConnectionManager
+from reporting import ChangeFilter, WindowStats
 
 # MQTT 設定
 MQTT_BROKER = "172.20.10.2"  # 公開測試用 Broker
 MQTT_PORT = 1883
 CLIENT_ID = "pico_w_publisher"
 TOPIC = "pico/test"
+KEEPALIVE_S = 60  # connection.py 每 30 秒送一次 PINGREQ
 
-# 嘗試連線 WiFi
-wifi.connect()
+# 延遲量測：在訊息中附上送出時間 ts（epoch 毫秒）與序號 seq，儀表板的「延遲診斷」會用到
+STAMP_PAYLOADS = True
+DEVICE_NAME = "pico01"
+DEVICE_ID = 1
+FRAME_TOPIC = "home/" + DEVICE_NAME + "/frame"
 
-# 顯示 IP
-print("IP:", wifi.get_ip())
+# 省電模式：同一份韌體依部署需求在延遲與電池壽命之間取捨
+#   always     一直保持連線，每湊滿 batch 筆、或最舊的訊框等了 max_wait_ms 就送出（延遲最低、最耗電；change / summary 模式每個訊框立刻送出）
+#   periodic   取樣放進緩衝區，每 upload_ms 才打開無線電整批上傳，送完就關閉
+#   lightsleep 同 periodic，但兩次取樣之間以 machine.lightsleep 讓 CPU 休眠（RAM 保留）
+#   deepsleep  每次醒來只取樣一次，緩衝區存在 flash，到上傳時間才連線；之後以 machine.deepsleep 休眠（醒來等於重新開機）
+# sample_ms = 取樣間隔、batch = 每則訊息串接幾個訊框、upload_ms = 上傳間隔（0 = 有完整批次就送）、
+# max_wait_ms = 不足一批時最多等多久就先送出（只用於 always；斷線後補送時仍然整批串接）
+PROFILES = {
+    "always": {"sample_ms": 1000, "batch": 10, "upload_ms": 0, "max_wait_ms": 1000},
+    "periodic": {"sample_ms": 1000, "batch": 10, "upload_ms": 60000},
+    "lightsleep": {"sample_ms": 5000, "batch": 10, "upload_ms": 300000},
+    "deepsleep": {"sample_ms": 60000, "batch": 10, "upload_ms": 600000},
+}
+PROFILE = "always"
+SAMPLE_INTERVAL_MS = PROFILES[PROFILE]["sample_ms"]
+UPLOAD_INTERVAL_MS = PROFILES[PROFILE]["upload_ms"]
+MAX_WAIT_MS = PROFILES[PROFILE].get("max_wait_ms", 0)
+# 回報方式（減少上傳量）
+#   all     每筆取樣都上傳
+#   change  溫度變化超過 DEADBAND_C 才上傳，一直沒變時每 HEARTBEAT_MS 至少上傳一筆
+#   summary 每 SUMMARY_WINDOW_MS 只上傳一筆 min / mean / max 摘要（版本 2 的摘要訊框，儀表板會存成各自的序列）
+REPORT_MODE = "all"
+DEADBAND_C = 0.5            # 內建溫度感測器的雜訊約 ±0.5°C，太小的 deadband 幾乎每筆都會送出
+HEARTBEAT_MS = 20000        # 比儀表板的離線判斷（30 秒）短
+SUMMARY_WINDOW_MS = 60000
+# change / summary 模式的訊框本來就很少（溫度變化、heartbeat 或每個時間窗一筆），一直連線時每個訊框立刻送出：
+# 湊滿一批要等好幾分鐘，儀表板早就判斷為離線（30 秒沒有數據，只送摘要的裝置為兩個時間窗）
+BATCH_FRAMES = 1 if PROFILE == "always" and REPORT_MODE != "all" else PROFILES[PROFILE]["batch"]
+MAX_BURST = 6               # always 模式一次最多連續送幾則
+CATCHUP_BATCH_FRAMES = 30   # 斷線後補送積欠的資料時，每則訊息串接的訊框數
+STATUS_INTERVAL_MS = 10000  # always 模式的狀態訊息間隔（其他模式每次上傳都送）
+CONNECT_TIMEOUT_MS = 30000  # 定期上傳時最多等多久連上，連不上就把資料留到下一次
+# 緩衝區：RAM 可放 RAM_FRAMES 筆（約 8.6 KB），斷線太久時較舊的取樣移到 flash 的 SPILL_PATH（最多 SPILL_MAX_BYTES）
+RAM_FRAMES = 360
+FLASH_SPILL = True
+SPILL_PATH = "summary.bin" if REPORT_MODE == "summary" else "spill.bin"  # 兩種訊框長度不同，分開存放
+SPILL_MAX_BYTES = 64 * 1024
+STATE_PATH = "state.json"   # deepsleep 模式跨越休眠保存的狀態（序號、時間、計數器）
+# 開機時最多等多久完成第一次 NTP 校時才開始取樣（WiFi 一直連不上時還是會開始取樣，只是時間可能不準）
+BOOT_SYNC_TIMEOUT_MS = 30000
+# MicroPython 部分版本的 time.time() 以 2000-01-01 為起點，換算成 1970 起算的 epoch
+EPOCH_OFFSET = 946684800 if time.gmtime(0)[0] == 2000 else 0
 
-# 建立 MQTT 連線
-print("正在連接 MQTT Broker...")
-client = MQTTClient(CLIENT_ID, MQTT_BROKER, port=MQTT_PORT)
-client.connect()
-print(f"已連接到 {MQTT_BROKER}")
+_base_ms = (time.time() + EPOCH_OFFSET) * 1000
+_base_tick = time.ticks_ms()
+clock_synced = asyncio.Event()
 
-# 每隔 10 秒發布一次訊息
-counter = 0
-while True:
-    counter += 1
-    message = f"Hello from Pico W! #{counter}"
-    
+
+def epoch_ms():
+    """目前時間（epoch 毫秒）：time.time() 只有秒，毫秒部分由 ticks_ms 推算"""
+    global _base_ms, _base_tick
+    now = time.ticks_ms()
+    elapsed = time.ticks_diff(now, _base_tick)
+    if elapsed > 86400000:  # 每天往前移動對齊點，避免 ticks_ms 繞回
+        _base_ms += elapsed
+        _base_tick = now
+        elapsed = 0
+    return _base_ms + elapsed
+
+
+def set_epoch_ms(ms):
+    global _base_ms, _base_tick
+    _base_ms = ms
+    _base_tick = time.ticks_ms()
+
+
+def sync_clock():
+    """
+    WiFi 連上時以 NTP 校時（訊框中的取樣時間要和接收端的時鐘一致，歷史圖表與延遲才有意義）
+    一直連線的模式只在第一次連上時校時，避免取樣時間跳動；deepsleep 模式每次上傳都校時，修正休眠累積的誤差
+    """
+    if clock_synced.is_set() and PROFILE != "deepsleep":
+        return
+    try:
+        ntptime.settime()
+        print("NTP 校時完成")
+    except Exception as e:
+        print("NTP 校時失敗，取樣時間與延遲數據會包含時鐘誤差:", e)
+        if clock_synced.is_set():
+            return
+    # 記錄某一秒剛開始時的 epoch 毫秒與 ticks_ms，之後以 ticks_ms 推算毫秒
+    start = time.time()
+    while time.time() == start:
+        pass
+    set_epoch_ms((time.time() + EPOCH_OFFSET) * 1000)
+    clock_synced.set()
+
+
+# RP2040 內建溫度感測器（ADC 第 4 通道）
+sensor_temp = ADC(4)
+
+
+def read_temperature():
+    voltage = sensor_temp.read_u16() * 3.3 / 65535
+    return 27 - (voltage - 0.706) / 0.001721
+
+
+buffer = FrameBuffer(RAM_FRAMES, SPILL_PATH if FLASH_SPILL or PROFILE == "deepsleep" else None, SPILL_MAX_BYTES,
+                     SUMMARY_SIZE if REPORT_MODE == "summary" else FRAME_SIZE)
+change = ChangeFilter(DEADBAND_C, HEARTBEAT_MS)
+window = WindowStats(SUMMARY_WINDOW_MS)
+connection = ConnectionManager(
+    wifi, lambda: MQTTClient(CLIENT_ID, MQTT_BROKER, port=MQTT_PORT, keepalive=KEEPALIVE_S),
+    on_wifi=sync_clock, keep_connected=PROFILE == "always",
+)
+seq = 0       # 訊框序號（只算上傳的訊框，儀表板以此判斷遺失）
+samples = 0   # 取樣次數
+uploads = 0   # 狀態訊息的序號
+sampled = asyncio.Event()  # 有新的取樣（always 模式湊滿一批或等太久就送出）
+pending_since = time.ticks_ms()  # 緩衝區中最舊的未送訊框大約何時放進去（always 模式的 max_wait_ms）
+_last_status = None
+
+
+def _mark_pending():
+    global pending_since
+    if not len(buffer):
+        pending_since = time.ticks_ms()
+
+
+def take_sample():
+    """取樣一次，依 REPORT_MODE 決定放進緩衝區的內容"""
+    global seq, samples
+    samples += 1
+    now = epoch_ms()
+    temperature = read_temperature()
+    if REPORT_MODE == "summary":
+        if window.due(now):
+            start, count, stats = window.take()
+            seq += 1
+            _mark_pending()
+            buffer.append_summary(DEVICE_ID, seq, start * 1000, SUMMARY_WINDOW_MS, count, stats)
+            sampled.set()
+        window.add(temperature, now)
+        return
+    if REPORT_MODE == "change" and not change.check(temperature, now):
+        return
+    seq += 1
+    _mark_pending()
+    buffer.append(DEVICE_ID, seq, now * 1000, temperature)
+    sampled.set()
+
+
+async def flush(burst=None, partial=False):
+    """
+    把緩衝區中的訊框每 BATCH_FRAMES 筆串成一則送出（burst = 最多幾則，None = 全部送完，包含最後不足一批的；
+    partial = 有 burst 時也送出最後不足一批的），
+    再送一則帶有省電計數器的狀態訊息（always 模式每 STATUS_INTERVAL_MS 最多一則）
+    qos=1 等到 Broker 確認才從緩衝區移除，送到一半斷線時資料仍在緩衝區，下次再送
+    等待確認是阻塞的：每則最多卡住 SOCKET_TIMEOUT_S（見 connection.py），每送一則就讓出事件迴圈，
+    到了取樣時間時取樣任務會先執行，不會因為整批上傳而延誤超過一則訊息的時間
+    """
+    global uploads, _last_status
+    sent = 0
+    size = BATCH_FRAMES if len(buffer) <= MAX_BURST * BATCH_FRAMES else max(BATCH_FRAMES, CATCHUP_BATCH_FRAMES)
+    while len(buffer) and (burst is None or (sent < burst and (partial or len(buffer) >= BATCH_FRAMES))):
+        batch = buffer.next_batch(size)
+        connection.publish(FRAME_TOPIC, batch, qos=1)
+        buffer.commit(batch)
+        sent += 1
+        await asyncio.sleep_ms(0)  # 每則之間讓出事件迴圈，讓到期的取樣任務先執行
+    now = time.ticks_ms()
+    if burst is not None and _last_status is not None and time.ticks_diff(now, _last_status) < STATUS_INTERVAL_MS:
+        return
+    _last_status = now
+    uploads += 1
+    message = f"Hello from Pico W! #{uploads}"
+    if STAMP_PAYLOADS:
+        stats = connection.stats()
+        payload = json.dumps({
+            "message": message, "ts": epoch_ms(), "seq": uploads, "profile": PROFILE, "report": REPORT_MODE,
+            "radio_on_ms": stats["radio_on_ms"], "messages": stats["messages"] + 1, "buffered": len(buffer),
+            "samples": samples, "frames": seq,
+        })
+    else:
+        payload = message
+    connection.publish(TOPIC, payload)
     print("-" * 30)
-    client.publish(TOPIC, message)
-    print(f"已發布訊息: {message}")
-    print(f"主題: {TOPIC}")
-    
-    print("等待 10 秒後再次發布...")
-    time.sleep(10)
\ No newline at end of file
+    print(f"已發布 {sent} 批訊框 → {FRAME_TOPIC}，緩衝區剩 {len(buffer)} 筆（flash 暫存 {buffer.spilled}、丟棄 {buffer.dropped}）")
+    print(f"已發布訊息: {payload}")
+    print(f"連線狀態: {connection.stats()}")
+
+
+async def upload_cycle():
+    """打開無線電、連線、把緩衝區全部送出後關閉無線電；連不上或送到一半斷線時資料留到下一次"""
+    connection.want(True)
+    try:
+        await asyncio.wait_for(connection.up.wait(), CONNECT_TIMEOUT_MS / 1000)
+        await flush()
+    except asyncio.TimeoutError:
+        print("連線逾時，資料留到下一次上傳")
+    except Exception as e:
+        print("上傳失敗，資料保留在緩衝區:", e)
+    connection.want(False)
+
+
+async def sampler():
+    """依 ticks_ms 排程取樣放進緩衝區；不管有沒有連線都照常執行"""
+    try:
+        await asyncio.wait_for(clock_synced.wait(), BOOT_SYNC_TIMEOUT_MS / 1000)
+    except asyncio.TimeoutError:
+        print("尚未校時，先開始取樣")
+    next_sample = time.ticks_ms()
+    while True:
+        take_sample()
+        next_sample = time.ticks_add(next_sample, SAMPLE_INTERVAL_MS)
+        await asyncio.sleep_ms(max(0, time.ticks_diff(next_sample, time.ticks_ms())))
+
+
+async def uploader():
+    """always：連線時一有完整批次、或最舊的訊框等了 MAX_WAIT_MS 就送；periodic：每 UPLOAD_INTERVAL_MS 上傳一次"""
+    if PROFILE != "always":
+        # 先連線一次完成校時，之後只在上傳時打開無線電
+        await upload_cycle()
+        while True:
+            await asyncio.sleep_ms(UPLOAD_INTERVAL_MS)
+            await upload_cycle()
+    global pending_since
+    while True:
+        await connection.up.wait()
+        partial = False
+        if not len(buffer):
+            sampled.clear()
+            await sampled.wait()
+            continue
+        if len(buffer) < BATCH_FRAMES:
+            wait_ms = MAX_WAIT_MS - time.ticks_diff(time.ticks_ms(), pending_since)
+            if wait_ms > 0:
+                # 不足一批：等下一筆取樣，或等到最舊的訊框到期
+                sampled.clear()
+                try:
+                    await asyncio.wait_for(sampled.wait(), wait_ms / 1000)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            partial = True
+        try:
+            await flush(MAX_BURST, partial)
+        except Exception as e:
+            # Broker 或 WiFi 斷線：資料留在緩衝區，connection 會在背景重新連線
+            print("發布失敗，資料保留在緩衝區:", e)
+        if len(buffer):
+            pending_since = time.ticks_ms()
+
+
+async def main():
+    asyncio.create_task(connection.run())
+    asyncio.create_task(sampler())
+    await uploader()
+
+
+async def upload_once():
+    """休眠模式：暫時啟動連線任務，上傳一次後結束"""
+    task = asyncio.create_task(connection.run())
+    await upload_cycle()
+    task.cancel()
+
+
+def run_upload():
+    asyncio.new_event_loop()  # 清掉上一次留下的任務
+    asyncio.run(upload_once())
+
+
+def load_state():
+    try:
+        with open(STATE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_state(next_ms, last_upload_ms):
+    state = {
+        "seq": seq, "samples": samples, "uploads": uploads, "next_ms": next_ms, "last_upload_ms": last_upload_ms,
+        "change": change.snapshot(), "window": window.snapshot(),
+        "spill_sent": buffer.spill_sent, "messages": connection.messages, "radio_on_ms": connection.radio_time_ms(),
+    }
+    with open(STATE_PATH, "w") as f:
+        json.dump(state, f)
+
+
+def run_lightsleep():
+    """lightsleep：取樣與上傳之間讓 CPU 休眠，只有上傳時打開無線電"""
+    run_upload()  # 開機先連線一次完成校時
+    last_upload = time.ticks_ms()
+    next_sample = time.ticks_ms()
+    while True:
+        take_sample()
+        if time.ticks_diff(time.ticks_ms(), last_upload) >= UPLOAD_INTERVAL_MS:
+            run_upload()
+            last_upload = time.ticks_ms()
+        next_sample = time.ticks_add(next_sample, SAMPLE_INTERVAL_MS)
+        machine.lightsleep(max(1, time.ticks_diff(next_sample, time.ticks_ms())))
+
+
+def run_deepsleep():
+    """
+    deepsleep：每次醒來（等於重新開機）取樣一次，到上傳時間才連線，然後再次休眠
+    RAM 在休眠時會清空，緩衝區與序號、時間、計數器都保存在 flash
+    """
+    global seq, samples, uploads
+    state = load_state()
+    if state is None:
+        run_upload()  # 第一次開機：先連線校時
+        last_upload_ms = epoch_ms()
+    else:
+        # 醒來時的時間以休眠前預定的時間推算，上傳時再以 NTP 校正
+        seq, samples, uploads = state["seq"], state["samples"], state["uploads"]
+        change.restore(state["change"])
+        window.restore(state["window"])
+        buffer.spill_sent = state["spill_sent"]
+        connection.messages, connection.radio_on_ms = state["messages"], state["radio_on_ms"]
+        set_epoch_ms(state["next_ms"])
+        last_upload_ms = state["last_upload_ms"]
+    take_sample()
+    if epoch_ms() - last_upload_ms >= UPLOAD_INTERVAL_MS:
+        run_upload()
+        last_upload_ms = epoch_ms()
+    buffer.save()
+    save_state(epoch_ms() + SAMPLE_INTERVAL_MS, last_upload_ms)
+    machine.deepsleep(SAMPLE_INTERVAL_MS)
+
+
+print("省電模式:", PROFILE)
+if PROFILE == "lightsleep":
+    run_lightsleep()
+elif PROFILE == "deepsleep":
+    run_deepsleep()
+else:
+    asyncio.run(main())
@@ -0,0 +1,73 @@
+# reporting.py
+# 適用：Raspberry Pi Pico W（MicroPython），也可以在一般 Python 上測試
+#
+# 在裝置端減少上傳的資料量，讓 Broker 與儀表板的負載跟著環境變化而不是取樣頻率成長：
+# - ChangeFilter：數值變化超過 deadband 才回報，一直沒變時每 heartbeat_ms 至少回報一次（讓儀表板知道裝置還活著）
+# - WindowStats：固定時間窗內只累計 min / mean / max 與取樣數，時間窗結束才產生一筆摘要
+# 時間都使用 epoch 毫秒（不是 ticks_ms），狀態才能跨越 deepsleep 保存（snapshot / restore）。
+
+
+class ChangeFilter:
+    """report-on-change：和上一次回報的值比較"""
+
+    def __init__(self, deadband, heartbeat_ms):
+        self.deadband = deadband
+        self.heartbeat_ms = heartbeat_ms
+        self.last_value = None
+        self.last_ms = None
+        self.suppressed = 0  # 沒有回報的取樣數
+
+    def check(self, value, now_ms):
+        """這筆取樣是否要回報（要回報時記為新的比較基準）"""
+        if (self.last_value is None or abs(value - self.last_value) >= self.deadband
+                or now_ms - self.last_ms >= self.heartbeat_ms):
+            self.last_value = value
+            self.last_ms = now_ms
+            return True
+        self.suppressed += 1
+        return False
+
+    def snapshot(self):
+        return [self.last_value, self.last_ms, self.suppressed]
+
+    def restore(self, state):
+        self.last_value, self.last_ms, self.suppressed = state
+
+
+class WindowStats:
+    """固定時間窗的 min / mean / max（只存累計值，不存每筆取樣）"""
+
+    def __init__(self, window_ms):
+        self.window_ms = window_ms
+        self.reset()
+
+    def reset(self):
+        self.start_ms = None
+        self.count = 0
+        self.total = 0.0
+        self.low = None
+        self.high = None
+
+    def add(self, value, now_ms):
+        if self.start_ms is None:
+            self.start_ms = now_ms
+        self.count += 1
+        self.total += value
+        self.low = value if self.low is None else min(self.low, value)
+        self.high = value if self.high is None else max(self.high, value)
+
+    def due(self, now_ms):
+        """時間窗是否已經結束（在加入新的取樣前檢查，結束時先 take() 再 add()）"""
+        return self.start_ms is not None and now_ms - self.start_ms >= self.window_ms
+
+    def take(self):
+        """取出摘要並開始新的時間窗：回傳 (起點 epoch 毫秒, 取樣數, (min, mean, max))"""
+        summary = (self.start_ms, self.count, (self.low, self.total / self.count, self.high))
+        self.reset()
+        return summary
+
+    def snapshot(self):
+        return [self.start_ms, self.count, self.total, self.low, self.high]
+
+    def restore(self, state):
+        self.start_ms, self.count, self.total, self.low, self.high = state
@@ -45,6 +45,20 @@ def connect(ssid=WIFI_SSID, password=WIFI_PASSWORD, retry=20):
 
     raise RuntimeError("❌ WiFi 連線失敗，請檢查 SSID/密碼或距離")
 
+# -------------------------------
+# 開始連線但不等待（給 asyncio 的 connection.py 使用）
+# -------------------------------
+def begin(ssid=WIFI_SSID, password=WIFI_PASSWORD):
+    """
+    啟動 WLAN 並送出連線要求後立刻返回，
+    之後以 is_connected() 查詢是否連上
+    """
+    wlan = network.WLAN(network.STA_IF)
+    wlan.active(True)
+    if not wlan.isconnected():
+        wlan.connect(ssid, password)
+    return wlan
+
 # -------------------------------
 # 斷線函式
 # -------------------------------
@@ -57,6 +71,15 @@ def disconnect():
     else:
         print("目前沒有 WiFi 連線")
 
+# -------------------------------
+# 關閉無線電（省電；連線中也會先斷線）
+# -------------------------------
+def off():
+    wlan = network.WLAN(network.STA_IF)
+    if wlan.isconnected():
+        wlan.disconnect()
+    wlan.active(False)
+
 # -------------------------------
 # 是否連線成功？
 # -------------------------------
@@ -1,3 +1,19 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import Device, Reading
+
+
+@admin.register(Device)
+class DeviceAdmin(admin.ModelAdmin):
+    list_display = ("name", "device_id", "created_at")
+    search_fields = ("name",)
+
+
+@admin.register(Reading)
+class ReadingAdmin(admin.ModelAdmin):
+    list_display = ("device", "timestamp", "temperature", "humidity", "light", "seq")
+    list_filter = ("device",)
+    list_select_related = ("device",)
+    # 讀數表很大：不計算總筆數，依主鍵由新到舊排序（不需要額外的索引）
+    show_full_result_count = False
+    ordering = ("-id",)
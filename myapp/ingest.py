@@ -0,0 +1,346 @@
+"""
+感測讀數的批次寫入
+
+MQTT 訊息（mqtt_ingest 指令）與 HTTP 批次（/api/ingest）先轉成欄式的 NumPy 陣列，再一次建立所有
+Reading 物件，在同一個交易中以 bulk_create 寫入：每批只有一次 commit，而不是每筆讀數一次。
+
+支援的主題（與 lesson6 儀表板的車隊主題相同）：
+    home/<裝置>/temperature   {"value": 25.3, "ts": ..., "seq": ...} 或純數字
+    home/<裝置>/humidity      同上
+    home/<裝置>/light         {"status": "on"} 或純文字 on / off
+    home/<裝置>/frame         二進位訊框（可串接多筆）、摘要訊框或 JSON，見 sensor_frames
+JSON 的 ts（epoch 毫秒）與訊框的時間是取樣時間，沒有時以收到的時間代替。
+"""
+import json
+import time
+
+import numpy as np
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+# 訊框的格式與編解碼只有一份：專案根目錄的 sensor_frames 套件，和 lesson6 儀表板共用
+from sensor_frames import (FRAME_MAGIC, FRAME_SIZE, FRAME_VERSION, SUMMARY_SIZE, SUMMARY_VERSION, decode_frames,
+                           decode_summaries, is_frame, is_summary)
+
+from .models import Device, Reading
+
+DEFAULT_TOPICS = ["home/+/temperature", "home/+/humidity", "home/+/light", "home/+/frame"]
+BULK_BATCH_SIZE = 2000  # bulk_create 每條 INSERT 的筆數（SQLite 變數數量有上限）
+
+# HTTP 批次的檢查範圍
+MIN_TIMESTAMP_MS = 1_577_836_800_000  # 2020-01-01：更早的時間代表裝置還沒校時
+MAX_CLOCK_SKEW_MS = 24 * 3600 * 1000  # 比伺服器時間晚超過一天視為時間錯誤
+TEMPERATURE_RANGE = (-40.0, 125.0)    # 感測器的量測範圍
+HUMIDITY_RANGE = (0.0, 100.0)
+
+DEVICE_NAME_MAX_LENGTH = Device._meta.get_field("name").max_length
+
+_device_pks = {}  # {裝置名稱: 主鍵}，整個程序共用，避免每批都查詢 Device
+_device_numbers = set()  # 已經記錄過裝置編號的裝置名稱
+
+
+def valid_device_name(name):
+    """裝置名稱不可為空、不超過 Device.name 的長度，也不能包含 MQTT 主題的分隔字元與萬用字元"""
+    return 0 < len(name) <= DEVICE_NAME_MAX_LENGTH and not any(c in name for c in "/+#")
+
+
+def _empty_columns():
+    return {
+        "device": [],
+        "timestamp": np.empty(0, dtype=np.int64),
+        "temperature": np.empty(0),
+        "humidity": np.empty(0),
+        "light": np.empty(0),
+        "seq": np.empty(0, dtype=np.int64),
+    }
+
+
+def _value_and_stamp(payload):
+    """{"value": x, "ts": ..., "seq": ...} 或純數字 -> (數值, ts, seq)，缺少的欄位為 NaN / -1"""
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        return np.nan, np.nan, -1
+    if not isinstance(data, dict):
+        data = {"value": data}
+    values = []
+    for name, missing in (("value", np.nan), ("ts", np.nan)):
+        try:
+            values.append(float(data[name]))
+        except (KeyError, TypeError, ValueError):
+            values.append(missing)
+    try:
+        seq = int(data["seq"])
+    except (KeyError, TypeError, ValueError):
+        seq = -1
+    return values[0], values[1], seq
+
+
+def _light(payload):
+    """電燈狀態 -> 1.0 / 0.0，無法判斷時為 NaN"""
+    text = payload.decode("utf-8", errors="replace")
+    try:
+        data = json.loads(text) if text.startswith("{") else {"status": text}
+        status = str(data.get("status", text)).lower()
+    except ValueError:
+        status = text.lower()
+    if status in ("on", "開", "1", "true"):
+        return 1.0
+    if status in ("off", "關", "0", "false"):
+        return 0.0
+    return np.nan
+
+
+def _frame_rows(payloads, received):
+    """二進位訊框與摘要訊框 -> 欄位陣列（不含裝置名稱），number = 每列的裝置編號"""
+    frames = decode_frames(payloads)
+    sent_ms = frames["sent_ns"] / 1e6
+    summaries = decode_summaries(payloads)
+    return {
+        "timestamp": np.concatenate([
+            np.where(np.isnan(sent_ms), received[frames["message"]], np.rint(np.nan_to_num(sent_ms))).astype(np.int64),
+            summaries["start_ns"] // 1_000_000,
+        ]),
+        "temperature": np.concatenate([frames["temperature"], summaries["temperature_mean"]]),
+        "humidity": np.concatenate([frames["humidity"], summaries["humidity_mean"]]),
+        "light": np.concatenate([frames["light"], np.full(len(summaries["seq"]), np.nan)]),
+        "seq": np.concatenate([frames["seq"], summaries["seq"]]),
+        "number": np.concatenate([frames["device"], summaries["device"]]),
+    }
+
+
+def select_rows(columns, keep):
+    """依布林遮罩保留部分列（device 是 Python 清單，其他欄位是陣列）"""
+    return {name: (np.asarray(values, dtype=object)[keep].tolist() if name == "device" else values[keep])
+            for name, values in columns.items()}
+
+
+def messages_to_columns(messages):
+    """
+    把一批 MQTT 訊息 [(主題, payload, 收到的 epoch 毫秒), ...] 轉成欄式資料
+    回傳 ({欄位: 陣列}, {裝置名稱: 裝置編號})，每筆讀數一列；裝置編號來自二進位訊框
+    """
+    groups = {}
+    for topic, payload, received in messages:
+        parts = topic.split("/")
+        if len(parts) != 3 or parts[0] != "home" or not valid_device_name(parts[1]):
+            continue
+        groups.setdefault((parts[1], parts[2]), []).append((payload, received))
+
+    parts = []
+    numbers = {}
+    for (device, metric), items in groups.items():
+        payloads = [payload for payload, _ in items]
+        received = np.array([received for _, received in items], dtype=np.int64)
+        if metric == "frame":
+            row = _frame_rows(payloads, received)
+            row["device"] = device
+            known = row.pop("number")
+            parts.append(row)
+            known = known[known >= 0]
+            if len(known):
+                numbers[device] = int(known[-1])
+            continue
+        n = len(items)
+        row = {"device": device, "timestamp": received, "seq": np.full(n, -1, dtype=np.int64)}
+        for name in ("temperature", "humidity", "light"):
+            row[name] = np.full(n, np.nan)
+        if metric == "light":
+            row["light"] = np.array([_light(payload) for payload in payloads])
+        elif metric in ("temperature", "humidity"):
+            decoded = np.array([_value_and_stamp(payload) for payload in payloads]).reshape(n, 3)
+            row[metric] = decoded[:, 0]
+            stamped = ~np.isnan(decoded[:, 1])
+            row["timestamp"] = np.where(stamped, np.rint(np.nan_to_num(decoded[:, 1])), received).astype(np.int64)
+            row["seq"] = decoded[:, 2].astype(np.int64)
+        else:
+            continue
+        parts.append(row)
+
+    if not parts:
+        return _empty_columns(), numbers
+    columns = {name: np.concatenate([part[name] for part in parts]) for name in ("timestamp", "temperature",
+                                                                                 "humidity", "light", "seq")}
+    columns["device"] = [part["device"] for part in parts for _ in range(len(part["timestamp"]))]
+    # 完全沒有數值的列（無法解析的訊息）不寫入
+    keep = ~(np.isnan(columns["temperature"]) & np.isnan(columns["humidity"]) & np.isnan(columns["light"]))
+    if not keep.all():
+        columns = select_rows(columns, keep)
+    return columns, numbers
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _light_value(value):
+    if value is None:
+        return np.nan
+    if isinstance(value, str):
+        return _light(value.encode())
+    return float(bool(value))
+
+
+def ndjson_to_columns(body, device=None, received_ms=None):
+    """
+    HTTP 批次：每行一個 JSON 物件
+        {"device": "pico01", "ts": 1730000000000, "temperature": 25.3, "humidity": 61.2, "light": "on", "seq": 42}
+    device 沒有時使用參數 device；ts（epoch 毫秒）沒有時以收到的時間代替
+    回傳 (欄位, {}, 每列的行號, [(行號, 錯誤)])，行號從 0 開始；無法解析的行直接列入錯誤，
+    整個內容不是 UTF-8 文字（例如誤傳了二進位訊框）時丟出 ValueError
+    """
+    received_ms = int(time.time() * 1000) if received_ms is None else received_ms
+    try:
+        text = body.decode("utf-8") if isinstance(body, bytes) else body
+    except UnicodeDecodeError:
+        raise ValueError("內容不是 UTF-8 文字") from None
+    records, rows, errors = [], [], []
+    for i, line in enumerate(text.splitlines()):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError:
+            errors.append((i, "JSON 格式錯誤"))
+            continue
+        if not isinstance(data, dict):
+            errors.append((i, "每行必須是 JSON 物件"))
+            continue
+        records.append(data)
+        rows.append(i)
+    stamps = np.array([_number(data.get("ts")) for data in records], dtype=float)
+    seqs = np.array([_number(data.get("seq")) for data in records], dtype=float)
+    columns = {
+        "device": [str(data.get("device") or device or "") for data in records],
+        "timestamp": np.where(np.isnan(stamps), received_ms, np.rint(np.nan_to_num(stamps))).astype(np.int64),
+        "temperature": np.array([_number(data.get("temperature")) for data in records], dtype=float),
+        "humidity": np.array([_number(data.get("humidity")) for data in records], dtype=float),
+        "light": np.array([_light_value(data.get("light")) for data in records], dtype=float),
+        "seq": np.where(np.isnan(seqs), -1, np.nan_to_num(seqs)).astype(np.int64),
+    }
+    return columns, {}, np.array(rows, dtype=np.int64), errors
+
+
+def binary_to_columns(body, device=None, received_ms=None):
+    """
+    HTTP 批次：串接的二進位訊框或摘要訊框（格式見 sensor_frames）
+    訊框只有裝置編號：有 device 參數時全部算在該裝置，否則依 Device.device_id 對應，
+    還沒有的裝置以「device-<編號>」建立
+    回傳 (欄位, {裝置名稱: 裝置編號}, 每列的訊框序號, [(訊框序號, 錯誤)])；長度或格式不對時丟出 ValueError
+    """
+    if is_frame(body):
+        size, version = FRAME_SIZE, FRAME_VERSION
+    elif is_summary(body):
+        size, version = SUMMARY_SIZE, SUMMARY_VERSION
+    else:
+        raise ValueError(f"內容不是完整的訊框（每個訊框 {FRAME_SIZE} 或 {SUMMARY_SIZE} bytes）")
+    received_ms = int(time.time() * 1000) if received_ms is None else received_ms
+    # 先依每個訊框開頭的 magic 與版本篩選，錯誤可以回報到是第幾個訊框
+    raw = np.frombuffer(body, dtype=np.uint8).reshape(-1, size)
+    valid = (raw[:, 0] == FRAME_MAGIC) & (raw[:, 1] == version)
+    rows = np.flatnonzero(valid)
+    errors = [(int(row), "訊框 magic 或版本不正確") for row in np.flatnonzero(~valid)]
+    columns = _frame_rows([raw[valid].tobytes()], np.array([received_ms], dtype=np.int64))
+    ids = columns.pop("number")
+    if device:
+        columns["device"] = [device] * len(ids)
+        return columns, ({device: int(ids[0])} if len(ids) else {}), rows, errors
+    known = dict(Device.objects.filter(device_id__in=np.unique(ids).tolist()).values_list("device_id", "name"))
+    names = {number: known.get(number, f"device-{number}") for number in np.unique(ids).tolist()}
+    columns["device"] = [names[number] for number in ids.tolist()]
+    return columns, {name: number for number, name in names.items()}, rows, errors
+
+
+def validate_readings(columns, received_ms=None):
+    """
+    向量化檢查每列讀數：回傳 (保留的遮罩, [(列, 錯誤)])
+    每個規則對整個欄位一次比較，不逐筆判斷；一列違反多個規則時只回報第一個
+    """
+    received_ms = int(time.time() * 1000) if received_ms is None else received_ms
+    temperature, humidity = columns["temperature"], columns["humidity"]
+    timestamp = columns["timestamp"]
+    with np.errstate(invalid="ignore"):
+        rules = [
+            ("缺少裝置名稱", np.array([not name for name in columns["device"]], dtype=bool)),
+            ("裝置名稱不正確", np.array([not valid_device_name(name) for name in columns["device"]], dtype=bool)),
+            ("沒有任何數值", np.isnan(temperature) & np.isnan(humidity) & np.isnan(columns["light"])),
+            ("時間超出範圍（裝置還沒校時？）",
+             (timestamp < MIN_TIMESTAMP_MS) | (timestamp > received_ms + MAX_CLOCK_SKEW_MS)),
+            ("溫度超出範圍", (temperature < TEMPERATURE_RANGE[0]) | (temperature > TEMPERATURE_RANGE[1])),
+            ("濕度超出範圍", (humidity < HUMIDITY_RANGE[0]) | (humidity > HUMIDITY_RANGE[1])),
+        ]
+    bad = np.zeros(len(timestamp), dtype=bool)
+    errors = []
+    for message, failed in rules:
+        failed = failed & ~bad
+        errors.extend((int(row), message) for row in np.flatnonzero(failed))
+        bad |= failed
+    return ~bad, sorted(errors)
+
+
+def device_pks(names, numbers=None):
+    """{裝置名稱: 主鍵}；還沒有的裝置一次建立（numbers = {名稱: 裝置編號}，有的話一併記錄）"""
+    numbers = numbers or {}
+    missing = [name for name in set(names) if name not in _device_pks]
+    if missing:
+        Device.objects.bulk_create([Device(name=name) for name in missing], ignore_conflicts=True)
+        _device_pks.update(Device.objects.filter(name__in=missing).values_list("name", "pk"))
+    for name, number in numbers.items():
+        if name in _device_numbers or name not in _device_pks:
+            continue
+        # 裝置編號只在第一次看到時記錄（已經有編號的裝置、或編號已被其他裝置使用時不覆蓋）
+        if not Device.objects.filter(device_id=number).exists():
+            Device.objects.filter(pk=_device_pks[name], device_id__isnull=True).update(device_id=number)
+        _device_numbers.add(name)
+    return {name: _device_pks[name] for name in names}
+
+
+def _nullable(values):
+    """NaN -> None 的 Python 清單（向量化，不逐筆判斷）"""
+    column = values.astype(object)
+    column[np.isnan(values)] = None
+    return column.tolist()
+
+
+def save_readings(columns, numbers=None):
+    """把欄式資料在一個交易中以 bulk_create 寫入，回傳寫入的筆數"""
+    n = len(columns["timestamp"])
+    if n == 0:
+        return 0
+    try:
+        _bulk_insert(columns, numbers)
+    except IntegrityError:
+        # 快取中的裝置可能已經在管理介面被刪除：清掉快取重新建立後再試一次
+        _device_pks.clear()
+        _device_numbers.clear()
+        _bulk_insert(columns, numbers)
+    return n
+
+
+def _bulk_insert(columns, numbers):
+    with transaction.atomic():
+        pks = device_pks(set(columns["device"]), numbers)
+        light = columns["light"]
+        lights = np.where(np.isnan(light), None, light > 0).tolist()
+        seqs = columns["seq"].astype(object)
+        seqs[columns["seq"] < 0] = None
+        readings = [
+            Reading(device_id=pks[device], timestamp=timestamp, temperature=temperature, humidity=humidity,
+                    light=on, seq=seq)
+            for device, timestamp, temperature, humidity, on, seq in zip(
+                columns["device"], columns["timestamp"].tolist(), _nullable(columns["temperature"]),
+                _nullable(columns["humidity"]), lights, seqs.tolist(),
+            )
+        ]
+        Reading.objects.bulk_create(readings, batch_size=BULK_BATCH_SIZE)
+        # 每批每台裝置只更新一次，查詢 API 以此判斷資料是否有變動
+        Device.objects.filter(pk__in=set(pks.values())).update(updated_at=timezone.now())
+
+
+def save_messages(messages):
+    """一批 MQTT 訊息直接寫入，回傳寫入的讀數筆數"""
+    columns, numbers = messages_to_columns(messages)
+    return save_readings(columns, numbers)
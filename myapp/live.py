@@ -0,0 +1,283 @@
+"""
+即時讀數的 Server-Sent Events 推播
+
+整個程序只有一條 MQTT 訂閱（LiveHub），由 asyncio 事件迴圈直接驅動：訊息解碼成讀數事件
+（與 ingest.py 相同的解碼）後，分送到每個客戶端自己的 asyncio.Queue。
+閒置的客戶端只是一個等待中的協程，不佔用線程，數千條連線也只有一條 MQTT 連線。
+
+每個事件有遞增的 id，最近 RESUME_BUFFER 個事件保留在記憶體中：
+斷線重連時瀏覽器的 EventSource 會自動帶上 Last-Event-ID，從中斷處補送。
+id 從啟動時的 epoch 微秒開始遞增，伺服器重啟後舊的 id 仍然比新的小。
+
+    GET /api/live?topic=home/+/temperature&topic=...   topic 為 MQTT 主題篩選，可重複指定（預設全部感測主題）
+    從中斷處繼續：Last-Event-ID 標頭（EventSource 重連時自動帶上）或 ?since=<事件 id>
+
+這個端點不經過 Django 的 view（見 django_project/asgi.py）：Django 的 ASGI handler 會為每個請求
+保留一個執行同步程式碼的線程直到回應結束，長時間連線的 SSE 就等於每個客戶端一個線程。
+因此必須以 ASGI 伺服器（uvicorn）執行，manage.py runserver 不提供這個端點。
+"""
+import asyncio
+import collections
+import json
+import threading
+import time
+from urllib.parse import parse_qs
+
+import numpy as np
+import paho.mqtt.client as mqtt
+from django.conf import settings
+
+from .ingest import DEFAULT_TOPICS, messages_to_columns
+
+RESUME_BUFFER = 10_000   # 保留幾個事件供重連補送
+CLIENT_QUEUE = 1000      # 每個客戶端最多累積幾個未送出的事件，超過時中斷連線讓客戶端重連補送
+KEEPALIVE_S = 15.0       # 沒有事件時多久送一次註解行，避免代理伺服器關閉閒置連線
+RECONNECT_MIN_S = 1.0    # MQTT 斷線重連的等待時間（每次失敗加倍）
+RECONNECT_MAX_S = 30.0
+
+
+def reading_events(topic, payload, received_ms):
+    """一則 MQTT 訊息 -> 讀數事件清單（二進位訊框可能包含多筆讀數）"""
+    columns, _ = messages_to_columns([(topic, payload, received_ms)])
+    events = []
+    for i in range(len(columns["timestamp"])):
+        event = {"topic": topic, "device": columns["device"][i], "timestamp": int(columns["timestamp"][i])}
+        for name in ("temperature", "humidity", "light"):
+            value = columns[name][i]
+            if not np.isnan(value):
+                event[name] = bool(value) if name == "light" else float(value)
+        if columns["seq"][i] >= 0:
+            event["seq"] = int(columns["seq"][i])
+        events.append(event)
+    return events
+
+
+class Subscriber:
+    """一個 SSE 客戶端：主題篩選與待送出的事件"""
+
+    def __init__(self, topics):
+        self.topics = topics
+        self.queue = asyncio.Queue(maxsize=CLIENT_QUEUE)
+        self.overflowed = False
+        self._matches = {}  # {主題: 是否符合}，主題數量只有「裝置 × 量測項目」個
+
+    def wants(self, topic):
+        if topic not in self._matches:
+            self._matches[topic] = any(mqtt.topic_matches_sub(sub, topic) for sub in self.topics)
+        return self._matches[topic]
+
+
+class LiveHub:
+    """共用的 MQTT 訂閱與事件分送（全部在事件迴圈中執行）"""
+
+    def __init__(self, broker, port, topics):
+        self.broker = broker
+        self.port = port
+        self.topics = topics
+        self.loop = None
+        self.client = None
+        self.subscribers = set()
+        self.recent = collections.deque(maxlen=RESUME_BUFFER)  # [(id, 主題, SSE 文字)]
+        self._next_id = time.time_ns() // 1000
+        self._pending = []
+        self._task = None
+        self._loop_thread = None
+
+    def start(self, loop):
+        """第一個客戶端連線時才連接 MQTT（在事件迴圈中呼叫）"""
+        if self.client is not None:
+            return
+        self.loop = loop
+        self._loop_thread = threading.get_ident()
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        client.on_connect = self._on_connect
+        client.on_message = self._on_message
+        # 不用 loop_start()：paho 的線程以 select() 等待，檔案描述符超過 1024（上千條 SSE 連線）就會失效；
+        # 改由事件迴圈（Linux 上是 epoll）在 socket 可讀寫時呼叫 paho
+        client.on_socket_open = lambda client, userdata, sock: self._on_loop(loop.add_reader, sock, client.loop_read)
+        client.on_socket_close = lambda client, userdata, sock: self._on_loop(loop.remove_reader, sock)
+        client.on_socket_register_write = lambda client, userdata, sock: self._on_loop(
+            loop.add_writer, sock, client.loop_write)
+        client.on_socket_unregister_write = lambda client, userdata, sock: self._on_loop(loop.remove_writer, sock)
+        client.connect_async(self.broker, self.port, 60)
+        self.client = client
+        self._task = loop.create_task(self._keep_connected())
+
+    def _on_loop(self, register, sock, *args):
+        """
+        paho 的 socket 回呼：在事件迴圈的線程中直接註冊；
+        在執行緒池中（reconnect()）則交回事件迴圈執行，到時 socket 已經關閉就略過
+        """
+        if threading.get_ident() == self._loop_thread:
+            register(sock, *args)
+            return
+
+        def call():
+            if sock.fileno() != -1:
+                register(sock, *args)
+        self.loop.call_soon_threadsafe(call)
+
+    async def _keep_connected(self):
+        """連線、斷線後重連，並定期呼叫 loop_misc()（送出 PING、檢查逾時）"""
+        delay = RECONNECT_MIN_S
+        while True:
+            if self.client.socket() is None:
+                try:
+                    # reconnect() 是阻塞的（DNS 查詢、TCP 連線最多等 connect_timeout 秒），放到執行緒池，
+                    # 等待期間事件迴圈照常服務其他 SSE 客戶端
+                    await self.loop.run_in_executor(None, self.client.reconnect)
+                    delay = RECONNECT_MIN_S
+                except OSError as e:
+                    print(f"即時推播連接 MQTT 失敗: {e}，{delay:.0f} 秒後重試")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, RECONNECT_MAX_S)
+                    continue
+            self.client.loop_misc()
+            await asyncio.sleep(1)
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code == 0:
+            client.subscribe([(topic, 0) for topic in self.topics])
+        else:
+            print(f"即時推播連接 MQTT 失敗，錯誤代碼: {reason_code}")
+
+    def _on_message(self, client, userdata, msg):
+        # 解碼、編號並轉成 SSE 文字（每個事件只序列化一次，所有客戶端共用）後放進待分送清單；
+        # 同一輪事件迴圈收到的訊息一起分送
+        events = reading_events(msg.topic, msg.payload, time.time_ns() // 1_000_000)
+        if not events:
+            return
+        if not self._pending:
+            self.loop.call_soon(self._dispatch)
+        for event in events:
+            self._pending.append((self._next_id, msg.topic, _sse(self._next_id, "reading", event)))
+            self._next_id += 1
+
+    def _dispatch(self):
+        batch, self._pending = self._pending, []
+        self.recent.extend(batch)
+        for subscriber in self.subscribers:
+            if subscriber.overflowed:
+                continue
+            for item in batch:
+                if not subscriber.wants(item[1]):
+                    continue
+                try:
+                    subscriber.queue.put_nowait(item)
+                except asyncio.QueueFull:
+                    # 客戶端太慢：不再排入，送出已排入的事件後中斷，重連時由 Last-Event-ID 補送
+                    subscriber.overflowed = True
+                    break
+
+    def subscribe(self, topics, since=None):
+        """
+        新增客戶端；since 為上次收到的事件 id，有的話先把記憶體中之後的事件排入
+        回傳 (Subscriber, 是否有遺漏)：since 早於保留的最舊事件時代表中間的事件已經無法補送
+        """
+        subscriber = Subscriber(topics)
+        missed = False
+        if since is not None:
+            oldest = self.recent[0][0] if self.recent else (
+                self._pending[0][0] if self._pending else self._next_id)
+            missed = since < oldest - 1
+            for item in self.recent:
+                if item[0] > since and subscriber.wants(item[1]):
+                    if subscriber.queue.full():
+                        # 補送的事件超過 CLIENT_QUEUE：和太慢的客戶端一樣，送完已排入的事件後中斷，
+                        # 客戶端以最後收到的 id 重連，從這裡繼續補送
+                        subscriber.overflowed = True
+                        break
+                    subscriber.queue.put_nowait(item)
+        self.subscribers.add(subscriber)
+        return subscriber, missed
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+
+_hub = None
+
+
+def get_hub():
+    global _hub
+    if _hub is None:
+        _hub = LiveHub(settings.MQTT_BROKER, settings.MQTT_PORT, DEFAULT_TOPICS)
+    _hub.start(asyncio.get_running_loop())
+    return _hub
+
+
+def _sse(event_id, name, data):
+    return f"id: {event_id}\nevent: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def event_stream(topics, since=None):
+    """SSE 文字串流；客戶端斷線時 live_app 會取消這個產生器"""
+    hub = get_hub()
+    subscriber, missed = hub.subscribe(topics, since)
+    try:
+        yield "retry: 3000\n\n"
+        if missed:
+            # 要補送的事件已經不在記憶體中：請客戶端改用 /api/devices/<id>/series 補齊歷史資料
+            yield f"event: reset\ndata: {json.dumps({'since': since})}\n\n"
+        while True:
+            try:
+                item = await asyncio.wait_for(subscriber.queue.get(), KEEPALIVE_S)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            # 已經排隊的事件合併成一次送出，突發大量訊息時不必每個事件各寫一次 socket
+            chunks = [item[2]]
+            while not subscriber.queue.empty():
+                chunks.append(subscriber.queue.get_nowait()[2])
+            yield "".join(chunks)
+            if subscriber.overflowed:
+                return
+    finally:
+        hub.unsubscribe(subscriber)
+
+
+async def _send_error(send, status, message):
+    body = json.dumps({"error": message}, ensure_ascii=False).encode()
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def live_app(scope, receive, send):
+    """/api/live 的 ASGI 應用程式：一個協程負責送出事件，另一個等待客戶端斷線"""
+    if scope["method"] != "GET":
+        await _send_error(send, 405, "只支援 GET")
+        return
+    query = parse_qs(scope["query_string"].decode())
+    topics = query.get("topic") or DEFAULT_TOPICS
+    since = dict(scope["headers"]).get(b"last-event-id", b"").decode() or query.get("since", [""])[0]
+    try:
+        since = int(since) if since else None
+    except ValueError:
+        await _send_error(send, 400, "since / Last-Event-ID 必須是事件 id")
+        return
+
+    await send({"type": "http.response.start", "status": 200, "headers": [
+        (b"content-type", b"text/event-stream; charset=utf-8"),
+        (b"cache-control", b"no-cache"),
+        (b"x-accel-buffering", b"no"),  # nginx 不要緩衝整個回應
+    ]})
+    stream = event_stream(topics, since)
+
+    async def pump():
+        async for chunk in stream:
+            await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def disconnected():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    tasks = [asyncio.ensure_future(pump()), asyncio.ensure_future(disconnected())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await stream.aclose()
@@ -0,0 +1,162 @@
+"""
+長時間執行的 MQTT 訂閱者：把感測讀數批次寫入資料庫
+
+    python manage.py mqtt_ingest
+    python manage.py mqtt_ingest --broker 192.168.1.10 --topic "home/+/frame" --batch-size 10000
+
+以 QoS 1 訂閱，並使用固定的 --client-id 與持續的 session（clean_session=False）：
+Broker 會把斷線期間的 QoS 1 訊息保留下來，重新連線後補送，不會因為短暫斷線而遺失讀數。
+paho 的網路線程只把 (主題, payload, 收到時間) 放進佇列；主線程累積到 --batch-size 筆
+或距離上次寫入超過 --flush-interval 秒時，整批在一個交易中以 bulk_create 寫入（見 myapp/ingest.py）。
+資料庫寫入較慢時佇列會變長，超過 --max-queue 則丟棄新訊息並計數，避免記憶體無限成長。
+寫入失敗（例如 database is locked、資料庫暫時無法連線）時保留整批，以指數退避重試 --max-retries 次；
+仍然失敗就把整批原始訊息附加到 --dead-letter 檔案（每行一則 JSON：topic、base64 的 payload、received_ms），
+之後以 python manage.py replay_dead_letter 重新匯入，訂閱與後續的批次照常進行。
+"""
+import base64
+import json
+import queue
+import time
+
+import paho.mqtt.client as mqtt
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection
+
+from myapp.ingest import DEFAULT_TOPICS, save_messages
+
+STATS_INTERVAL = 10.0  # 秒，多久印一次統計
+RETRY_MIN_S = 1.0      # 寫入失敗後的重試等待（每次失敗加倍）
+RETRY_MAX_S = 30.0
+
+
+class Command(BaseCommand):
+    help = "訂閱 MQTT 感測主題，批次寫入 Device / Reading"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--broker", default=settings.MQTT_BROKER, help="MQTT Broker 位址")
+        parser.add_argument("--port", type=int, default=settings.MQTT_PORT, help="MQTT Broker 埠號")
+        parser.add_argument("--client-id", default="django-mqtt-ingest",
+                            help="MQTT 用戶端 ID（Broker 依此保留斷線期間的訊息，同時執行多個時要不同）")
+        parser.add_argument("--topic", action="append", dest="topics",
+                            help=f"訂閱的主題，可重複指定（預設 {', '.join(DEFAULT_TOPICS)}）")
+        parser.add_argument("--batch-size", type=int, default=5000, help="累積幾則訊息就寫入一次")
+        parser.add_argument("--flush-interval", type=float, default=1.0, help="最久幾秒寫入一次")
+        parser.add_argument("--max-queue", type=int, default=200_000, help="等待寫入的訊息上限，超過則丟棄")
+        parser.add_argument("--max-retries", type=int, default=5, help="資料庫寫入失敗時重試幾次")
+        parser.add_argument("--dead-letter", default="mqtt_dead_letter.ndjson",
+                            help="重試後仍然寫入失敗的訊息附加到這個檔案")
+
+    def handle(self, *args, **options):
+        topics = options["topics"] or DEFAULT_TOPICS
+        batch_size = options["batch_size"]
+        flush_interval = options["flush_interval"]
+        inbox = queue.Queue(maxsize=options["max_queue"])
+        dropped = [0]
+        self.dead_lettered = 0
+
+        def on_connect(client, userdata, flags, reason_code, properties):
+            if reason_code == 0:
+                # 重新連線時也要重新訂閱；QoS 1：斷線期間的訊息由 Broker 保留，重新連線後補送
+                client.subscribe([(topic, 1) for topic in topics])
+                self.stdout.write(f"已連接到 MQTT Broker {options['broker']}:{options['port']}，訂閱 {', '.join(topics)}")
+            else:
+                self.stderr.write(f"連接失敗，錯誤代碼: {reason_code}")
+
+        def on_message(client, userdata, msg):
+            try:
+                inbox.put_nowait((msg.topic, msg.payload, time.time_ns() // 1_000_000))
+            except queue.Full:
+                dropped[0] += 1
+
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=options["client_id"], clean_session=False)
+        client.on_connect = on_connect
+        client.on_message = on_message
+        client.connect(options["broker"], options["port"], 60)
+        client.loop_start()
+
+        received = saved = batches = 0
+        write_seconds = 0.0
+        started = last_stats = time.monotonic()
+        batch = []
+        try:
+            while True:
+                batch = []
+                deadline = time.monotonic() + flush_interval
+                while len(batch) < batch_size:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(inbox.get(timeout=timeout))
+                    except queue.Empty:
+                        break
+                if batch:
+                    t0 = time.perf_counter()
+                    saved += self.save(batch, options["max_retries"], options["dead_letter"])
+                    write_seconds += time.perf_counter() - t0
+                    received += len(batch)
+                    batches += 1
+                    batch = []
+
+                now = time.monotonic()
+                if now - last_stats >= STATS_INTERVAL:
+                    elapsed = now - started
+                    self.stdout.write(
+                        f"訊息 {received}（{received / elapsed:.0f}/s）、讀數 {saved}、批次 {batches}、"
+                        f"寫入耗時 {write_seconds:.1f}s、佇列 {inbox.qsize()}、丟棄 {dropped[0]}、"
+                        f"dead-letter {self.dead_lettered}")
+                    last_stats = now
+        except KeyboardInterrupt:
+            pass
+        finally:
+            client.loop_stop()
+            client.disconnect()
+            # 停止前把佇列中剩下的訊息（包括中斷時還沒寫入的那一批）寫完，失敗時不再等待重試
+            rest = batch
+            while True:
+                try:
+                    rest.append(inbox.get_nowait())
+                except queue.Empty:
+                    break
+            if rest:
+                saved += self.save(rest, 0, options["dead_letter"])
+                received += len(rest)
+            self.stdout.write(f"已停止：共 {received} 則訊息、{saved} 筆讀數、丟棄 {dropped[0]}、"
+                              f"dead-letter {self.dead_lettered}")
+
+    def save(self, batch, max_retries, dead_letter):
+        """
+        寫入一批訊息，回傳寫入的讀數
+        資料庫錯誤時保留整批、以指數退避重試；其他錯誤（重試也不會成功）或重試用完時寫到 dead-letter 檔案
+        """
+        delay = RETRY_MIN_S
+        for attempt in range(max_retries + 1):
+            try:
+                return save_messages(batch)
+            except DatabaseError as e:
+                # 連線可能已經失效（資料庫重新啟動等），關閉後下一次自動重新連線
+                connection.close()
+                if attempt == max_retries:
+                    self.stderr.write(f"寫入 {len(batch)} 則訊息失敗: {e}")
+                    break
+                self.stderr.write(f"寫入 {len(batch)} 則訊息失敗: {e}，{delay:.0f} 秒後重試（{attempt + 1}/{max_retries}）")
+                time.sleep(delay)
+                delay = min(delay * 2, RETRY_MAX_S)
+            except Exception as e:
+                self.stderr.write(f"處理 {len(batch)} 則訊息時發生錯誤: {e}")
+                break
+        self.write_dead_letter(batch, dead_letter)
+        return 0
+
+    def write_dead_letter(self, batch, path):
+        try:
+            with open(path, "a", encoding="utf-8") as f:
+                for topic, payload, received_ms in batch:
+                    f.write(json.dumps({"topic": topic, "payload": base64.b64encode(payload).decode("ascii"),
+                                        "received_ms": received_ms}) + "\n")
+        except OSError as e:
+            self.stderr.write(f"無法寫入 dead-letter 檔案 {path}: {e}，丟棄 {len(batch)} 則訊息")
+            return
+        self.dead_lettered += len(batch)
+        self.stderr.write(f"已把 {len(batch)} 則訊息保存到 {path}")
@@ -0,0 +1,80 @@
+"""
+重新匯入 mqtt_ingest 寫不進資料庫的訊息（dead-letter 檔案）
+
+    python manage.py replay_dead_letter
+    python manage.py replay_dead_letter --dead-letter /var/log/mqtt_dead_letter.ndjson --batch-size 10000
+
+檔案每行一則 JSON：{"topic": ..., "payload": base64, "received_ms": ...}（見 mqtt_ingest.write_dead_letter），
+以和 mqtt_ingest 相同的 save_messages 分批寫入，讀數的時間仍以訊息中的 ts 或當初收到的時間為準。
+開始前先把檔案改名為 <檔名>.replaying，執行中的 mqtt_ingest 之後失敗的訊息會寫到新的檔案，不會互相覆蓋；
+這次仍然寫入失敗的批次與無法解析的行附加回原本的檔案，可以稍後再執行一次。
+"""
+import base64
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection
+
+from myapp.ingest import save_messages
+
+
+class Command(BaseCommand):
+    help = "重新匯入 mqtt_ingest 的 dead-letter 檔案"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dead-letter", default="mqtt_dead_letter.ndjson",
+                            help="mqtt_ingest 的 dead-letter 檔案")
+        parser.add_argument("--batch-size", type=int, default=5000, help="每次寫入幾則訊息")
+
+    def handle(self, *args, **options):
+        path = options["dead_letter"]
+        replaying = path + ".replaying"
+        # 上次中斷時留下的 .replaying 檔案先處理完，不另外改名
+        if not os.path.exists(replaying):
+            try:
+                os.replace(path, replaying)
+            except FileNotFoundError:
+                raise CommandError(f"找不到 dead-letter 檔案 {path}") from None
+
+        saved = replayed = 0
+        failed = []  # 這次仍然無法匯入的原始行
+        batch, lines = [], []
+        with open(replaying, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    data = json.loads(line)
+                    batch.append((data["topic"], base64.b64decode(data["payload"]), int(data["received_ms"])))
+                except (ValueError, KeyError, TypeError) as e:
+                    self.stderr.write(f"無法解析的行：{e}")
+                    failed.append(line)
+                    continue
+                lines.append(line)
+                if len(batch) >= options["batch_size"]:
+                    saved += self.save(batch, lines, failed)
+                    replayed += len(batch)
+                    batch, lines = [], []
+        if batch:
+            saved += self.save(batch, lines, failed)
+            replayed += len(batch)
+
+        if failed:
+            with open(path, "a", encoding="utf-8") as f:
+                f.writelines(line if line.endswith("\n") else line + "\n" for line in failed)
+        os.remove(replaying)
+        self.stdout.write(f"已處理 {replayed} 則訊息，寫入 {saved} 筆讀數；{len(failed)} 行未能匯入"
+                          + (f"，已附加回 {path}" if failed else ""))
+
+    def save(self, batch, lines, failed):
+        """寫入一批訊息，回傳寫入的讀數；失敗時把這批的原始行留給下次"""
+        try:
+            return save_messages(batch)
+        except DatabaseError as e:
+            connection.close()
+            self.stderr.write(f"寫入 {len(batch)} 則訊息失敗: {e}")
+        except Exception as e:
+            self.stderr.write(f"處理 {len(batch)} 則訊息時發生錯誤: {e}")
+        failed.extend(lines)
+        return 0
@@ -0,0 +1,133 @@
+"""
+SQLite 設定的並行讀寫基準測試
+
+    python manage.py sqlite_bench
+    python manage.py sqlite_bench --seconds 10 --readers 4 --batch 1000
+
+在暫存目錄建立兩個相同結構的資料庫，各跑一次「一個寫入者 + 多個讀取者」：
+- 預設：SQLite 預設的 rollback journal、synchronous=FULL、交易開始時不取得寫入鎖
+- 調校：settings.SQLITE_PRAGMAS 與 DATABASES 的 timeout、transaction_mode（與 Django 連線相同的設定）
+寫入者模擬 mqtt_ingest（每個交易 bulk insert 一批讀數），讀取者模擬儀表板（某台裝置最近一段時間的統計）。
+直接使用標準函式庫的 sqlite3，量到的是資料庫設定本身的差異，不含 ORM 的額外負擔。
+"""
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+DEVICES = 200
+SCHEMA = """
+CREATE TABLE reading (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    device_id INTEGER NOT NULL,
+    timestamp BIGINT NOT NULL,
+    temperature REAL,
+    humidity REAL
+);
+CREATE INDEX reading_device_time ON reading (device_id, timestamp);
+"""
+RECENT_QUERY = """
+SELECT COUNT(*), AVG(temperature), MIN(temperature), MAX(temperature)
+FROM reading WHERE device_id = ? AND timestamp >= ?
+"""
+
+
+def _connect(path, tuned):
+    options = settings.DATABASES["default"].get("OPTIONS", {})
+    # isolation_level=None：交易由下面自行 BEGIN / COMMIT
+    conn = sqlite3.connect(path, timeout=options.get("timeout", 5) if tuned else 5,
+                           isolation_level=None, check_same_thread=False)
+    if tuned:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            conn.execute(f"PRAGMA {name}={value}")
+    return conn
+
+
+def _run(path, tuned, seconds, readers, batch):
+    """回傳 {寫入筆數, 寫入交易, 查詢數, 鎖定錯誤, 查詢延遲清單}"""
+    conn = _connect(path, tuned)
+    conn.executescript(SCHEMA)
+    conn.close()
+
+    begin = "BEGIN IMMEDIATE" if tuned and settings.DATABASES["default"]["OPTIONS"].get(
+        "transaction_mode") == "IMMEDIATE" else "BEGIN"
+    stop = threading.Event()
+    result = {"rows": 0, "commits": 0, "queries": 0, "locked": 0, "latencies": []}
+    lock = threading.Lock()
+
+    def writer():
+        conn = _connect(path, tuned)
+        rng = random.Random(0)
+        while not stop.is_set():
+            now = time.time_ns() // 1_000_000
+            rows = [(rng.randrange(DEVICES), now, rng.uniform(15, 35), rng.uniform(30, 80)) for _ in range(batch)]
+            try:
+                conn.execute(begin)
+                conn.executemany(
+                    "INSERT INTO reading (device_id, timestamp, temperature, humidity) VALUES (?, ?, ?, ?)", rows)
+                conn.execute("COMMIT")
+            except sqlite3.OperationalError:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                with lock:
+                    result["locked"] += 1
+                continue
+            with lock:
+                result["rows"] += batch
+                result["commits"] += 1
+        conn.close()
+
+    def reader(seed):
+        conn = _connect(path, tuned)
+        rng = random.Random(seed)
+        while not stop.is_set():
+            since = time.time_ns() // 1_000_000 - 60_000
+            t0 = time.perf_counter()
+            try:
+                conn.execute(RECENT_QUERY, (rng.randrange(DEVICES), since)).fetchone()
+            except sqlite3.OperationalError:
+                with lock:
+                    result["locked"] += 1
+                continue
+            elapsed = time.perf_counter() - t0
+            with lock:
+                result["queries"] += 1
+                result["latencies"].append(elapsed)
+        conn.close()
+
+    threads = [threading.Thread(target=writer)] + [
+        threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return result
+
+
+class Command(BaseCommand):
+    help = "比較 SQLite 預設設定與 settings.SQLITE_PRAGMAS 的並行讀寫吞吐量"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seconds", type=float, default=5.0, help="每種設定執行幾秒")
+        parser.add_argument("--readers", type=int, default=2, help="讀取者線程數")
+        parser.add_argument("--batch", type=int, default=500, help="每個寫入交易的筆數")
+
+    def handle(self, *args, **options):
+        seconds = options["seconds"]
+        with tempfile.TemporaryDirectory() as tmp:
+            for label, tuned in (("預設", False), ("調校", True)):
+                result = _run(str(Path(tmp) / f"{label}.sqlite3"), tuned, seconds, options["readers"],
+                              options["batch"])
+                latencies = sorted(result["latencies"])
+                p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else float("nan")
+                self.stdout.write(
+                    f"{label}：寫入 {result['rows'] / seconds:,.0f} 筆/秒（{result['commits']} 個交易）、"
+                    f"查詢 {result['queries'] / seconds:,.0f} 次/秒（p99 {p99:.2f} ms）、"
+                    f"database is locked {result['locked']} 次")
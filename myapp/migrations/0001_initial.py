@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Device',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True, verbose_name='名稱')),
+                ('device_id', models.PositiveIntegerField(blank=True, help_text='二進位訊框中的裝置編號', null=True, unique=True, verbose_name='裝置編號')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='建立時間')),
+            ],
+            options={
+                'verbose_name': '裝置',
+                'verbose_name_plural': '裝置',
+            },
+        ),
+        migrations.CreateModel(
+            name='Reading',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.BigIntegerField(help_text='取樣時間（epoch 毫秒，UTC）', verbose_name='時間')),
+                ('temperature', models.FloatField(blank=True, null=True, verbose_name='溫度')),
+                ('humidity', models.FloatField(blank=True, null=True, verbose_name='濕度')),
+                ('light', models.BooleanField(blank=True, null=True, verbose_name='電燈')),
+                ('seq', models.PositiveIntegerField(blank=True, null=True, verbose_name='序號')),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='readings', to='myapp.device', verbose_name='裝置')),
+            ],
+            options={
+                'verbose_name': '讀數',
+                'verbose_name_plural': '讀數',
+                'indexes': [models.Index(fields=['device', 'timestamp'], name='reading_device_time')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='updated_at',
+            field=models.DateTimeField(blank=True, help_text='最後一批讀數寫入的時間（查詢 API 的 Last-Modified）', null=True, verbose_name='最後寫入時間'),
+        ),
+    ]
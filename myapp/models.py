@@ -1,3 +1,43 @@
 from django.db import models
 
-# Create your models here.
+
+class Device(models.Model):
+    """感測裝置（對應 MQTT 主題 home/<裝置>/...）"""
+    name = models.CharField("名稱", max_length=64, unique=True)
+    device_id = models.PositiveIntegerField("裝置編號", null=True, blank=True, unique=True,
+                                            help_text="二進位訊框中的裝置編號")
+    created_at = models.DateTimeField("建立時間", auto_now_add=True)
+    updated_at = models.DateTimeField("最後寫入時間", null=True, blank=True,
+                                      help_text="最後一批讀數寫入的時間（查詢 API 的 Last-Modified）")
+
+    class Meta:
+        verbose_name = "裝置"
+        verbose_name_plural = "裝置"
+
+    def __str__(self):
+        return self.name
+
+
+class Reading(models.Model):
+    """
+    一筆感測讀數
+    時間以 epoch 毫秒（UTC）的整數儲存：依時間範圍查詢與分段統計都只是整數運算，
+    也和 MQTT 訊息中的 ts 欄位相同
+    """
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name="readings", verbose_name="裝置")
+    timestamp = models.BigIntegerField("時間", help_text="取樣時間（epoch 毫秒，UTC）")
+    temperature = models.FloatField("溫度", null=True, blank=True)
+    humidity = models.FloatField("濕度", null=True, blank=True)
+    light = models.BooleanField("電燈", null=True, blank=True)
+    seq = models.PositiveIntegerField("序號", null=True, blank=True)
+
+    class Meta:
+        verbose_name = "讀數"
+        verbose_name_plural = "讀數"
+        indexes = [
+            # 查詢幾乎都是「某台裝置、某段時間」：先比對裝置再依時間範圍掃描
+            models.Index(fields=["device", "timestamp"], name="reading_device_time"),
+        ]
+
+    def __str__(self):
+        return f"{self.device_id} @ {self.timestamp}"
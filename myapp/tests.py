@@ -1,3 +1,257 @@
-from django.test import TestCase
+import json
+import time
+from unittest.mock import patch
 
-# Create your tests here.
+import numpy as np
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from sensor_frames import encode_frame, encode_summary
+
+from . import ingest
+from .ingest import messages_to_columns, ndjson_to_columns, save_messages, valid_device_name, validate_readings
+from .models import Device, Reading
+
+NOW_MS = 1_760_000_000_000  # 2025-10-09，測試用的固定時間
+
+
+def clear_device_cache():
+    # 裝置主鍵的快取是整個程序共用的，每個測試的資料庫都會回復，快取也要清掉
+    ingest._device_pks.clear()
+    ingest._device_numbers.clear()
+
+
+class IngestTestCase(TestCase):
+    def setUp(self):
+        clear_device_cache()
+
+
+class MessagesToColumnsTest(IngestTestCase):
+    def test_json_topics(self):
+        columns, numbers = messages_to_columns([
+            ("home/kitchen/temperature", json.dumps({"value": 25.3, "ts": NOW_MS - 5, "seq": 7}).encode(), NOW_MS),
+            ("home/kitchen/humidity", b"61.5", NOW_MS),
+            ("home/kitchen/light", b'{"status": "on"}', NOW_MS),
+            ("home/kitchen/temperature", b"not a number", NOW_MS),
+            ("office/kitchen/temperature", b"20", NOW_MS),
+        ])
+        # 無法解析的數值與其他前綴的主題不寫入
+        self.assertEqual(numbers, {})
+        self.assertEqual(columns["device"], ["kitchen"] * 3)
+        stamped = columns["seq"] == 7
+        self.assertEqual(columns["temperature"][stamped].tolist(), [25.3])
+        self.assertEqual(columns["timestamp"][stamped].tolist(), [NOW_MS - 5])
+        self.assertEqual(columns["humidity"][~np.isnan(columns["humidity"])].tolist(), [61.5])
+        self.assertEqual(columns["light"][~np.isnan(columns["light"])].tolist(), [1.0])
+        # 沒有 ts 的訊息以收到的時間為準
+        self.assertEqual(sorted(columns["timestamp"].tolist()), [NOW_MS - 5, NOW_MS, NOW_MS])
+
+    def test_frames_record_device_number(self):
+        frames = encode_frame(42, 1, NOW_MS * 1000, 22.5, 40.0, True) + encode_frame(42, 2, NOW_MS * 1000 + 1000, 23.0)
+        summary = encode_summary(42, 3, NOW_MS * 1000, 60_000, 30, (20, 21, 22), (40, 41, 42))
+        columns, numbers = messages_to_columns([("home/garage/frame", frames, NOW_MS),
+                                                ("home/garage/frame", summary, NOW_MS)])
+        self.assertEqual(numbers, {"garage": 42})
+        self.assertEqual(columns["seq"].tolist(), [1, 2, 3])
+        self.assertEqual(columns["temperature"].tolist(), [22.5, 23.0, 21.0])
+
+    def test_invalid_device_names_are_skipped(self):
+        columns, _ = messages_to_columns([("home/" + "x" * 65 + "/temperature", b"20", NOW_MS)])
+        self.assertEqual(len(columns["timestamp"]), 0)
+
+
+class SaveMessagesTest(IngestTestCase):
+    def test_bulk_insert_creates_devices(self):
+        messages = [(f"home/dev{i % 3}/temperature", json.dumps({"value": 20 + i, "ts": NOW_MS + i}).encode(), NOW_MS)
+                    for i in range(30)]
+        messages.append(("home/dev0/frame", encode_frame(7, 1, NOW_MS * 1000, 25.0), NOW_MS))
+        with self.assertNumQueries(8):
+            self.assertEqual(save_messages(messages), 31)
+        self.assertEqual(Reading.objects.count(), 31)
+        self.assertEqual(sorted(Device.objects.values_list("name", flat=True)), ["dev0", "dev1", "dev2"])
+        self.assertEqual(Device.objects.get(name="dev0").device_id, 7)
+        self.assertFalse(Device.objects.filter(updated_at__isnull=True).exists())
+        # 第二批不再查詢或建立裝置
+        with self.assertNumQueries(4):
+            save_messages(messages[:3])
+
+
+class DeletedDeviceTest(TransactionTestCase):
+    """SQLite 在 commit 時才檢查外鍵，要真的 commit 才能測到快取中的裝置已被刪除的情況"""
+
+    def setUp(self):
+        clear_device_cache()
+
+    def test_recovers_from_deleted_cached_device(self):
+        save_messages([("home/gone/temperature", b"20", NOW_MS)])
+        Device.objects.filter(name="gone").delete()
+        self.assertEqual(save_messages([("home/gone/temperature", b"21", NOW_MS)]), 1)
+        self.assertEqual(Device.objects.get(name="gone").readings.count(), 1)
+
+
+class DeviceSeriesTest(IngestTestCase):
+    def setUp(self):
+        super().setUp()
+        self.device = Device.objects.create(name="kitchen")
+        # 0～9 秒每秒一筆，溫度 20～29
+        Reading.objects.bulk_create([Reading(device=self.device, timestamp=NOW_MS + i * 1000, temperature=20 + i,
+                                             humidity=50.0) for i in range(10)])
+        self.url = f"/api/devices/{self.device.pk}/series"
+
+    def get(self, **params):
+        return self.client.get(self.url, params)
+
+    def test_step_buckets(self):
+        data = self.get(**{"from": NOW_MS, "to": NOW_MS + 10_000, "step": 2000}).json()
+        self.assertEqual(data["step"], 2000)
+        series = data["series"]
+        self.assertEqual(series["t"], [NOW_MS + i * 2000 for i in range(5)])
+        self.assertEqual(series["count"], [2] * 5)
+        self.assertEqual(series["temperature_min"], [20, 22, 24, 26, 28])
+        self.assertEqual(series["temperature_mean"], [20.5, 22.5, 24.5, 26.5, 28.5])
+        self.assertEqual(series["temperature_max"], [21, 23, 25, 27, 29])
+
+    def test_buckets_align_to_step(self):
+        series = self.get(**{"from": NOW_MS + 1500, "to": NOW_MS + 10_000, "step": 5000}).json()["series"]
+        # 區間起點是 step 的整數倍（NOW_MS 可以被 5000 整除），不是 from
+        self.assertEqual(series["t"], [NOW_MS, NOW_MS + 5000])
+        self.assertEqual(series["count"], [3, 5])
+
+    def test_step_grows_to_respect_max_points(self):
+        start, to = NOW_MS - 3_600_000, NOW_MS + 3_600_000
+        for max_points in (1, 7, 1000):
+            data = self.get(**{"from": start, "to": to, "max_points": max_points}).json()
+            step = data["step"]
+            self.assertLess((to - 1) // step - start // step, max_points)
+            self.assertLessEqual(len(data["series"]["t"]), max_points)
+            self.assertEqual(sum(data["series"]["count"]), 10)
+        # 超過 MAX_POINTS 的要求以 MAX_POINTS 為準，step 不小於 MIN_STEP_MS
+        data = self.get(**{"from": NOW_MS, "to": NOW_MS + 10_000_000, "max_points": 10**6, "step": 1}).json()
+        self.assertGreaterEqual(data["step"], 10_000)
+
+    def test_default_to_is_latest_reading(self):
+        data = self.get().json()
+        self.assertEqual(data["to"], NOW_MS + 9000 + 1)
+        self.assertEqual(data["from"], data["to"] - 24 * 3600 * 1000)
+        self.assertEqual(sum(data["series"]["count"]), 10)
+
+    def test_default_to_without_readings_is_now(self):
+        empty = Device.objects.create(name="empty")
+        before = int(time.time() * 1000)
+        data = self.client.get(f"/api/devices/{empty.pk}/series").json()
+        self.assertGreaterEqual(data["to"], before)
+        self.assertEqual(data["series"]["t"], [])
+
+    def test_etag_and_not_modified(self):
+        response = self.get()
+        etag = response["ETag"]
+        self.assertEqual(response["Cache-Control"], "no-cache")
+        # 沒有新讀數時預設範圍不變，ETag 相同
+        self.assertEqual(self.client.get(self.url, headers={"If-None-Match": etag}).status_code, 304)
+        # 補傳較舊的讀數也會改變 ETag
+        Reading.objects.create(device=self.device, timestamp=NOW_MS - 1000, temperature=19)
+        response = self.client.get(self.url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_last_modified(self):
+        self.assertNotIn("Last-Modified", self.get())
+        save_messages([("home/kitchen/temperature", json.dumps({"value": 30, "ts": NOW_MS + 20_000}).encode(), NOW_MS)])
+        last_modified = self.get()["Last-Modified"]
+        self.assertEqual(self.client.get(self.url, headers={"If-Modified-Since": last_modified}).status_code, 304)
+
+    def test_bad_parameters(self):
+        self.assertEqual(self.get(**{"from": NOW_MS, "to": NOW_MS}).status_code, 400)
+        self.assertEqual(self.get(step="abc").status_code, 400)
+        self.assertEqual(self.get(max_points=0).status_code, 400)
+        self.assertEqual(self.client.get("/api/devices/999999/series").status_code, 404)
+
+
+class ValidateReadingsTest(SimpleTestCase):
+    def test_reports_first_failed_rule_per_row(self):
+        columns, _, rows, errors = ndjson_to_columns("\n".join([
+            json.dumps({"device": "a", "ts": NOW_MS, "temperature": 20, "humidity": 50}),
+            json.dumps({"ts": NOW_MS, "temperature": 20}),
+            json.dumps({"device": "a", "ts": NOW_MS}),
+            json.dumps({"device": "a", "ts": 1000, "temperature": 200}),
+            json.dumps({"device": "a", "ts": NOW_MS + 2 * 24 * 3600 * 1000, "temperature": 20}),
+            json.dumps({"device": "a", "ts": NOW_MS, "temperature": 200}),
+            json.dumps({"device": "a", "ts": NOW_MS, "humidity": -1}),
+            json.dumps({"device": "a/b", "ts": NOW_MS, "temperature": 20}),
+            json.dumps({"device": "a", "ts": NOW_MS, "light": "on"}),
+        ]).encode(), received_ms=NOW_MS)
+        self.assertEqual(errors, [])
+        keep, invalid = validate_readings(columns, NOW_MS)
+        self.assertEqual(keep.tolist(), [True, False, False, False, False, False, False, False, True])
+        self.assertEqual(invalid, [
+            (1, "缺少裝置名稱"),
+            (2, "沒有任何數值"),
+            (3, "時間超出範圍（裝置還沒校時？）"),
+            (4, "時間超出範圍（裝置還沒校時？）"),
+            (5, "溫度超出範圍"),
+            (6, "濕度超出範圍"),
+            (7, "裝置名稱不正確"),
+        ])
+
+    def test_device_name_length(self):
+        self.assertTrue(valid_device_name("x" * 64))
+        self.assertFalse(valid_device_name("x" * 65))
+        self.assertFalse(valid_device_name(""))
+        self.assertFalse(valid_device_name("home/+"))
+
+
+@override_settings(INGEST_TOKEN="test-token")
+class IngestViewTest(IngestTestCase):
+    url = "/api/ingest"
+
+    def post(self, body, content_type="application/x-ndjson", token="test-token", path=None, headers=None):
+        headers = dict(headers or {})
+        if token is not None:
+            headers["Authorization"] = f"Bearer {token}"
+        return self.client.post(path or self.url, body, content_type=content_type, headers=headers)
+
+    def ndjson(self, *records):
+        return "\n".join(json.dumps(record) for record in records)
+
+    def test_ndjson_batch(self):
+        now = int(time.time() * 1000)
+        body = self.ndjson({"device": "a", "ts": now, "temperature": 20, "seq": 1},
+                           {"device": "a", "ts": now + 1, "humidity": 150}) + "\nnot json\n\n[1]"
+        response = self.post(body, path=self.url + "?batch=17")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            "batch": "17", "accepted": 1, "rejected": 3,
+            "errors": [{"row": 1, "error": "濕度超出範圍"}, {"row": 2, "error": "JSON 格式錯誤"},
+                       {"row": 4, "error": "每行必須是 JSON 物件"}],
+        })
+        self.assertEqual(Reading.objects.get().seq, 1)
+
+    def test_binary_batch_with_device_parameter(self):
+        now_us = int(time.time() * 1_000_000)
+        body = encode_frame(5, 1, now_us, 21.0) + b"\x00" * 24 + encode_frame(5, 2, now_us + 1000, 22.0)
+        response = self.post(body, "application/octet-stream", path=self.url + "?device=garage",
+                             headers={"X-Batch-Id": "b1"})
+        self.assertEqual(response.json(), {"batch": "b1", "accepted": 2, "rejected": 1,
+                                           "errors": [{"row": 1, "error": "訊框 magic 或版本不正確"}]})
+        self.assertEqual(Device.objects.get(name="garage").device_id, 5)
+
+    def test_requires_token(self):
+        body = self.ndjson({"device": "a", "temperature": 20})
+        self.assertEqual(self.post(body, token=None).status_code, 401)
+        self.assertEqual(self.post(body, token="wrong").status_code, 401)
+        with override_settings(INGEST_TOKEN=""):
+            self.assertEqual(self.post(body, token="").status_code, 401)
+        self.assertFalse(Reading.objects.exists())
+
+    def test_bad_bodies(self):
+        self.assertEqual(self.post(b"\xf5\x01\x02", "application/octet-stream").status_code, 400)
+        self.assertEqual(self.post(b"{\"device\": \"a\"}\n\xff\xfe", "application/x-ndjson").status_code, 400)
+        self.assertEqual(self.post(self.ndjson({"device": "a"}), path=self.url + "?device=" + "x" * 65).status_code,
+                         400)
+        self.assertEqual(self.post("{}", "application/json").status_code, 415)
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+
+    def test_batch_size_limits(self):
+        body = self.ndjson(*[{"device": "a", "temperature": 20}] * 3)
+        with patch("myapp.views.MAX_BATCH_READINGS", 2):
+            self.assertEqual(self.post(body).status_code, 413)
+        with override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=10):
+            self.assertEqual(self.post(body).status_code, 413)
@@ -4,5 +4,8 @@ from . import views
 urlpatterns = [
     path('', views.index, name='index'),
     path('about/', views.about, name='about'),
+    path('api/devices', views.device_list, name='device_list'),
+    path('api/devices/<int:pk>/series', views.device_series, name='device_series'),
+    path('api/ingest', views.ingest, name='ingest'),
 ]
 
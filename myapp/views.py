@@ -1,5 +1,32 @@
-from django.shortcuts import render
-from django.http import HttpResponse
+import hashlib
+import hmac
+import math
+import time
+
+from django.conf import settings
+from django.core.exceptions import RequestDataTooBig
+from django.db.models import Avg, BigIntegerField, Count, ExpressionWrapper, F, Max, Min, Value
+from django.shortcuts import render, get_object_or_404
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_GET, require_POST
+
+from .ingest import (DEVICE_NAME_MAX_LENGTH, binary_to_columns, ndjson_to_columns, save_readings, select_rows,
+                     valid_device_name, validate_readings)
+from .models import Device, Reading
+
+# 時間序列查詢 API
+DEFAULT_RANGE_MS = 24 * 3600 * 1000  # 沒有指定 from 時查詢 to 之前的一天
+MIN_STEP_MS = 1000
+MAX_POINTS = 1000  # 每次回應最多幾個時間區間，超過時自動加大 step
+SERIES_METRICS = ("temperature", "humidity")
+
+# HTTP 批次寫入 API
+NDJSON_TYPES = ("application/x-ndjson", "application/jsonl", "application/json-seq", "text/plain")
+# 每個請求最多幾筆讀數；settings.DATA_UPLOAD_MAX_MEMORY_SIZE 依這個數量設定，NDJSON 也能帶滿一批
+MAX_BATCH_READINGS = 100_000
+ERROR_LIMIT = 20  # 回應中最多列出幾筆錯誤
 
 # Create your views here.
 
@@ -10,3 +37,143 @@ def index(request):
 def about(request):
     """關於頁面視圖"""
     return HttpResponse("<h1>關於我們</h1><p>這是一個 Django 學習專案。</p>")
+
+
+@require_GET
+def device_list(request):
+    """所有裝置：GET /api/devices"""
+    devices = Device.objects.order_by("name").values("id", "name", "device_id", "updated_at")
+    return JsonResponse({"devices": list(devices)})
+
+
+def _series_params(request, pk):
+    """
+    解析 ?from=&to=&step=&max_points=（時間與 step 都是 epoch 毫秒 / 毫秒）
+    回傳 (from, to, step)；step 至少讓區間數不超過 max_points，格式錯誤時丟出 ValueError
+    沒有指定 to 時以這台裝置最新一筆讀數為終點（還沒有讀數時為現在時間）：
+    沒有新讀數時每次輪詢的範圍都相同，ETag 不變，客戶端才會收到 304
+    """
+    if request.GET.get("to"):
+        to = int(request.GET["to"])
+    else:
+        latest = Reading.objects.filter(device_id=pk).aggregate(t=Max("timestamp"))["t"]
+        to = latest + 1 if latest is not None else int(time.time() * 1000)
+    start = int(request.GET.get("from") or to - DEFAULT_RANGE_MS)
+    if start >= to:
+        raise ValueError("from 必須小於 to")
+    max_points = min(int(request.GET.get("max_points") or MAX_POINTS), MAX_POINTS)
+    if max_points < 1:
+        raise ValueError("max_points 必須大於 0")
+    step = max(int(request.GET.get("step") or 0), MIN_STEP_MS, math.ceil((to - start) / max_points))
+    # 區間對齊 step 的整數倍，頭尾可能各多出半個區間
+    while (to - 1) // step - start // step >= max_points:
+        step += math.ceil(step / max_points)
+    return start, to, step
+
+
+def _series_readings(pk, start, to):
+    return Reading.objects.filter(device_id=pk, timestamp__gte=start, timestamp__lt=to)
+
+
+def _series_etag(request, pk):
+    """這段時間內的讀數筆數與最大主鍵：有新讀數（包含補傳的舊資料）時就會改變"""
+    try:
+        start, to, step = _series_params(request, pk)
+    except ValueError:
+        return None
+    stats = _series_readings(pk, start, to).aggregate(count=Count("id"), last=Max("id"))
+    key = f"{pk}:{start}:{to}:{step}:{stats['count']}:{stats['last']}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def _series_last_modified(request, pk):
+    """裝置最後一批讀數寫入的時間（比 ETag 粗略：任何新讀數都算變動）"""
+    return Device.objects.filter(pk=pk).values_list("updated_at", flat=True).first()
+
+
+@require_GET
+@cache_control(no_cache=True)
+@condition(etag_func=_series_etag, last_modified_func=_series_last_modified)
+def device_series(request, pk):
+    """
+    降採樣後的時間序列：GET /api/devices/<id>/series?from=&to=&step=
+    在資料庫中依 timestamp / step 分組計算每個區間的 min / mean / max，回傳欄式 JSON：
+    {"t": [區間起點...], "count": [...], "temperature_min": [...], "temperature_mean": [...], ...}
+    區間起點對齊 step 的整數倍，重疊的查詢範圍會得到相同的區間；沒有讀數的區間不回傳
+    """
+    device = get_object_or_404(Device, pk=pk)
+    try:
+        start, to, step = _series_params(request, pk)
+    except ValueError as e:
+        return JsonResponse({"error": f"查詢參數錯誤：{e}"}, status=400)
+
+    # 整數除法：SQLite 與 PostgreSQL 的整數相除都會捨去小數
+    bucket = ExpressionWrapper(F("timestamp") / Value(step) * Value(step), output_field=BigIntegerField())
+    aggregates = {"count": Count("id")}
+    for metric in SERIES_METRICS:
+        aggregates[f"{metric}_min"] = Min(metric)
+        aggregates[f"{metric}_mean"] = Avg(metric)
+        aggregates[f"{metric}_max"] = Max(metric)
+    rows = (_series_readings(pk, start, to).annotate(t=bucket).values("t")
+            .annotate(**aggregates).order_by("t"))
+
+    series = {name: [] for name in ["t", *aggregates]}
+    for row in rows:
+        for name, values in series.items():
+            values.append(row[name])
+    return JsonResponse({"device": device.name, "from": start, "to": to, "step": step, "series": series})
+
+
+def _ingest_authorized(request):
+    """比對 Bearer token（固定時間比較）；伺服器沒有設定 INGEST_TOKEN 時一律拒絕"""
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    return (bool(settings.INGEST_TOKEN) and scheme.lower() == "bearer"
+            and hmac.compare_digest(token.strip().encode(), settings.INGEST_TOKEN.encode()))
+
+
+@csrf_exempt
+@require_POST
+def ingest(request):
+    """
+    HTTP 批次寫入（給不能使用 MQTT 的裝置）：POST /api/ingest?device=&batch=
+    Content-Type: application/x-ndjson        每行一筆 JSON 讀數（見 ingest.ndjson_to_columns）
+    Content-Type: application/octet-stream    串接的二進位訊框或摘要訊框（見 sensor_frames）
+    整批檢查後，通過的讀數以一次 bulk_create 寫入，未通過的列在回應中列出（row 從 0 開始：
+    NDJSON 為行號、二進位為訊框序號）。batch（或 X-Batch-Id 標頭）原樣放回回應，
+    裝置收到確認後才刪除自己緩衝的資料：
+    {"batch": "17", "accepted": 998, "rejected": 2, "errors": [{"row": 3, "error": "濕度超出範圍"}, ...]}
+    裝置必須帶 Authorization: Bearer <settings.INGEST_TOKEN>，否則回應 401
+    """
+    if not _ingest_authorized(request):
+        return JsonResponse({"error": "未授權：請以 Authorization: Bearer <INGEST_TOKEN> 標頭上傳"}, status=401)
+    device = request.GET.get("device")
+    if device is not None and not valid_device_name(device):
+        return JsonResponse({"error": f"裝置名稱不正確（1～{DEVICE_NAME_MAX_LENGTH} 個字元，不可包含 / + #）"},
+                            status=400)
+    try:
+        body = request.body
+    except RequestDataTooBig:
+        return JsonResponse({"error": "請求太大，請分成多批上傳"}, status=413)
+    received = int(time.time() * 1000)
+    try:
+        if request.content_type in NDJSON_TYPES:
+            columns, numbers, rows, errors = ndjson_to_columns(body, device, received)
+        elif request.content_type == "application/octet-stream":
+            columns, numbers, rows, errors = binary_to_columns(body, device, received)
+        else:
+            return JsonResponse({"error": f"不支援的 Content-Type：{request.content_type}"}, status=415)
+    except ValueError as e:
+        return JsonResponse({"error": f"內容格式錯誤：{e}"}, status=400)
+    if len(columns["timestamp"]) > MAX_BATCH_READINGS:
+        return JsonResponse({"error": f"每批最多 {MAX_BATCH_READINGS} 筆讀數"}, status=413)
+
+    keep, invalid = validate_readings(columns, received)
+    errors += [(int(rows[row]), message) for row, message in invalid]
+    accepted = save_readings(select_rows(columns, keep), numbers) if keep.any() else 0
+    errors.sort()
+    return JsonResponse({
+        "batch": request.GET.get("batch") or request.headers.get("X-Batch-Id"),
+        "accepted": accepted,
+        "rejected": len(errors),
+        "errors": [{"row": row, "error": message} for row, message in errors[:ERROR_LIMIT]],
+    })
@@ -0,0 +1,255 @@
+"""
+精簡的二進位感測器訊框（與 JSON 並存）
+
+lesson6 儀表板與 Django 的 myapp 共用這個套件（pyproject.toml 打包，uv run 或 pip install -e . 後即可匯入）。
+
+原本每筆讀數要發三則 JSON（電燈、溫度、濕度），每則還帶著各自的主題與 ts / seq 欄位。
+訊框把一台裝置的一筆讀數放進一則 24 位元組的訊息，發到 home/<裝置>/frame：
+
+    位移  型別    欄位
+    0     uint8   magic（0xF5，不是合法的 UTF-8 開頭，不會和 JSON / 純文字混淆）
+    1     uint8   版本（1）
+    2     uint16  旗標：bit0 = 有電燈狀態、bit1 = 電燈開啟
+    4     uint32  裝置編號
+    8     uint32  序號
+    12    int64   送出時間（epoch 微秒）
+    20    int16   溫度 × 100（°C），-32768 = 沒有數據
+    22    uint16  濕度 × 100（%），65535 = 沒有數據
+
+全部為 little-endian（struct 格式 "<BBHIIqhH"，MicroPython 的 ustruct 也能使用）。
+一則訊息也可以是多個訊框直接串接（批次上傳，見 lesson7/frame_buffer.py），長度為 24 的倍數；
+此時每個訊框的送出時間就是取樣時間。
+
+版本 2 是摘要訊框（裝置端在一個時間窗內統計，只上傳 min / mean / max），每個 38 位元組：
+
+    位移  型別    欄位
+    0     uint8   magic（0xF5）
+    1     uint8   版本（2）
+    2     uint16  旗標（保留）
+    4     uint32  裝置編號
+    8     uint32  序號
+    12    int64   時間窗起點（epoch 微秒）
+    20    uint32  時間窗長度（毫秒）
+    24    uint16  取樣數
+    26    int16×3 溫度 min / mean / max × 100，-32768 = 沒有數據
+    32    uint16×3 濕度 min / mean / max × 100，65535 = 沒有數據
+
+同一則訊息中的訊框版本必須相同（依第一個訊框的版本判斷長度）。
+接收端依第一個位元組自動判斷：同一批訊框以 np.frombuffer 一次解碼，
+frame 主題上的 JSON（{"temperature": 25.3, "humidity": 50, "light": true, "ts": ..., "seq": ...}）逐筆解析。
+"""
+import json
+import struct
+
+import numpy as np
+
+FRAME_MAGIC = 0xF5
+FRAME_VERSION = 1
+FRAME_TOPIC_LAYOUT = "home/{device}/frame"
+FRAME_FORMAT = "<BBHIIqhH"
+FRAME_SIZE = struct.calcsize(FRAME_FORMAT)  # 24
+FRAME_DTYPE = np.dtype([
+    ("magic", "u1"),
+    ("version", "u1"),
+    ("flags", "<u2"),
+    ("device", "<u4"),
+    ("seq", "<u4"),
+    ("ts_us", "<i8"),
+    ("temperature", "<i2"),
+    ("humidity", "<u2"),
+])
+NO_TEMPERATURE = -32768
+NO_HUMIDITY = 0xFFFF
+FLAG_LIGHT_KNOWN = 0x1
+FLAG_LIGHT_ON = 0x2
+
+SUMMARY_VERSION = 2
+SUMMARY_FORMAT = "<BBHIIqIHhhhHHH"
+SUMMARY_SIZE = struct.calcsize(SUMMARY_FORMAT)  # 38
+SUMMARY_DTYPE = np.dtype([
+    ("magic", "u1"),
+    ("version", "u1"),
+    ("flags", "<u2"),
+    ("device", "<u4"),
+    ("seq", "<u4"),
+    ("start_us", "<i8"),
+    ("window_ms", "<u4"),
+    ("count", "<u2"),
+    ("temperature", "<i2", (3,)),
+    ("humidity", "<u2", (3,)),
+])
+SUMMARY_STATS = ("min", "mean", "max")
+
+
+def encode_frame(device_id, seq, ts_us, temperature=None, humidity=None, light=None):
+    """編碼一筆讀數；沒有的欄位傳 None"""
+    flags = 0
+    if light is not None:
+        flags = FLAG_LIGHT_KNOWN | (FLAG_LIGHT_ON if light else 0)
+    return struct.pack(
+        FRAME_FORMAT, FRAME_MAGIC, FRAME_VERSION, flags, device_id, seq, int(ts_us),
+        NO_TEMPERATURE if temperature is None else int(round(temperature * 100)),
+        NO_HUMIDITY if humidity is None else int(round(humidity * 100)),
+    )
+
+
+def encode_frames(device_ids, seqs, ts_us, temperature, humidity, light):
+    """
+    向量化編碼一批讀數（各參數為等長陣列，ts_us 可以是單一數字），回傳每筆的 bytes
+    temperature / humidity 的 NaN 與 light 的 None 代表沒有數據
+    """
+    n = len(device_ids)
+    frames = np.zeros(n, dtype=FRAME_DTYPE)
+    frames["magic"] = FRAME_MAGIC
+    frames["version"] = FRAME_VERSION
+    frames["device"] = device_ids
+    frames["seq"] = seqs
+    frames["ts_us"] = ts_us
+    temperature = np.asarray(temperature, dtype=float)
+    humidity = np.asarray(humidity, dtype=float)
+    frames["temperature"] = np.where(np.isnan(temperature), NO_TEMPERATURE,
+                                     np.round(np.nan_to_num(temperature) * 100))
+    frames["humidity"] = np.where(np.isnan(humidity), NO_HUMIDITY, np.round(np.nan_to_num(humidity) * 100))
+    known = np.array([value is not None for value in light], dtype=bool)
+    on = np.array([bool(value) for value in light], dtype=bool)
+    frames["flags"] = np.where(known, FLAG_LIGHT_KNOWN, 0) | np.where(known & on, FLAG_LIGHT_ON, 0)
+    raw = frames.tobytes()
+    return [raw[i:i + FRAME_SIZE] for i in range(0, len(raw), FRAME_SIZE)]
+
+
+def encode_summary(device_id, seq, start_us, window_ms, count, temperature=None, humidity=None):
+    """編碼一個時間窗的摘要；temperature / humidity 為 (min, mean, max)，沒有的項目傳 None"""
+    temperature = [NO_TEMPERATURE] * 3 if temperature is None else [int(round(v * 100)) for v in temperature]
+    humidity = [NO_HUMIDITY] * 3 if humidity is None else [int(round(v * 100)) for v in humidity]
+    return struct.pack(SUMMARY_FORMAT, FRAME_MAGIC, SUMMARY_VERSION, 0, device_id, seq, int(start_us),
+                       window_ms, count, *temperature, *humidity)
+
+
+def is_frame(payload):
+    """payload 是否為二進位訊框（一個或多個串接的訊框）"""
+    return (len(payload) >= FRAME_SIZE and len(payload) % FRAME_SIZE == 0
+            and payload[0] == FRAME_MAGIC and payload[1] == FRAME_VERSION)
+
+
+def is_summary(payload):
+    """payload 是否為摘要訊框（一個或多個串接的摘要）"""
+    return (len(payload) >= SUMMARY_SIZE and len(payload) % SUMMARY_SIZE == 0
+            and payload[0] == FRAME_MAGIC and payload[1] == SUMMARY_VERSION)
+
+
+def _empty(n):
+    return {
+        "message": np.zeros(n, dtype=np.int64),
+        "device": np.full(n, -1, dtype=np.int64),
+        "seq": np.full(n, -1, dtype=np.int64),
+        "sent_ns": np.full(n, np.nan),
+        "temperature": np.full(n, np.nan),
+        "humidity": np.full(n, np.nan),
+        "light": np.full(n, np.nan),  # 1 = 開、0 = 關、NaN = 未知
+    }
+
+
+def _decode_binary(payloads):
+    """一次解碼多則二進位訊息（每則可包含多個訊框）；magic 或版本不對的訊框會被略過"""
+    counts = [len(payload) // FRAME_SIZE for payload in payloads]
+    frames = np.frombuffer(b"".join(payloads), dtype=FRAME_DTYPE)
+    message = np.repeat(np.arange(len(payloads)), counts)
+    valid = (frames["magic"] == FRAME_MAGIC) & (frames["version"] == FRAME_VERSION)
+    if not valid.all():
+        frames, message = frames[valid], message[valid]
+    temperature = frames["temperature"].astype(float)
+    temperature[frames["temperature"] == NO_TEMPERATURE] = np.nan
+    humidity = frames["humidity"].astype(float)
+    humidity[frames["humidity"] == NO_HUMIDITY] = np.nan
+    flags = frames["flags"]
+    light = np.where(flags & FLAG_LIGHT_KNOWN, (flags & FLAG_LIGHT_ON) > 0, np.nan).astype(float)
+    return {
+        "message": message,
+        "device": frames["device"].astype(np.int64),
+        "seq": frames["seq"].astype(np.int64),
+        "sent_ns": frames["ts_us"] * 1e3,
+        "temperature": temperature / 100,
+        "humidity": humidity / 100,
+        "light": light,
+    }
+
+
+def _decode_json(payload, decoded, i):
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        return
+    if not isinstance(data, dict):
+        return
+    for name in ("temperature", "humidity"):
+        try:
+            decoded[name][i] = float(data[name])
+        except (KeyError, TypeError, ValueError):
+            pass
+    light = data.get("light")
+    if isinstance(light, str):
+        light = light.lower() in ("on", "1", "true", "開")
+    if light is not None:
+        decoded["light"][i] = float(bool(light))
+    try:
+        decoded["sent_ns"][i] = float(data["ts"]) * 1e6  # JSON 的 ts 為 epoch 毫秒（見 latency.py）
+    except (KeyError, TypeError, ValueError):
+        pass
+    try:
+        decoded["seq"][i] = int(data["seq"])
+    except (KeyError, TypeError, ValueError):
+        pass
+
+
+def decode_frames(payloads):
+    """
+    批次解碼一批訊框（二進位或 JSON，可以混合），回傳 {欄位: 陣列}，每個訊框一列
+    message = 該列來自第幾則 payload（一則二進位訊息可以包含多個訊框）
+    device / seq 沒有時為 -1，其餘欄位沒有時為 NaN；無法解析的 JSON 訊息所有欄位都是缺值
+    摘要訊框不在結果中（見 decode_summaries）
+    """
+    binary = [i for i, payload in enumerate(payloads) if is_frame(payload)]
+    if len(binary) == len(payloads):
+        # 常見情況：整批都是二進位訊框，一次 frombuffer 解碼
+        return _decode_binary(payloads)
+    decoded = _decode_binary([payloads[i] for i in binary])
+    decoded["message"] = np.array(binary, dtype=np.int64)[decoded["message"]]
+    others = [i for i in range(len(payloads)) if not is_frame(payloads[i]) and not is_summary(payloads[i])]
+    parsed = _empty(len(others))
+    parsed["message"] = np.array(others, dtype=np.int64)
+    for row, i in enumerate(others):
+        _decode_json(payloads[i], parsed, row)
+    # 合併後依原本的訊息順序排列
+    order = np.argsort(np.concatenate([decoded["message"], parsed["message"]]), kind="stable")
+    return {name: np.concatenate([decoded[name], parsed[name]])[order] for name in decoded}
+
+
+def decode_summaries(payloads):
+    """
+    批次解碼一批訊息中的摘要訊框（其他訊息略過），回傳 {欄位: 陣列}，每個時間窗一列
+    start_ns / end_ns = 時間窗起訖（epoch 奈秒）；temperature_min / _mean / _max、humidity_* 沒有時為 NaN
+    """
+    summary = [i for i, payload in enumerate(payloads) if is_summary(payload)]
+    frames = np.frombuffer(b"".join(payloads[i] for i in summary), dtype=SUMMARY_DTYPE)
+    counts = [len(payloads[i]) // SUMMARY_SIZE for i in summary]
+    message = np.repeat(np.array(summary, dtype=np.int64), counts)
+    valid = frames["magic"] == FRAME_MAGIC
+    if not valid.all():
+        frames, message = frames[valid], message[valid]
+    start_ns = frames["start_us"] * 1000
+    decoded = {
+        "message": message,
+        "device": frames["device"].astype(np.int64),
+        "seq": frames["seq"].astype(np.int64),
+        "start_ns": start_ns,
+        "end_ns": start_ns + frames["window_ms"].astype(np.int64) * 1_000_000,
+        "count": frames["count"].astype(np.int64),
+    }
+    temperature = frames["temperature"].astype(float)
+    temperature[frames["temperature"] == NO_TEMPERATURE] = np.nan
+    humidity = frames["humidity"].astype(float)
+    humidity[frames["humidity"] == NO_HUMIDITY] = np.nan
+    for i, stat in enumerate(SUMMARY_STATS):
+        decoded[f"temperature_{stat}"] = temperature[:, i] / 100
+        decoded[f"humidity_{stat}"] = humidity[:, i] / 100
+    return decoded